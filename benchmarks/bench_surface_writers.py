@@ -0,0 +1,63 @@
+"""Compare the native surface writers in ``ukb.surface`` with meshio.
+
+Run with ``python benchmarks/bench_surface_writers.py``. For each format, all
+eight surfaces of a random shape are written ``--repeat`` times and the
+average time per set of surfaces is reported.
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import timeit
+from pathlib import Path
+
+import meshio
+import numpy as np
+
+import ukb.surface
+
+
+def write_native(folder: Path, points: np.ndarray, suffix: str) -> None:
+    topology = ukb.surface.topology()
+    for name in ukb.surface.surfaces:
+        surface_points, triangles = topology.extract(name, points)
+        ukb.surface.write_surface(folder / f"{name}.{suffix}", surface_points, triangles)
+
+
+def write_meshio(folder: Path, points: np.ndarray, suffix: str, binary: bool) -> None:
+    topology = ukb.surface.topology()
+    for name in ukb.surface.surfaces:
+        surface_points, triangles = topology.extract(name, points)
+        mesh = meshio.Mesh(points=surface_points, cells=[("triangle", triangles.astype(np.int32))])
+        mesh.write(folder / f"{name}.{suffix}", binary=binary)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    points = np.random.default_rng(0).normal(0, 1, (5806, 3))
+    ukb.surface.topology()  # Exclude the one-time topology computation
+
+    cases = {
+        "native stl": lambda folder: write_native(folder, points, "stl"),
+        "meshio stl (ascii, previous default)": lambda folder: write_meshio(
+            folder, points, "stl", binary=False
+        ),
+        "meshio stl (binary)": lambda folder: write_meshio(folder, points, "stl", binary=True),
+        "native ply": lambda folder: write_native(folder, points, "ply"),
+        "meshio ply (binary)": lambda folder: write_meshio(folder, points, "ply", binary=True),
+        "native vtp": lambda folder: write_native(folder, points, "vtp"),
+        "native npz": lambda folder: write_native(folder, points, "npz"),
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        folder = Path(tmpdir)
+        for label, func in cases.items():
+            seconds = timeit.timeit(lambda: func(folder), number=args.repeat) / args.repeat
+            print(f"{label:40s} {1000 * seconds:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
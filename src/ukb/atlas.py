@@ -1,20 +1,33 @@
-from typing import Literal, NamedTuple, Protocol
+from __future__ import annotations
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Iterable, Iterator, Literal, NamedTuple, Protocol
 from pathlib import Path
+import hashlib
+import itertools
+import json
 import logging
-import scipy.io
-import h5py
 import numpy as np
+import numpy.typing as npt
+
+if TYPE_CHECKING:
+    import h5py
 
 logger = logging.getLogger(__name__)
 
 
 class Points(NamedTuple):
-    ED: np.ndarray
-    ES: np.ndarray
+    """End-diastolic (ED) and end-systolic (ES) points of shape ``(N, 3)``.
+    A phase that was not generated is None.
+    """
+
+    ED: np.ndarray | None
+    ES: np.ndarray | None
 
 
 unwanted_nodes = (5630, 5655, 5696, 5729)
 
+Case = Literal["ED", "ES", "both"]
+
 
 def download_atlas(outdir: Path, all: bool = False) -> Path:
     """Download the UK Biobank atlas from the Cardiac Atlas Project.
@@ -70,18 +83,51 @@ def download_atlas(outdir: Path, all: bool = False) -> Path:
     return path.with_suffix(".h5")
 
 
+def phases(case: Case) -> tuple[str, ...]:
+    """Return the phases that are part of ``case``."""
+    if case == "both":
+        return ("ED", "ES")
+    if case not in ("ED", "ES"):
+        raise ValueError(f"Unknown case {case!r}, expected 'ED', 'ES' or 'both'")
+    return (case,)
+
+
+def phase_slice(size: int, case: Case) -> slice:
+    """Return the slice of a flattened ED+ES shape vector of length ``size``
+    holding the coordinates of ``case``. The first half is ED and the
+    second half is ES.
+    """
+    if case == "both":
+        return slice(0, size)
+    N = size // 2
+    return slice(0, N) if phases(case) == ("ED",) else slice(N, size)
+
+
+def to_points(S: np.ndarray, case: Case = "both") -> Points:
+    """Split a shape vector holding the phases of ``case`` into :class:`Points`
+    and remove ``unwanted_nodes``. Phases not in ``case`` are set to None.
+    """
+    names = phases(case)
+    blocks = np.reshape(S, (len(names), -1, 3))
+    arrays = {name: np.delete(block, unwanted_nodes, axis=0) for name, block in zip(names, blocks)}
+    return Points(ED=arrays.get("ED"), ES=arrays.get("ES"))
+
+
 def generate_points(
-    filename: Path,
+    filename: Path | AtlasModel,
     mode: int = -1,
     std: float = 1.5,
     score: np.ndarray | None = None,
+    case: Case = "both",
 ) -> Points:
     """Generate points from the UK Biobank atlas.
 
     Parameters
     ----------
-    filename : Path
-        Path to the UK Biobank atlas file.
+    filename : Path | AtlasModel
+        Path to the UK Biobank atlas file, or an already loaded
+        :class:`AtlasModel`. If the atlas has been repacked (see
+        :func:`repack`) the repacked copy is used instead.
     mode : int, optional
         Mode to generate points from. If -1, generate points from the mean
         shape. If between 0 and the number of modes, generate points from
@@ -91,41 +137,49 @@ def generate_points(
     score : np.ndarray | None, optional
         PCA scores to generate points from. If None, use the mode and std
         parameters to generate points. By default None
+    case : str, optional
+        Which phase(s) to generate, ``"ED"``, ``"ES"`` or ``"both"``. Only the
+        part of the atlas belonging to the requested phase(s) is read.
+        By default "both"
 
     Returns
     -------
     Points
         Named tuple containing the end-diastolic (ED) and end-systolic (ES)
-        points.
+        points. A phase that is not part of ``case`` is None.
     """
-    logger.info(f"Generating points from {filename}")
-    with h5py.File(filename, "r") as hdf:
-        S = compute_S(hdf, mode, std, score=score)
+    if isinstance(filename, AtlasModel):
+        return filename.points(mode=mode, std=std, score=score, case=case)
 
-    # First half is ED and second half is ES
-    N = S.shape[1] // 2
+    repacked = find_repacked(filename)
+    if repacked is not None:
+        model = AtlasModel.load(repacked, cache_size=0)
+        return _writable(model.points(mode=mode, std=std, score=score, case=case))
 
-    ed = np.reshape(S[0, :N], (-1, 3))
-    es = np.reshape(S[0, N:], (-1, 3))
+    import h5py
 
-    return Points(
-        ED=np.delete(ed, unwanted_nodes, axis=0),
-        ES=np.delete(es, unwanted_nodes, axis=0),
-    )
+    logger.info(f"Generating points from {filename}")
+    with h5py.File(filename, "r") as hdf:
+        S = compute_S(hdf, mode, std, score=score, case=case)
+
+    return to_points(S, case)
 
 
 def generate_points_burns(
-    filename: Path,
+    filename: Path | AtlasModel,
     mode: int = -1,
     std: float = 1.5,
     score: np.ndarray | None = None,
+    case: Case = "both",
 ) -> Points:
     """Generate points from the Burns atlas.
 
     Parameters
     ----------
-    filename : Path
-        Path to the Burns atlas file.
+    filename : Path | AtlasModel
+        Path to the Burns atlas file, or an already loaded
+        :class:`AtlasModel`. If the atlas has been repacked (see
+        :func:`repack`) the repacked copy is used instead.
     mode : int, optional
         Mode to generate points from. If -1, generate points from the mean
         shape. If between 0 and the number of modes, generate points from
@@ -135,29 +189,35 @@ def generate_points_burns(
     score : np.ndarray | None, optional
         PCA scores to generate points from. If None, use the mode and std
         parameters to generate points. By default None
+    case : str, optional
+        Which phase(s) to generate, ``"ED"``, ``"ES"`` or ``"both"``.
+        By default "both"
 
     Returns
     -------
     Points
         Named tuple containing the end-diastolic (ED) and end-systolic (ES)
-        points.
+        points. A phase that is not part of ``case`` is None.
     """
+    if isinstance(filename, AtlasModel):
+        return filename.points(mode=mode, std=std, score=score, case=case)
+
+    repacked = find_repacked(filename)
+    if repacked is not None:
+        model = AtlasModel.load(repacked, cache_size=0)
+        return _writable(model.points(mode=mode, std=std, score=score, case=case))
+
+    import scipy.io
+
     logger.info(f"Generating points from {filename} (Burns atlas)")
 
     data = scipy.io.loadmat(filename)
 
     hdf = data["pca200"][0, 0]
 
-    S = compute_S(hdf, mode, std, score)
+    S = compute_S(hdf, mode, std, score, case=case)
 
-    N = S.shape[0] // 2
-    ed = np.reshape(S[:N, 0], (-1, 3))
-    es = np.reshape(S[N:, 0], (-1, 3))
-
-    return Points(
-        ED=np.delete(ed, unwanted_nodes, axis=0),
-        ES=np.delete(es, unwanted_nodes, axis=0),
-    )
+    return to_points(S, case)
 
 
 class AtlasFile(Protocol):
@@ -169,6 +229,7 @@ def compute_S(
     mode: int = -1,
     std: float = 1.5,
     score: np.ndarray | None = None,
+    case: Case = "both",
 ) -> np.ndarray:
     """Compute the shape matrix S from the PCA atlas.
 
@@ -185,38 +246,891 @@ def compute_S(
     score : np.ndarray | None, optional
         PCA scores to generate points from. If None, use the mode and std
         parameters to generate points. By default None
+    case : str, optional
+        Which phase(s) to compute. For ``"ED"`` or ``"ES"`` only the
+        columns of MU and COEFF belonging to that phase are read and S
+        holds only that half of the shape vector. By default "both"
     Returns
     -------
     np.ndarray
         Shape matrix S.
     """
+    MU = hdf["MU"]
+    columns = phase_slice(int(np.prod(MU.shape)), case)
+    # ukb h5 format stores MU as (N, 1), Burns format as (1, N)
+    mu = np.transpose(MU[:, columns] if MU.shape[0] == 1 else MU[columns, :])
+
+    latent = np.asarray(hdf["LATENT"]).flatten()  # works for (1, modes) and (modes, 1)
+    coeff = hdf["COEFF"]
+    ukb_format = coeff.shape[0] == latent.size  # ukb h5 format: COEFF is (modes, N)
 
     if score is None:
         logger.info(f"Using mode {mode} and std {std}")
-        mu = np.transpose(hdf["MU"])
         if mode == -1:
             S = mu
         else:
-            if mode < 0 or mode >= hdf["COEFF"].shape[0]:
+            if mode < 0 or mode >= latent.size:
                 raise ValueError(
-                    f"Mode {mode} is out of bounds. Needs to be between "
-                    f"0 and {hdf['COEFF'].shape[0] - 1}"
+                    f"Mode {mode} is out of bounds. Needs to be between 0 and {latent.size - 1}"
                 )
-            eigenvalue = hdf["LATENT"][0, mode]
-            eigenvector = hdf["COEFF"][mode, :]
-            S = np.transpose(hdf["MU"]) + (std * np.sqrt(eigenvalue) * eigenvector)
+            eigenvalue = latent[mode]
+            eigenvector = coeff[mode, columns] if ukb_format else coeff[columns, mode]
+            S = mu + (std * np.sqrt(eigenvalue) * eigenvector).reshape(mu.shape)
     else:
         num_scores = len(score)
-        latent = np.asarray(hdf["LATENT"]).flatten()[
-            :num_scores
-        ]  # works for (1, modes) and (modes, 1)
-        d = score * np.sqrt(latent)  # (num_scores,)
-        coeff = hdf["COEFF"]
-        if coeff.shape[0] == np.asarray(hdf["LATENT"]).size:  # ukb h5 format: COEFF is (modes, N)
-            eigvecs = coeff[:num_scores, :]  # (num_scores, N)
+        d = score * np.sqrt(latent[:num_scores])  # (num_scores,)
+        if ukb_format:
+            eigvecs = coeff[:num_scores, columns]  # (num_scores, N)
         else:  # Burns format: COEFF is (N, modes)
-            eigvecs = coeff[:, :num_scores].T  # (num_scores, N)
-        mu = np.transpose(hdf["MU"])
+            eigvecs = np.transpose(coeff[columns, :num_scores])  # (num_scores, N)
         S = mu + np.matmul(d, eigvecs).reshape(mu.shape)
 
     return S
+
+
+def _score_key(score: np.ndarray | None) -> str | None:
+    if score is None:
+        return None
+    score = np.ascontiguousarray(score)
+    return hashlib.sha1(str(score.dtype).encode() + score.tobytes()).hexdigest()
+
+
+class ReducedBasis(NamedTuple):
+    """Mean and eigenvectors with ``unwanted_nodes`` removed.
+
+    Both arrays are laid out as contiguous ``(phase, node, xyz)`` blocks, i.e.
+    ``mu.reshape(2, -1, 3)`` gives the ED and ES mean points and
+    ``coeff.reshape(modes, 2, -1, 3)`` the corresponding eigenvectors.
+    """
+
+    mu: np.ndarray
+    coeff: np.ndarray
+
+    @property
+    def num_nodes(self) -> int:
+        return self.mu.size // 6
+
+
+def reduced_columns(size: int) -> np.ndarray:
+    """Return the indices into a flattened ED+ES shape vector of length
+    ``size`` that remain after removing ``unwanted_nodes`` from both phases.
+    """
+    num_nodes = size // 6
+    keep = np.ones((2, num_nodes, 3), dtype=bool)
+    keep[:, list(unwanted_nodes), :] = False
+    return np.flatnonzero(keep)
+
+
+def repacked_path(filename: Path, cache_dir: Path | None = None) -> Path:
+    """Path of the repacked copy of the atlas ``filename``, see :func:`repack`.
+
+    Parameters
+    ----------
+    filename : Path
+        Path to the original atlas file.
+    cache_dir : Path | None, optional
+        Directory holding the repacked copy, by default the directory of
+        ``filename``.
+    """
+    filename = Path(filename)
+    cache_dir = filename.parent if cache_dir is None else Path(cache_dir)
+    return cache_dir / f"{filename.stem}.atlas"
+
+
+def find_repacked(filename: Path, cache_dir: Path | None = None) -> Path | None:
+    """Return the repacked copy of ``filename`` if it exists, is newer than
+    ``filename`` and holds the atlas in float64, otherwise None.
+    """
+    path = repacked_path(filename, cache_dir)
+    meta = path / "meta.json"
+    if not meta.exists():
+        return None
+    if Path(filename).exists() and meta.stat().st_mtime < Path(filename).stat().st_mtime:
+        logger.debug(f"Repacked atlas {path} is older than {filename}. Ignoring it.")
+        return None
+    dtype = json.loads(meta.read_text())["dtype"]
+    if np.dtype(dtype) != np.float64:
+        logger.warning(f"Repacked atlas {path} is stored in {dtype}, not float64. Ignoring it.")
+        return None
+    return path
+
+
+def repack(filename: Path, cache_dir: Path | None = None) -> Path:
+    """Convert a UK Biobank ``.h5`` or Burns ``.mat`` atlas to a directory of
+    ``.npy`` files that can be memory mapped.
+
+    The repacked copy stores the reduced basis of :class:`AtlasModel`, so
+    loading the atlas only maps the files instead of parsing the original
+    file. A copy next to ``filename`` is picked up automatically by
+    :func:`generate_points`, :func:`generate_points_burns` and
+    :meth:`AtlasModel.from_file`. A copy in another directory is only used
+    by :meth:`AtlasModel.from_file` when that directory is passed as its
+    ``cache_dir``.
+
+    Parameters
+    ----------
+    filename : Path
+        Path to the atlas file.
+    cache_dir : Path | None, optional
+        Directory to save the repacked copy to, by default the directory of
+        ``filename``.
+
+    Returns
+    -------
+    Path
+        Path to the repacked copy.
+    """
+    path = repacked_path(filename, cache_dir)
+    AtlasModel.from_file(filename, repacked=False).save(path)
+    return path
+
+
+class AtlasModel:
+    """PCA atlas held in memory.
+
+    The mean, eigenvectors and eigenvalues are read once when the model is
+    created, and every call to :meth:`points` is a single matrix product
+    against the in-memory arrays. Recently synthesized shapes are kept in a
+    bounded LRU cache.
+
+    The model stores the atlas with ``unwanted_nodes`` already removed, laid
+    out as contiguous ``(phase, node, xyz)`` blocks (see :class:`ReducedBasis`),
+    so synthesis is a plain matrix product with no deletion or remapping.
+
+    Parameters
+    ----------
+    mu : np.ndarray
+        Mean shape, flattened to length ``2 * 3 * N`` where the first half
+        is ED and the second half is ES.
+    coeff : np.ndarray
+        Eigenvectors, shape ``(modes, 2 * 3 * N)``.
+    latent : np.ndarray
+        Eigenvalues, length ``modes``.
+    name : str, optional
+        Name used in log messages, by default ""
+    cache_size : int, optional
+        Maximum number of shapes kept in the LRU cache. Set to 0 to
+        disable caching, by default 32
+    reduced : bool, optional
+        If True, ``mu`` and ``coeff`` already have ``unwanted_nodes``
+        removed, e.g. when loaded with :meth:`load`. By default False
+    dtype : npt.DTypeLike, optional
+        Floating point type used to store the atlas and synthesize shapes.
+        ``np.float32`` halves memory and memory bandwidth. The resulting
+        maximum absolute deviation of the mean shape from float64 is stored in
+        :attr:`precision_error`, which is NaN if ``mu`` is not given in
+        float64. By default ``np.float64``
+    """
+
+    def __init__(
+        self,
+        mu: np.ndarray,
+        coeff: np.ndarray,
+        latent: np.ndarray,
+        name: str = "",
+        cache_size: int = 32,
+        reduced: bool = False,
+        dtype: npt.DTypeLike = np.float64,
+    ) -> None:
+        self.dtype = np.dtype(dtype)
+        if self.dtype.kind != "f":
+            raise ValueError(f"dtype must be a floating point type, got {self.dtype}")
+        mu = np.asarray(mu).ravel()
+        coeff = np.asarray(coeff)
+        self.latent = np.asarray(latent, dtype=float).ravel()
+        self.name = name
+        self.cache_size = cache_size
+        self._cache: OrderedDict[tuple, Points] = OrderedDict()
+        self._regions: dict[tuple[str | None, Case], ReducedBasis] = {}
+        self._projections: dict[tuple[int, Case, float], np.ndarray] = {}
+
+        if coeff.shape != (self.latent.size, mu.size):
+            raise ValueError(
+                f"Inconsistent atlas: COEFF has shape {coeff.shape}, expected "
+                f"{(self.latent.size, mu.size)}"
+            )
+        if not reduced:
+            columns = reduced_columns(mu.size)
+            mu = mu[columns]
+            coeff = coeff[:, columns]
+        self.mu = np.ascontiguousarray(mu, dtype=self.dtype)
+        self.coeff = np.ascontiguousarray(coeff, dtype=self.dtype)
+
+        self.explained_variance = 1.0
+        self.truncation_error = 0.0
+        # Total variance and expected squared error of the modes dropped by
+        # truncate, so that truncating again is relative to the full atlas
+        self._total_variance = float(np.sum(self.latent))
+        self._dropped_squared_error = 0.0
+        # The deviation is only known if the atlas is given in float64
+        self.precision_error = (
+            float(np.max(np.abs(self.mu.astype(np.float64) - mu)))
+            if mu.dtype == np.float64
+            else float("nan")
+        )
+        if self.dtype != np.float64:
+            logger.info(
+                f"Using {self.dtype} for the atlas. Max absolute deviation of the mean "
+                f"shape from float64: {self.precision_error:.3g}"
+            )
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(name={self.name!r}, num_modes={self.num_modes})"
+
+    @classmethod
+    def from_atlas_file(cls, hdf: AtlasFile | h5py.File, **kwargs) -> AtlasModel:
+        """Create a model from an opened atlas in either the UK Biobank
+        (COEFF is ``(modes, N)``) or the Burns (COEFF is ``(N, modes)``) layout.
+        """
+        latent = np.asarray(hdf["LATENT"]).ravel()
+        coeff = np.asarray(hdf["COEFF"])
+        if coeff.shape[0] != latent.size:  # Burns format: COEFF is (N, modes)
+            coeff = coeff.T
+        return cls(mu=np.asarray(hdf["MU"]), coeff=coeff, latent=latent, **kwargs)
+
+    @classmethod
+    def from_file(
+        cls,
+        filename: Path,
+        cache_dir: Path | None = None,
+        repacked: bool = True,
+        **kwargs,
+    ) -> AtlasModel:
+        """Load a model from a UK Biobank ``.h5`` file or a Burns ``.mat`` file.
+
+        Parameters
+        ----------
+        filename : Path
+            Path to the atlas file.
+        cache_dir : Path | None, optional
+            If given, the atlas is repacked (see :func:`repack`) into this
+            directory the first time it is loaded, and memory mapped from
+            there on subsequent calls as long as it is newer than
+            ``filename``. By default None
+        repacked : bool, optional
+            If True, use a repacked copy next to ``filename`` or in
+            ``cache_dir`` when it exists. By default True
+        **kwargs
+            Passed on to :class:`AtlasModel`.
+        """
+        filename = Path(filename)
+        kwargs.setdefault("name", str(filename))
+
+        if repacked:
+            path = find_repacked(filename, cache_dir) or find_repacked(filename)
+            if path is not None:
+                return cls.load(path, **kwargs)
+
+        logger.info(f"Loading atlas from {filename}")
+        # The repacked copy is shared by all precisions, so it is always
+        # saved in float64
+        dtype = np.dtype(kwargs.pop("dtype", np.float64))
+        source_dtype = np.float64 if cache_dir is not None else dtype
+        if filename.suffix == ".mat":
+            import scipy.io
+
+            data = scipy.io.loadmat(filename)
+            model = cls.from_atlas_file(data["pca200"][0, 0], dtype=source_dtype, **kwargs)
+        else:
+            import h5py
+
+            with h5py.File(filename, "r") as hdf:
+                model = cls.from_atlas_file(hdf, dtype=source_dtype, **kwargs)
+
+        if cache_dir is not None:
+            model.save(repacked_path(filename, cache_dir))
+            if model.dtype != dtype:
+                # Convert from float64 so that precision_error is measured
+                # against the original atlas
+                model = cls(
+                    model.mu, model.coeff, model.latent, reduced=True, dtype=dtype, **kwargs
+                )
+        return model
+
+    def save(self, path: Path) -> None:
+        """Save the reduced basis and eigenvalues to a directory of ``.npy``
+        files that can be loaded with :meth:`load`.
+        """
+        logger.info(f"Saving repacked atlas to {path}")
+        path = Path(path)
+        path.mkdir(exist_ok=True, parents=True)
+        for name in ["mu", "coeff", "latent"]:
+            np.save(path / f"{name}.npy", getattr(self, name))
+        # Written last, so that an interrupted save is not picked up
+        (path / "meta.json").write_text(
+            json.dumps({"name": self.name, "dtype": str(self.dtype)}, indent=4)
+        )
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True, **kwargs) -> AtlasModel:
+        """Load a model saved with :meth:`save`.
+
+        Parameters
+        ----------
+        path : Path
+            Directory written by :meth:`save`.
+        mmap : bool, optional
+            Memory map the mean and eigenvectors instead of reading them, so
+            only the parts used for synthesis are read from disk.
+            By default True
+        **kwargs
+            Passed on to :class:`AtlasModel`.
+        """
+        logger.info(f"Loading repacked atlas from {path}")
+        path = Path(path)
+        kwargs.setdefault("name", str(path))
+        mmap_mode: Literal["r"] | None = "r" if mmap else None
+        return cls(
+            mu=np.load(path / "mu.npy", mmap_mode=mmap_mode),
+            coeff=np.load(path / "coeff.npy", mmap_mode=mmap_mode),
+            latent=np.load(path / "latent.npy"),
+            reduced=True,
+            **kwargs,
+        )
+
+    @property
+    def num_modes(self) -> int:
+        return self.latent.size
+
+    @property
+    def num_nodes(self) -> int:
+        """Number of nodes per phase, after removing ``unwanted_nodes``."""
+        return self.mu.size // 6
+
+    @property
+    def reduced(self) -> ReducedBasis:
+        """The mean and eigenvectors with ``unwanted_nodes`` removed."""
+        return ReducedBasis(mu=self.mu, coeff=self.coeff)
+
+    def truncate(
+        self,
+        variance: float | None = None,
+        rms_error: float | None = None,
+    ) -> AtlasModel:
+        """Return a model using only the leading modes of this atlas.
+
+        Exactly one of ``variance`` and ``rms_error`` must be given, and the
+        smallest number of modes satisfying it is kept. The dropped modes
+        contribute an expected squared error of
+        ``sum(latent[k:] * |coeff[k:]|**2)`` for a shape drawn from the atlas,
+        and the corresponding root mean square point distance (in the units of
+        the atlas, i.e. mm) is stored in :attr:`truncation_error` of the new
+        model, together with the fraction of variance it explains in
+        :attr:`explained_variance`. Both are relative to the full atlas, also
+        when truncating a model that is already truncated.
+
+        Parameters
+        ----------
+        variance : float | None, optional
+            Fraction of the total variance (sum of LATENT) to keep, between 0 and 1.
+        rms_error : float | None, optional
+            Largest allowed expected root mean square point error, at least 0.
+
+        Returns
+        -------
+        AtlasModel
+            Model sharing the mean and leading eigenvectors with this model.
+        """
+        if (variance is None) == (rms_error is None):
+            raise ValueError("Specify exactly one of 'variance' and 'rms_error'")
+
+        explained = np.cumsum(self.latent) / self._total_variance
+        squared_norms = np.einsum("ij,ij->i", self.coeff, self.coeff, dtype=np.float64)
+        # tail[k] is the expected squared error when keeping the first k modes
+        tail = np.append(np.cumsum((self.latent * squared_norms)[::-1])[::-1], 0.0)
+        tail += self._dropped_squared_error
+        rms = np.sqrt(tail / (2 * self.num_nodes))
+
+        if variance is not None:
+            if not 0 < variance <= 1:
+                raise ValueError(f"variance must be in (0, 1], got {variance}")
+            num_modes = int(np.searchsorted(explained, variance - 1e-12)) + 1
+        else:
+            assert rms_error is not None
+            if not rms_error >= 0:
+                raise ValueError(f"rms_error must be non-negative, got {rms_error}")
+            if not np.any(rms <= rms_error):
+                raise ValueError(
+                    f"rms_error {rms_error} cannot be met, the smallest is {rms.min():.3g}"
+                )
+            num_modes = int(np.argmax(rms <= rms_error))
+        num_modes = min(max(num_modes, 1), self.num_modes)
+
+        model = type(self)(
+            mu=self.mu,
+            coeff=self.coeff[:num_modes],
+            latent=self.latent[:num_modes],
+            name=self.name,
+            cache_size=self.cache_size,
+            reduced=True,
+            dtype=self.dtype,
+        )
+        model.precision_error = self.precision_error
+        model._total_variance = self._total_variance
+        model._dropped_squared_error = float(tail[num_modes])
+        model.explained_variance = float(explained[num_modes - 1])
+        model.truncation_error = float(rms[num_modes])
+        logger.info(
+            f"Truncated atlas to {num_modes} of {self.num_modes} modes, explaining "
+            f"{model.explained_variance:.2%} of the variance with an expected RMS "
+            f"error of {model.truncation_error:.3g}"
+        )
+        return model
+
+    def _synthesize(
+        self,
+        mu: np.ndarray,
+        coeff: np.ndarray,
+        mode: int = -1,
+        std: float = 1.5,
+        score: np.ndarray | None = None,
+    ) -> np.ndarray:
+        if score is None:
+            if mode == -1:
+                return mu
+            if mode < 0 or mode >= self.num_modes:
+                raise ValueError(
+                    f"Mode {mode} is out of bounds. Needs to be between 0 and {self.num_modes - 1}"
+                )
+            return mu + self.dtype.type(std * np.sqrt(self.latent[mode])) * coeff[mode]
+
+        score = np.asarray(score, dtype=float).ravel()
+        num_scores = score.size
+        if num_scores > self.num_modes:
+            raise ValueError(
+                f"Got {num_scores} scores, but the atlas only has {self.num_modes} modes"
+            )
+        d = (score * np.sqrt(self.latent[:num_scores])).astype(self.dtype)
+        return mu + d @ coeff[:num_scores]
+
+    def compute_S(
+        self,
+        mode: int = -1,
+        std: float = 1.5,
+        score: np.ndarray | None = None,
+        case: Case = "both",
+    ) -> np.ndarray:
+        """Compute the flattened shape vector of the phase(s) in ``case``,
+        see :func:`compute_S`. Unlike :func:`compute_S` the vector does not
+        contain ``unwanted_nodes``.
+        """
+        columns = phase_slice(self.mu.size, case)
+        return self._synthesize(
+            self.mu[columns], self.coeff[:, columns], mode=mode, std=std, score=score
+        )
+
+    def points(
+        self,
+        mode: int = -1,
+        std: float = 1.5,
+        score: np.ndarray | None = None,
+        case: Case = "both",
+    ) -> Points:
+        """Generate points from the atlas.
+
+        Parameters
+        ----------
+        mode : int, optional
+            Mode to generate points from. If -1, generate points from the mean
+            shape. If between 0 and the number of modes, generate points from
+            the specified mode. By default -1
+        std : float, optional
+            Standard deviation to scale the mode by, by default 1.5
+        score : np.ndarray | None, optional
+            PCA scores to generate points from. If None, use the mode and std
+            parameters to generate points. By default None
+        case : str, optional
+            Which phase(s) to generate, ``"ED"``, ``"ES"`` or ``"both"``.
+            By default "both"
+
+        Returns
+        -------
+        Points
+            Named tuple containing the end-diastolic (ED) and end-systolic (ES)
+            points. A phase that is not part of ``case`` is None. The arrays
+            are shared with the cache and are read-only.
+        """
+        key: tuple = (
+            (mode, std, None, case) if score is None else (None, None, _score_key(score), case)
+        )
+        if key in self._cache:
+            logger.debug(f"Using cached shape for {key}")
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        if score is None:
+            logger.info(f"Using mode {mode} and std {std}")
+        points = _split_phases(self.compute_S(mode=mode, std=std, score=score, case=case), case)
+        for array in points:
+            if array is not None:
+                array.flags.writeable = False
+
+        if self.cache_size > 0:
+            self._cache[key] = points
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return points
+
+    def clear_cache(self) -> None:
+        """Remove all shapes from the LRU cache."""
+        self._cache.clear()
+
+    def region(self, nodes: np.ndarray, case: Case = "both") -> ReducedBasis:
+        """Mean and eigenvectors restricted to the given nodes.
+
+        The columns are gathered on the first call for a given set of nodes
+        and phase(s) and cached on the model, so the arrays are read-only.
+
+        Parameters
+        ----------
+        nodes : np.ndarray
+            Node indices into the points returned by :meth:`points`, i.e.
+            after ``unwanted_nodes`` have been removed.
+        case : str, optional
+            Which phase(s) to include, by default "both"
+        """
+        nodes = np.asarray(nodes, dtype=int)
+        key = (_score_key(nodes), case)
+        if key not in self._regions:
+            xyz = (nodes[:, None] * 3 + np.arange(3)).ravel()
+            offsets = {"ED": 0, "ES": 3 * self.num_nodes}
+            columns = np.concatenate([offsets[phase] + xyz for phase in phases(case)])
+            basis = ReducedBasis(
+                mu=self.mu[columns], coeff=np.ascontiguousarray(self.coeff[:, columns])
+            )
+            for array in basis:
+                array.flags.writeable = False
+            self._regions[key] = basis
+        return self._regions[key]
+
+    def points_at(
+        self,
+        nodes: np.ndarray,
+        mode: int = -1,
+        std: float = 1.5,
+        score: np.ndarray | None = None,
+        case: Case = "both",
+    ) -> Points:
+        """Generate only the given nodes of a shape.
+
+        The cost per shape scales with the number of nodes rather than the
+        size of the atlas, see :meth:`region`.
+
+        Parameters
+        ----------
+        nodes : np.ndarray
+            Node indices into the points returned by :meth:`points`.
+        mode : int, optional
+            Mode to generate points from, by default -1
+        std : float, optional
+            Standard deviation to scale the mode by, by default 1.5
+        score : np.ndarray | None, optional
+            PCA scores to generate points from, by default None
+        case : str, optional
+            Which phase(s) to generate, by default "both"
+
+        Returns
+        -------
+        Points
+            Points of shape ``(len(nodes), 3)`` where row ``i`` is node
+            ``nodes[i]``. A phase that is not part of ``case`` is None. Like
+            :meth:`points`, the arrays are read-only since the mean shape is
+            shared with the cached region.
+        """
+        basis = self.region(nodes, case=case)
+        S = self._synthesize(basis.mu, basis.coeff, mode=mode, std=std, score=score)
+        points = _split_phases(S, case)
+        for array in points:
+            if array is not None:
+                array.flags.writeable = False
+        return points
+
+    def projection_matrix(
+        self,
+        n_modes: int | None = None,
+        case: Case = "both",
+        regularization: float = 0.0,
+    ) -> np.ndarray:
+        """Matrix mapping a centered shape vector to PCA scores.
+
+        With ``A = sqrt(latent[:k, None]) * coeff[:k]`` restricted to the
+        columns of ``case``, the scores of a shape ``x`` minimize
+        ``|x - mu - z @ A|**2 + regularization * |z|**2``, i.e.
+        ``z = (x - mu) @ A.T @ pinv(A @ A.T + regularization * I)``. The
+        matrix is computed once per set of arguments and cached on the model.
+
+        Parameters
+        ----------
+        n_modes : int | None, optional
+            Number of modes to fit, by default all modes.
+        case : str, optional
+            Which phase(s) the shapes contain, by default "both"
+        regularization : float, optional
+            Weight of the penalty on the scores, by default 0.0
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape ``(P * N * 3, n_modes)``.
+        """
+        n_modes = self.num_modes if n_modes is None else n_modes
+        if not 0 < n_modes <= self.num_modes:
+            raise ValueError(f"n_modes must be between 1 and {self.num_modes}, got {n_modes}")
+        key = (n_modes, case, float(regularization))
+        if key not in self._projections:
+            columns = phase_slice(self.mu.size, case)
+            A = np.sqrt(self.latent[:n_modes, None]) * self.coeff[:n_modes, columns]
+            G = A @ A.T + regularization * np.eye(n_modes)
+            self._projections[key] = np.ascontiguousarray(
+                (np.linalg.pinv(G, hermitian=True) @ A).T, dtype=self.dtype
+            )
+        return self._projections[key]
+
+    def points_batch(
+        self,
+        scores: np.ndarray,
+        chunk_size: int | None = None,
+        case: Case = "both",
+    ) -> np.ndarray:
+        """Generate points for many score vectors, see :func:`generate_points_batch`."""
+        scores = np.atleast_2d(np.asarray(scores, dtype=float))
+        K, num_scores = scores.shape
+        if num_scores > self.num_modes:
+            raise ValueError(
+                f"Got {num_scores} scores, but the atlas only has {self.num_modes} modes"
+            )
+        columns = phase_slice(self.mu.size, case)
+        mu = self.mu[columns]
+        eigvecs = self.coeff[:num_scores, columns]
+        d = (scores * np.sqrt(self.latent[:num_scores])).astype(self.dtype)
+
+        out = np.empty((K, len(phases(case)), self.num_nodes, 3), dtype=self.dtype)
+        flat = out.reshape(K, -1)
+        chunk_size = chunk_size or K
+        for start in range(0, K, chunk_size):
+            stop = min(start + chunk_size, K)
+            np.matmul(d[start:stop], eigvecs, out=flat[start:stop])
+            flat[start:stop] += mu
+        return out
+
+
+class Projection(NamedTuple):
+    """Result of :func:`project_points`.
+
+    ``scores`` are the PCA scores of shape ``(K, n_modes)`` and ``residuals``
+    the root mean square distance between the input points and the shape
+    generated from the scores, of shape ``(K,)``. For a single shape the
+    leading dimension is dropped.
+    """
+
+    scores: np.ndarray
+    residuals: np.ndarray
+
+
+def project_points(
+    model: AtlasModel,
+    points: Points | np.ndarray,
+    n_modes: int | None = None,
+    case: Case = "both",
+    regularization: float = 0.0,
+) -> Projection:
+    """Fit PCA scores to one or many point sets, the inverse of :func:`compute_S`.
+
+    All shapes are fitted with one matrix product against the cached
+    projection matrix of the model, see :meth:`AtlasModel.projection_matrix`.
+
+    Parameters
+    ----------
+    model : AtlasModel
+        The loaded atlas.
+    points : Points | np.ndarray
+        Points in the node ordering returned by :func:`generate_points`. Either
+        a :class:`Points` object, or an array of shape ``(P, N, 3)`` or
+        ``(K, P, N, 3)`` where ``P`` is the number of phases in ``case``. For a
+        single phase, ``(N, 3)`` and ``(K, N, 3)`` are also accepted. Arrays
+        that still contain ``unwanted_nodes`` (i.e. with ``N + 4`` nodes) are
+        also accepted.
+    n_modes : int | None, optional
+        Number of modes to fit, by default all modes.
+    case : str, optional
+        Which phase(s) the points contain, by default "both"
+    regularization : float, optional
+        Weight of the penalty on the scores. Use a positive value to pull the
+        scores of noisy or partial geometries towards the mean, by default 0.0
+
+    Returns
+    -------
+    Projection
+        Fitted scores and residuals.
+    """
+    names = phases(case)
+    if isinstance(points, Points):
+        missing = [name for name in names if getattr(points, name) is None]
+        if missing:
+            raise ValueError(f"Points are missing phase(s) {missing} required for case {case!r}")
+        array = np.stack([getattr(points, name) for name in names])
+    else:
+        array = np.asarray(points)
+
+    if array.shape[-2] == model.num_nodes + len(unwanted_nodes):
+        array = np.delete(array, unwanted_nodes, axis=-2)
+    # One phase may be given without a phase axis, and a batch of shapes has
+    # the phases on the second axis
+    num_phases = len(names)
+    valid = array.shape[-2:] == (model.num_nodes, 3) and (
+        (array.ndim == 2 and num_phases == 1)
+        or (array.ndim == 3 and (num_phases == 1 or array.shape[0] == num_phases))
+        or (array.ndim == 4 and array.shape[1] == num_phases)
+    )
+    size = num_phases * model.num_nodes * 3
+    if not valid:
+        raise ValueError(
+            f"Cannot fit points of shape {array.shape} to the {case!r} phase(s) "
+            f"of an atlas with {model.num_nodes} nodes"
+        )
+    single = array.size == size
+    X = array.reshape(-1, size)
+
+    columns = phase_slice(model.mu.size, case)
+    P = model.projection_matrix(n_modes=n_modes, case=case, regularization=regularization)
+    n_modes = P.shape[1]
+    scores = (X - model.mu[columns]) @ P
+
+    fitted = (
+        model.mu[columns]
+        + (scores * np.sqrt(model.latent[:n_modes])).astype(model.dtype)
+        @ model.coeff[:n_modes, columns]
+    )
+    residuals = np.sqrt(np.mean(np.sum((X - fitted).reshape(len(X), -1, 3) ** 2, axis=-1), axis=1))
+
+    if single:
+        return Projection(scores=scores[0], residuals=residuals[0])
+    return Projection(scores=scores, residuals=residuals)
+
+
+def read_scores(path: Path, chunk_size: int = 256) -> Iterator[np.ndarray]:
+    """Read PCA scores from a file in chunks of at most ``chunk_size`` rows.
+
+    Parameters
+    ----------
+    path : Path
+        A ``.npy`` file with an array of shape ``(K, M)``, which is memory
+        mapped, or a text file (e.g. ``.csv`` or ``.tsv``) with one score vector
+        per line. Lines starting with ``#`` are ignored.
+    chunk_size : int, optional
+        Maximum number of rows per chunk, by default 256
+
+    Yields
+    ------
+    np.ndarray
+        Scores of shape ``(k, M)`` with ``k <= chunk_size``.
+    """
+    path = Path(path)
+    if path.suffix == ".npy":
+        scores = np.load(path, mmap_mode="r")
+        for start in range(0, len(scores), chunk_size):
+            yield np.atleast_2d(np.asarray(scores[start : start + chunk_size], dtype=float))
+        return
+
+    delimiter = "," if path.suffix == ".csv" else None
+    with path.open() as f:
+        lines = (line for line in f if line.strip() and not line.lstrip().startswith("#"))
+        while chunk := list(itertools.islice(lines, chunk_size)):
+            yield np.loadtxt(chunk, delimiter=delimiter, ndmin=2)
+
+
+def iter_points(
+    model_or_file: AtlasModel | Path,
+    scores: np.ndarray | Path,
+    chunk_size: int = 256,
+    case: Case = "both",
+) -> Iterator[Points]:
+    """Generate points for a large number of score vectors lazily.
+
+    Scores are processed ``chunk_size`` rows at a time with one matrix product
+    per chunk (see :func:`generate_points_batch`), so memory use does not
+    depend on the number of score vectors.
+
+    Parameters
+    ----------
+    model_or_file : AtlasModel | Path
+        Loaded atlas, or path to a UK Biobank ``.h5`` or Burns ``.mat`` file.
+    scores : np.ndarray | Path
+        Array of shape ``(K, M)``, or a file read with :func:`read_scores`.
+    chunk_size : int, optional
+        Number of shapes to synthesize per matrix product, by default 256
+    case : str, optional
+        Which phase(s) to generate, by default "both"
+
+    Yields
+    ------
+    Points
+        The points of each score vector, in order. A phase that is not part
+        of ``case`` is None.
+    """
+    if not isinstance(model_or_file, AtlasModel):
+        model_or_file = AtlasModel.from_file(model_or_file)
+
+    if isinstance(scores, (str, Path)):
+        chunks: Iterable[np.ndarray] = read_scores(Path(scores), chunk_size=chunk_size)
+    else:
+        scores = np.atleast_2d(scores)
+        chunks = (scores[start : start + chunk_size] for start in range(0, len(scores), chunk_size))
+
+    names = phases(case)
+    for chunk in chunks:
+        for shape in model_or_file.points_batch(chunk, case=case):
+            arrays = dict(zip(names, shape))
+            yield Points(ED=arrays.get("ED"), ES=arrays.get("ES"))
+
+
+def _writable(points: Points) -> Points:
+    return Points(*(None if array is None else np.array(array) for array in points))
+
+
+def _split_phases(S: np.ndarray, case: Case) -> Points:
+    names = phases(case)
+    arrays = dict(zip(names, np.reshape(S, (len(names), -1, 3))))
+    return Points(ED=arrays.get("ED"), ES=arrays.get("ES"))
+
+
+def generate_points_batch(
+    model_or_file: AtlasModel | Path,
+    scores: np.ndarray,
+    chunk_size: int | None = None,
+    case: Case = "both",
+    dtype: npt.DTypeLike = np.float64,
+) -> np.ndarray:
+    """Generate points for many PCA score vectors at once.
+
+    All shapes are synthesized with a single matrix product against the
+    eigenvectors with ``unwanted_nodes`` already removed.
+
+    Parameters
+    ----------
+    model_or_file : AtlasModel | Path
+        Loaded atlas, or path to a UK Biobank ``.h5`` or Burns ``.mat`` file.
+    scores : np.ndarray
+        PCA scores of shape ``(K, M)`` where ``M`` is at most the number of
+        modes in the atlas.
+    chunk_size : int | None, optional
+        Number of shapes to synthesize per matrix product. Use this to bound
+        the size of the temporaries for very large ``K``. By default all
+        shapes are computed in one product.
+    case : str, optional
+        Which phase(s) to generate, ``"ED"``, ``"ES"`` or ``"both"``.
+        By default "both"
+    dtype : npt.DTypeLike, optional
+        Floating point type used when loading the atlas from a file, see
+        :class:`AtlasModel`. Ignored if a model is passed. By default ``np.float64``
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape ``(K, P, N, 3)`` where ``P`` is the number of phases in
+        ``case``. For ``"both"`` index 0 and 1 along the second axis are the
+        ED and ES points respectively.
+    """
+    if not isinstance(model_or_file, AtlasModel):
+        model_or_file = AtlasModel.from_file(model_or_file, dtype=dtype)
+    return model_or_file.points_batch(scores, chunk_size=chunk_size, case=case)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Sequence
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Bump when a change in the meshing code changes the generated meshes, so
+# that old cache entries are not used
+CACHE_VERSION = 1
+
+
+def _update_hash(h: Any, path: Path) -> None:
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+
+def file_hash(path: Path) -> str:
+    """SHA-256 hex digest of the content of a file."""
+    h = hashlib.sha256()
+    _update_hash(h, path)
+    return h.hexdigest()
+
+
+def default_cache_dir() -> Path:
+    """Directory of the mesh cache, ``$UKB_CACHE_DIR/meshes`` or
+    ``~/.ukb/meshes`` if ``UKB_CACHE_DIR`` is not set."""
+    return Path(os.environ.get("UKB_CACHE_DIR", Path.home() / ".ukb")) / "meshes"
+
+
+class MeshCache:
+    """Content-addressed cache of mesh files.
+
+    Meshes are stored under a key computed from the content of the input
+    files and the meshing options, so meshing the same surfaces with the same
+    options again is a file copy. When the cache grows beyond ``max_size``
+    bytes, the least recently used meshes are removed.
+
+    Parameters
+    ----------
+    directory : Path | None, optional
+        Cache directory, by default :func:`default_cache_dir`
+    max_size : int, optional
+        Maximum total size of the cached meshes in bytes, by default 2 GiB
+    """
+
+    def __init__(self, directory: Path | None = None, max_size: int = 2 * 1024**3) -> None:
+        self.directory = Path(directory) if directory is not None else default_cache_dir()
+        self.max_size = max_size
+
+    def key(self, inputs: Sequence[Path], **options: Any) -> str:
+        """Compute the cache key of a mesh.
+
+        Parameters
+        ----------
+        inputs : Sequence[Path]
+            Files the mesh is created from. Only their content is used, not
+            their names or modification times.
+        options
+            Meshing options, must be JSON serializable
+
+        Returns
+        -------
+        str
+            The key
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps({"version": CACHE_VERSION, **options}, sort_keys=True).encode())
+        for path in inputs:
+            _update_hash(h, path)
+        return h.hexdigest()
+
+    def path(self, key: str, suffix: str = ".msh") -> Path:
+        """Path of the cache entry ``key``."""
+        return self.directory / f"{key}{suffix}"
+
+    def get(self, key: str, outfile: Path) -> bool:
+        """Copy the cached mesh ``key`` to ``outfile`` if it exists.
+
+        The mesh is hard linked if possible and copied otherwise.
+
+        Returns
+        -------
+        bool
+            True if the mesh was in the cache
+        """
+        entry = self.path(key, outfile.suffix)
+        if not entry.exists():
+            return False
+        # Mark the entry as recently used
+        os.utime(entry)
+        outfile.unlink(missing_ok=True)
+        try:
+            os.link(entry, outfile)
+        except OSError:
+            shutil.copyfile(entry, outfile)
+        logger.info(f"Using cached mesh {entry}")
+        return True
+
+    def put(self, key: str, path: Path) -> None:
+        """Store the mesh ``path`` under ``key`` and evict old entries."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that concurrent readers never see
+        # a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, self.path(key, path.suffix))
+        logger.debug(f"Stored {path} in mesh cache as {key}")
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the total size is at
+        most ``max_size``."""
+        entries = []
+        for entry in self.directory.glob("*.msh"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_size:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+            logger.debug(f"Evicted {entry} from mesh cache")
@@ -4,7 +4,7 @@ from typing import Sequence
 import logging
 import argparse
 
-from . import surface, mesh, clip, pointcloud
+from . import surface, mesh, clip, pointcloud, repack, run
 
 
 def get_parser() -> argparse.ArgumentParser:
@@ -43,6 +43,18 @@ def get_parser() -> argparse.ArgumentParser:
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
     pointcloud.add_parser_arguments(points_parser)
+    repack_parser = subparsers.add_parser(
+        "repack",
+        help="Convert the atlas to a fast, memory mappable format",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    repack.add_parser_arguments(repack_parser)
+    run_parser = subparsers.add_parser(
+        "run",
+        help="Run the surf, clip and mesh steps in one process, skipping up to date steps",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    run.add_parser_arguments(run_parser)
 
     return parser
 
@@ -69,6 +81,10 @@ def dispatch(parser: argparse.ArgumentParser, argv: Sequence[str] | None = None)
         mesh.main(**args)
     elif command == "points":
         pointcloud.main(**args)
+    elif command == "repack":
+        repack.main(**args)
+    elif command == "run":
+        run.main(**args)
     else:
         parser.error(f"Unknown command {command}")
     return 0
@@ -1,8 +1,14 @@
+from __future__ import annotations
 from argparse import ArgumentParser
 from pathlib import Path
-from typing import Literal
+from typing import Any, Literal, NamedTuple, Sequence
 import logging
 
+import numpy as np
+
+from . import atlas, surface
+from .smooth import LaplacianSmoothing, Weights
+
 logger = logging.getLogger(__name__)
 
 
@@ -89,6 +95,27 @@ def add_parser_arguments(parser: ArgumentParser) -> None:
         default=0.1,
         help="Relaxation factor to smooth the RV surface.",
     )
+    parser.add_argument(
+        "-sw",
+        "--smooth-weights",
+        choices=["uniform", "cotangent"],
+        default="uniform",
+        help="Weights of the neighbors when smoothing the RV surface.",
+    )
+    parser.add_argument(
+        "--auto-plane",
+        action="store_true",
+        help=(
+            "Fit the clipping plane to the valve nodes of each shape instead of "
+            "using the origin and normal."
+        ),
+    )
+    parser.add_argument(
+        "--plane-offset",
+        type=float,
+        default=0.0,
+        help="Distance to move the fitted clipping plane towards the apex.",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -105,6 +132,520 @@ def default_normal() -> tuple[float, float, float]:
     return -0.7160843664428893, 0.544394641424108, 0.4368725838557541
 
 
+def fit_plane(points: np.ndarray, offset: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+    """Fit planes to point sets in the least-squares sense.
+
+    The normals are oriented like :func:`default_normal`, i.e. away from the
+    apex, so that clipping keeps the ventricles.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Points of shape ``(K, 3)``, or a batch of point sets of shape
+        ``(..., K, 3)``
+    offset : float, optional
+        Distance to move the planes towards the apex, by default 0.0.
+        A positive offset clips more of the base.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Origins and unit normals of the planes, of shape ``(..., 3)``
+    """
+    points = np.asarray(points, dtype=np.float64)
+    centroid = points.mean(axis=-2)
+    centered = points - centroid[..., None, :]
+    # The normal is the direction of least variance of the points
+    scatter = np.einsum("...ki,...kj->...ij", centered, centered)
+    _, vectors = np.linalg.eigh(scatter)
+    normal = vectors[..., :, 0]
+    normal = normal * np.where(normal @ np.asarray(default_normal()) < 0, -1.0, 1.0)[..., None]
+    return centroid - offset * normal, normal
+
+
+def base_plane(
+    points: np.ndarray, offset: float = 0.0, names: Sequence[str] = surface.valves
+) -> tuple[np.ndarray, np.ndarray]:
+    """Fit the base plane of shapes to the nodes of the triangles of their
+    valves.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Post-deletion points of a shape, of shape ``(N, 3)``, or of many
+        shapes, of shape ``(B, N, 3)``
+    offset : float, optional
+        Distance to move the plane towards the apex, by default 0.0
+    names : Sequence[str], optional
+        Surfaces whose nodes the plane is fitted to, by default the valves
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Origin and unit normal of the plane of each shape, of shape ``(3,)``
+        or ``(B, 3)``
+    """
+    top = surface.topology()
+    nodes = np.unique(np.concatenate([top.global_triangles(name) for name in names]))
+    return fit_plane(np.asarray(points)[..., nodes, :], offset=offset)
+
+
+class ClippedSurface(NamedTuple):
+    """Output of :func:`clip_plane`.
+
+    Attributes
+    ----------
+    points : np.ndarray
+        Points of shape ``(N, 3)``
+    triangles : np.ndarray
+        Triangles of shape ``(M, 3)`` given as indices into ``points``
+    boundary : list[np.ndarray]
+        Ordered point indices of each curve where the surface was cut by the
+        plane. Closed loops do not repeat their first point, and curves
+        only share points where the plane touches the surface at a vertex.
+    """
+
+    points: np.ndarray
+    triangles: np.ndarray
+    boundary: list[np.ndarray]
+
+
+def _rotate(triangles: np.ndarray, first: np.ndarray) -> np.ndarray:
+    """Rotate each triangle so that the vertex flagged in ``first`` (one per
+    row) comes first, keeping the orientation."""
+    shift = np.argmax(first, axis=1)
+    order = (shift[:, None] + np.arange(3)) % 3
+    return np.take_along_axis(triangles, order, axis=1)
+
+
+def _chain(start: np.ndarray, end: np.ndarray) -> list[np.ndarray]:
+    """Chain directed edges into ordered paths and loops.
+
+    Every edge is used once. Where several edges leave the same point, e.g.
+    where the plane touches the surface at a single vertex, the point is
+    shared by several curves.
+    """
+    following: dict[int, list[int]] = {}
+    for a, b in zip(start.tolist(), end.tolist()):
+        following.setdefault(a, []).append(b)
+    incoming = dict(zip(*np.unique(end, return_counts=True)))
+    # Open paths start at points with more outgoing than incoming edges
+    heads = [p for p, ends in following.items() if len(ends) > incoming.get(p, 0)]
+    curves = []
+    for head in heads + list(following):
+        while following[head]:
+            curve = [head]
+            node = following[head].pop()
+            while node != head:
+                curve.append(node)
+                if not following.get(node):
+                    break
+                node = following[node].pop()
+            curves.append(np.array(curve))
+    return curves
+
+
+def clip_plane(
+    points: np.ndarray,
+    triangles: np.ndarray,
+    origin: Sequence[float],
+    normal: Sequence[float],
+) -> ClippedSurface:
+    """Clip a triangle surface with a plane.
+
+    The part of the surface on the opposite side of ``normal`` is kept.
+    Triangles crossing the plane are split at the plane, and the new points
+    are shared between neighboring triangles.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Points of shape ``(N, 3)``
+    triangles : np.ndarray
+        Triangles of shape ``(M, 3)`` given as indices into ``points``
+    origin : Sequence[float]
+        Origin of the clipping plane
+    normal : Sequence[float]
+        Normal of the clipping plane
+
+    Returns
+    -------
+    ClippedSurface
+        The clipped surface and the curves where it was cut. Only the points
+        used by the clipped triangles are kept.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    n = np.asarray(normal, dtype=np.float64)
+    distance = (points - np.asarray(origin, dtype=np.float64)) @ (n / np.linalg.norm(n))
+    return _clip_distance(points, np.asarray(triangles, dtype=np.int64), distance)
+
+
+def _clip_distance(
+    points: np.ndarray, triangles: np.ndarray, distance: np.ndarray
+) -> ClippedSurface:
+    """Clip a surface given the signed distance of its points to the plane,
+    see :func:`clip_plane`."""
+    inside = distance <= 0
+    count = inside[triangles].sum(axis=1)
+
+    # Triangles with one vertex inside start with that vertex, and triangles
+    # with two vertices inside start with the vertex outside
+    one = _rotate(triangles[count == 1], inside[triangles[count == 1]])
+    two = _rotate(triangles[count == 2], ~inside[triangles[count == 2]])
+
+    # Crossing edges as (inside, outside) pairs. The intersection points are
+    # shared by the two triangles of each edge.
+    edges = np.concatenate([one[:, [0, 1]], one[:, [0, 2]], two[:, [1, 0]], two[:, [2, 0]]])
+    keys, inverse = np.unique(edges[:, 0] * len(points) + edges[:, 1], return_inverse=True)
+    edges = np.column_stack([keys // len(points), keys % len(points)])
+    d_in, d_out = distance[edges[:, 0]], distance[edges[:, 1]]
+    t = d_in / (d_in - d_out)
+    p_in, p_out = points[edges[:, 0]], points[edges[:, 1]]
+    new_points = p_in + t[:, None] * (p_out - p_in)
+    # Points on the plane are used instead of duplicating them
+    cut = np.where(d_in == 0, edges[:, 0], len(points) + np.arange(len(edges)))
+
+    n1, n2 = len(one), len(two)
+    p01, p02 = cut[inverse[:n1]], cut[inverse[n1 : 2 * n1]]
+    p10, p20 = cut[inverse[2 * n1 : 2 * n1 + n2]], cut[inverse[2 * n1 + n2 :]]
+    all_triangles = np.concatenate(
+        [
+            triangles[count == 3],
+            np.column_stack([one[:, 0], p01, p02]),
+            np.column_stack([two[:, 1], two[:, 2], p20]),
+            np.column_stack([two[:, 1], p20, p10]),
+        ]
+    )
+    degenerate = (
+        (all_triangles[:, 0] == all_triangles[:, 1])
+        | (all_triangles[:, 1] == all_triangles[:, 2])
+        | (all_triangles[:, 2] == all_triangles[:, 0])
+    )
+    all_triangles = all_triangles[~degenerate]
+
+    # Keep only the used points
+    used, local = np.unique(all_triangles, return_inverse=True)
+    lookup = np.full(len(points) + len(edges), -1)
+    lookup[used] = np.arange(len(used))
+
+    # The cut edges follow the orientation of the clipped triangles
+    start = np.concatenate([p01, p20])
+    end = np.concatenate([p02, p10])
+    valid = start != end
+    boundary = _chain(lookup[start[valid]], lookup[end[valid]])
+
+    return ClippedSurface(
+        points=np.concatenate([points, new_points])[used],
+        triangles=local.reshape(-1, 3),
+        boundary=boundary,
+    )
+
+
+Surface = tuple[np.ndarray, np.ndarray]
+
+
+def clip_surfaces(
+    lv: Surface,
+    rv_sept: Surface,
+    rv_fw: Surface,
+    epi: Surface,
+    origin: Sequence[float],
+    normal: Sequence[float],
+    smooth: bool = True,
+    smooth_iter: int = 100,
+    smooth_relaxation: float = 0.1,
+    smooth_weights: Weights = "uniform",
+    smoothing: LaplacianSmoothing | None = None,
+) -> dict[str, ClippedSurface]:
+    """Clip the LV, RV and EPI surfaces with a plane.
+
+    The part of the surfaces on the opposite side of ``normal`` is kept, see
+    :func:`clip_plane`.
+
+    Parameters
+    ----------
+    lv : tuple[np.ndarray, np.ndarray]
+        Points and triangles of the LV surface
+    rv_sept : tuple[np.ndarray, np.ndarray]
+        Points and triangles of the RV septum surface
+    rv_fw : tuple[np.ndarray, np.ndarray]
+        Points and triangles of the RV free wall surface
+    epi : tuple[np.ndarray, np.ndarray]
+        Points and triangles of the epicardial surface
+    origin : Sequence[float]
+        Origin of the clipping plane
+    normal : Sequence[float]
+        Normal of the clipping plane
+    smooth : bool, optional
+        Smooth the RV surface. The default is True.
+    smooth_iter : int, optional
+        Number of iterations to smooth the RV surface. The default is 100.
+    smooth_relaxation : float, optional
+        Relaxation factor to smooth the RV surface. The default is 0.1.
+    smooth_weights : Literal["uniform", "cotangent"], optional
+        Weights of the neighbors when smoothing the RV surface. The default
+        is "uniform".
+    smoothing : LaplacianSmoothing | None, optional
+        Precomputed smoothing operator of the merged RV surface, e.g. to
+        smooth many shapes with the same topology. If given, it is used
+        instead of ``smooth_iter``, ``smooth_relaxation`` and
+        ``smooth_weights``.
+
+    Returns
+    -------
+    dict[str, ClippedSurface]
+        The clipped surfaces with keys "lv", "rv" and "epi"
+    """
+    logger.info("Merging RV and RVFW")
+    rv_points, rv_parts = surface.merge_points({"RV": rv_sept, "RVFW": rv_fw})
+    rv_triangles = np.concatenate(list(rv_parts.values()))
+    if smooth:
+        logger.info("Smoothing RV")
+        if smoothing is None:
+            smoothing = LaplacianSmoothing.compute(
+                rv_triangles,
+                len(rv_points),
+                n_iter=smooth_iter,
+                relaxation=smooth_relaxation,
+                weights=smooth_weights,
+                reference=rv_points,
+            )
+        rv_points = smoothing(rv_points)
+
+    return {
+        "lv": clip_plane(*lv, origin=origin, normal=normal),
+        "rv": clip_plane(rv_points, rv_triangles, origin=origin, normal=normal),
+        "epi": clip_plane(*epi, origin=origin, normal=normal),
+    }
+
+
+def clip_shapes(
+    points: np.ndarray,
+    origins: np.ndarray,
+    normals: np.ndarray,
+    smooth: bool = True,
+    smooth_iter: int = 100,
+    smooth_relaxation: float = 0.1,
+    smooth_weights: Weights = "uniform",
+    outfile: Path | None = None,
+    per_shape: bool | None = None,
+) -> list[list[dict[str, ClippedSurface]]]:
+    """Clip the LV, RV and EPI surfaces of many shapes with many planes.
+
+    All shapes share the atlas topology, so the surfaces are taken from the
+    same triangles, the RV of all shapes is smoothed in one batch and the
+    distances of all points to all planes are computed at once.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Post-deletion points of the shapes, of shape ``(B, N, 3)``, or of a
+        single shape, of shape ``(N, 3)``
+    origins : np.ndarray
+        Origins of the clipping planes, of shape ``(P, 3)`` for the same
+        planes for all shapes, ``(B, 3)`` for one plane per shape, e.g. from
+        :func:`base_plane`, or ``(B, P, 3)`` for different planes for each
+        shape
+    normals : np.ndarray
+        Normals of the clipping planes, of the same shape as ``origins``
+    smooth : bool, optional
+        Smooth the RV surfaces, by default True
+    smooth_iter : int, optional
+        Number of iterations to smooth the RV surfaces, by default 100
+    smooth_relaxation : float, optional
+        Relaxation factor to smooth the RV surfaces, by default 0.1
+    smooth_weights : Literal["uniform", "cotangent"], optional
+        Weights of the neighbors when smoothing the RV surfaces, by default
+        "uniform". The cotangent weights and the fixed boundary corners are
+        taken from the mean of the shapes.
+    outfile : Path | None, optional
+        Write the clipped surfaces to this file with
+        :func:`write_clipped_container`, by default None
+    per_shape : bool | None, optional
+        Whether two-dimensional ``origins`` and ``normals`` hold one plane per
+        shape (True) or planes shared by all shapes (False). By default None,
+        which means one plane per shape if there is one row per shape.
+
+    Returns
+    -------
+    list[list[dict[str, ClippedSurface]]]
+        The clipped "lv", "rv" and "epi" surfaces of each shape and plane,
+        indexed as ``clipped[shape][plane][name]``
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim == 2:
+        points = points[None]
+    origins = np.asarray(origins, dtype=np.float64)
+    normals = np.asarray(normals, dtype=np.float64)
+    if origins.shape != normals.shape:
+        raise ValueError(f"Origins of shape {origins.shape} and normals of shape {normals.shape}")
+    if origins.ndim == 2:
+        if per_shape is None:
+            per_shape = len(origins) == len(points)
+        if per_shape and len(origins) != len(points):
+            raise ValueError(f"Expected one plane for each of the {len(points)} shapes")
+        # Shape (B, 1, 3) for one plane per shape, else (1, P, 3)
+        origins, normals = (a[:, None] if per_shape else a[None] for a in (origins, normals))
+    elif origins.ndim == 1:
+        origins, normals = origins[None, None], normals[None, None]
+    origins = np.broadcast_to(origins, (len(points),) + origins.shape[1:])
+    normals = np.broadcast_to(normals, origins.shape)
+    normals = normals / np.linalg.norm(normals, axis=-1, keepdims=True)
+    offsets = np.einsum("bpi,bpi->bp", origins, normals)
+
+    top = surface.topology()
+    global_triangles = {
+        "lv": top.global_triangles("LV"),
+        "rv": np.concatenate([top.global_triangles("RV"), top.global_triangles("RVFW")]),
+        "epi": top.global_triangles("EPI"),
+    }
+    clipped: list[list[dict[str, ClippedSurface]]] = [
+        [{} for _ in range(origins.shape[1])] for _ in range(len(points))
+    ]
+    for name, triangles in global_triangles.items():
+        nodes, local = np.unique(triangles, return_inverse=True)
+        local = local.reshape(-1, 3)
+        surface_points = points[:, nodes]
+        if name == "rv" and smooth:
+            logger.info(f"Smoothing RV of {len(points)} shape(s)")
+            smoothing = LaplacianSmoothing.compute(
+                local,
+                len(nodes),
+                n_iter=smooth_iter,
+                relaxation=smooth_relaxation,
+                weights=smooth_weights,
+                reference=surface_points.mean(axis=0),
+            )
+            surface_points = smoothing(surface_points)
+
+        # Signed distances of shape (B, P, n)
+        distances = np.einsum("bni,bpi->bpn", surface_points, normals) - offsets[:, :, None]
+        for i, shape_points in enumerate(surface_points):
+            for j, distance in enumerate(distances[i]):
+                clipped[i][j][name] = _clip_distance(shape_points, local, distance)
+
+    if outfile is not None:
+        write_clipped_container(outfile, clipped, origins, normals)
+    return clipped
+
+
+def write_clipped_container(
+    path: Path,
+    clipped: list[list[dict[str, ClippedSurface]]],
+    origins: np.ndarray,
+    normals: np.ndarray,
+) -> None:
+    """Write the output of :func:`clip_shapes` to a single ``.npz`` file.
+
+    The points and triangles of all clipped surfaces are concatenated into
+    the arrays ``points`` and ``triangles``, and surface ``k`` in the order
+    shape, plane, name consists of the rows ``point_offsets[k]`` up to
+    ``point_offsets[k + 1]`` and ``triangle_offsets[k]`` up to
+    ``triangle_offsets[k + 1]``. The cut curves are not stored.
+
+    Parameters
+    ----------
+    path : Path
+        Path to the output file.
+    clipped : list[list[dict[str, ClippedSurface]]]
+        Clipped surfaces returned by :func:`clip_shapes`
+    origins : np.ndarray
+        Origins of the clipping planes, of shape ``(P, 3)`` or ``(B, P, 3)``
+    normals : np.ndarray
+        Normals of the clipping planes, of the same shape as ``origins``
+    """
+    names = list(clipped[0][0])
+    pieces = [c[name] for shape in clipped for c in shape for name in names]
+    arrays: dict[str, Any] = {
+        "names": np.array(names),
+        "shape": np.array([len(clipped), len(clipped[0])]),
+        "origins": origins,
+        "normals": normals,
+        "points": np.concatenate([p.points for p in pieces]),
+        "triangles": np.concatenate([p.triangles for p in pieces]),
+        "point_offsets": np.cumsum([0] + [len(p.points) for p in pieces]),
+        "triangle_offsets": np.cumsum([0] + [len(p.triangles) for p in pieces]),
+    }
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+    logger.info(f"Saved {path}")
+
+
+def read_clipped_container(
+    path: Path,
+) -> tuple[list[list[dict[str, tuple[np.ndarray, np.ndarray]]]], np.ndarray, np.ndarray]:
+    """Read a file written by :func:`write_clipped_container`.
+
+    Returns
+    -------
+    tuple[list[list[dict[str, tuple[np.ndarray, np.ndarray]]]], np.ndarray, np.ndarray]
+        The points and triangles of each clipped surface, indexed as
+        ``clipped[shape][plane][name]``, and the origins and normals of the
+        planes of each shape, of shape ``(B, P, 3)``
+    """
+    with np.load(path) as data:
+        names = [str(name) for name in data["names"]]
+        n_shapes, n_planes = data["shape"]
+        points, triangles = data["points"], data["triangles"]
+        point_offsets, triangle_offsets = data["point_offsets"], data["triangle_offsets"]
+        clipped = []
+        k = 0
+        for _ in range(n_shapes):
+            planes = []
+            for _ in range(n_planes):
+                pieces = {}
+                for name in names:
+                    pieces[name] = (
+                        points[point_offsets[k] : point_offsets[k + 1]],
+                        triangles[triangle_offsets[k] : triangle_offsets[k + 1]],
+                    )
+                    k += 1
+                planes.append(pieces)
+            clipped.append(planes)
+        return clipped, data["origins"], data["normals"]
+
+
+def read_surface(
+    folder: Path,
+    name: str,
+    case: str,
+    container: tuple[np.ndarray, dict[str, np.ndarray]] | None = None,
+) -> Surface:
+    """Read the points and triangles of a surface.
+
+    Parameters
+    ----------
+    folder : Path
+        Directory with the generated surfaces.
+    name : str
+        Name of the surface, e.g. "LV".
+    case : str
+        Case of the surface, "ED" or "ES".
+    container : tuple[np.ndarray, dict[str, np.ndarray]] | None, optional
+        Points and triangles returned by :func:`ukb.surface.read_container`.
+        If given, the surface is taken from these arrays, otherwise it is read
+        from ``{name}_{case}.stl``.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Points of shape ``(N, 3)`` and triangles of shape ``(M, 3)``. Only
+        the points used by the triangles are included.
+    """
+    if container is not None:
+        points, triangles = container
+        nodes, local = np.unique(triangles[name], return_inverse=True)
+        return points[nodes], local.reshape(-1, 3)
+
+    import meshio
+
+    fname = folder / f"{name}_{case}.stl"
+    assert fname.exists(), f"File {fname} does not exist. Please check the path."
+    logger.info(f"Reading {fname}")
+    mesh = meshio.read(fname)
+    return np.asarray(mesh.points, dtype=np.float64), mesh.cells_dict["triangle"]
+
+
 def main(
     folder: Path,
     case: Literal["ED", "ES", "both"] = "ED",
@@ -117,14 +658,20 @@ def main(
     smooth: bool = True,
     smooth_iter: int = 100,
     smooth_relaxation: float = 0.1,
+    smooth_weights: Weights = "uniform",
+    auto_plane: bool = False,
+    plane_offset: float = 0.0,
 ):
     """Main function to clip the surfaces.
     Parameters
     ----------
     folder : Path
-        Directory to save the generated surfaces.
+        Directory to save the generated surfaces. The surfaces are read from
+        ``{case}_surfaces.npz`` if it exists (see ``ukb-atlas surf --container``)
+        and from the STL files otherwise.
     case : Literal["ED", "ES", "both"], optional
-        Case to generate surfaces for. The default is "ED".
+        Case to generate surfaces for. The default is "ED". With "both", the
+        clipped surfaces are written to ``{name}_clipped_{case}.ply``.
     origin_x : float, optional
         Origin of the clipping plane in x direction. The default is -13.612554383622273.
     origin_y : float, optional
@@ -143,138 +690,76 @@ def main(
         Number of iterations to smooth the RV surface. The default is 100.
     smooth_relaxation : float, optional
         Relaxation factor to smooth the RV surface. The default is 0.1.
+    smooth_weights : Literal["uniform", "cotangent"], optional
+        Weights of the neighbors when smoothing the RV surface. The default
+        is "uniform".
+    auto_plane : bool, optional
+        Fit the clipping plane to the valve nodes of each case with
+        :func:`fit_plane` instead of using the origin and normal. The default
+        is False.
+    plane_offset : float, optional
+        Distance to move the fitted plane towards the apex. The default is 0.0.
     """
     origin = [origin_x, origin_y, origin_z]
     normal = [normal_x, normal_y, normal_z]
 
     logger.info(f"Folder: {folder}")
     logger.info(f"Case: {case}")
-    logger.info(f"Origin: {origin}")
-    logger.info(f"Normal: {normal}")
-
-    try:
-        import pyvista as pv
-    except ImportError:
-        logger.warning("pyvista not installed. Cannot crop surfaces.")
-        return
-
-    lvfname = folder / f"LV_{case}.stl"
-    assert lvfname.exists(), f"File {lvfname} does not exist. Please check the path."
-    logger.info(f"Reading {lvfname}")
-    lv = pv.read(lvfname)
-    lv_clip = lv.clip(normal=normal, origin=origin, invert=True)
-    lv_clip.compute_normals(inplace=True, flip_normals=False)
-    pv.save_meshio(folder / "lv_clipped.ply", lv_clip)
-    logger.info(f"Saved {folder / 'lv_clipped.ply'}")
-
-    rvfname = folder / f"RV_{case}.stl"
-    assert rvfname.exists(), f"File {rvfname} does not exist. Please check the path."
-    logger.info(f"Reading {rvfname}")
-    rv_sept = pv.read(rvfname)
-    rv_sept.compute_normals(inplace=True, flip_normals=False)
-
-    rv_fw_fname = folder / f"RVFW_{case}.stl"
-    assert rv_fw_fname.exists(), f"File {rv_fw_fname} does not exist. Please check the path."
-    logger.info(f"Reading {rv_fw_fname}")
-    rv_fw = pv.read(rv_fw_fname)
-    logger.info("Merging RV and RVFW")
-    rv = rv_sept + rv_fw
-    if smooth:
-        logger.info("Smoothing RV")
-        rv = rv.smooth(n_iter=smooth_iter, relaxation_factor=smooth_relaxation)
-    rv_clip = rv.clip(normal=normal, origin=origin, invert=True)
-    rv_clip.compute_normals(inplace=True, flip_normals=False)
-    logger.info(f"Saving {folder / 'rv_clipped.ply'}")
-    pv.save_meshio(folder / "rv_clipped.ply", rv_clip)
-
-    epi_fname = folder / f"EPI_{case}.stl"
-    assert epi_fname.exists(), f"File {epi_fname} does not exist. Please check the path."
-    logger.info(f"Reading {epi_fname}")
-    epi = pv.read(epi_fname)
-    epi_clip = epi.clip(normal=normal, origin=origin, invert=True)
-    epi_clip.compute_normals(inplace=True, flip_normals=False)
-    logger.info(f"Saving {folder / 'epi_clipped.ply'}")
-    pv.save_meshio(folder / "epi_clipped.ply", epi_clip)
-
-
-def create_clipped_mesh(
-    folder: Path,
-    name: str = "clipped",
-    char_length_max: float = 5.0,
-    char_length_min: float = 5.0,
-    verbose: bool = False,
-) -> None:
-    """Create a gmsh mesh file from the surface mesh representation.
+    if auto_plane:
+        logger.info(f"Fitting plane to the valves with offset {plane_offset}")
+    else:
+        logger.info(f"Origin: {origin}")
+        logger.info(f"Normal: {normal}")
 
-    Parameters
-    ----------
-    folder : Path
-        Path to the output folde
-    name : str
-        Case name
-    char_length_max : float
-        Maximum characteristic length of the mesh elements
-    char_length_min : float
-        Minimum characteristic length of the mesh elements
-    verbose : bool, optional
-        Print verbose output, by default False
+    cases = atlas.phases(case)
+    for c in cases:
+        container_path = surface.find_container(folder, c)
+        container = None
+        if container_path is not None:
+            logger.info(f"Reading {container_path}")
+            container = surface.read_container(container_path)
+
+        if auto_plane:
+            if container is not None:
+                plane = base_plane(container[0], offset=plane_offset)
+            else:
+                # Neighboring valves share nodes, so remove the duplicates
+                valve_points = np.unique(
+                    np.concatenate([read_surface(folder, n, c)[0] for n in surface.valves]), axis=0
+                )
+                plane = fit_plane(valve_points, offset=plane_offset)
+            origin, normal = plane[0].tolist(), plane[1].tolist()
+            logger.info(f"Plane of {c}: origin {origin}, normal {normal}")
+
+        clipped = clip_surfaces(
+            lv=read_surface(folder, "LV", c, container),
+            rv_sept=read_surface(folder, "RV", c, container),
+            rv_fw=read_surface(folder, "RVFW", c, container),
+            epi=read_surface(folder, "EPI", c, container),
+            origin=origin,
+            normal=normal,
+            smooth=smooth,
+            smooth_iter=smooth_iter,
+            smooth_relaxation=smooth_relaxation,
+            smooth_weights=smooth_weights,
+        )
+        for name, clipped_surface in clipped.items():
+            # Keep the original file names when clipping a single case
+            path = folder / (f"{name}_clipped_{c}.ply" if len(cases) > 1 else f"{name}_clipped.ply")
+            surface.write_ply(path, clipped_surface.points, clipped_surface.triangles)
+            logger.info(f"Saved {path}")
+            logger.debug(f"Cut {name} along {len(clipped_surface.boundary)} curve(s)")
+
+
+def find_clipped(folder: Path, name: str, case: str) -> Path:
+    """Return the path of the clipped surface ``name`` of ``case``.
+
+    Clipping both cases writes ``{name}_clipped_{case}.ply``, while clipping
+    a single case writes ``{name}_clipped.ply``. The per-case file is used if
+    it exists and is newer than the other one.
     """
-    logger.info(f"Creating mesh for {name} with {char_length_max=}, {char_length_min=}")
-    try:
-        import gmsh
-
-    except ImportError:
-        logger.warning("gmsh python API not installed. Try subprocess.")
-        # return create_mesh_geo(folder, char_length_max, char_length_min, name)
-        raise
-    gmsh.initialize()
-    if not verbose:
-        gmsh.option.setNumber("General.Verbosity", 0)
-
-    # Merge all surfaces
-    gmsh.merge(f"{folder}/lv_clipped.ply")
-    gmsh.merge(f"{folder}/rv_clipped.ply")
-    gmsh.merge(f"{folder}/epi_clipped.ply")
-
-    gmsh.model.mesh.removeDuplicateNodes()
-    gmsh.model.mesh.create_topology()
-    gmsh.model.mesh.create_geometry()
-    surfaces = gmsh.model.getEntities(2)
-
-    # Create base plane
-    base_ring = gmsh.model.geo.addCurveLoop([s[1] for s in surfaces], 1)
-
-    gmsh.model.geo.addPlaneSurface([base_ring], 4)
-    gmsh.model.geo.synchronize()
-
-    surfaces = gmsh.model.getEntities(2)
-    gmsh.model.geo.addSurfaceLoop([s[1] for s in surfaces], 1)
-    vol = gmsh.model.geo.addVolume([1], 1)
-    gmsh.model.geo.synchronize()
-
-    gmsh.model.geo.synchronize()
-    physical_groups = {
-        "LV": [1],
-        "RV": [2],
-        "EPI": [3],
-        "BASE": [4],
-    }
-    for n, tag in physical_groups.items():
-        p = gmsh.model.addPhysicalGroup(2, tag)
-        gmsh.model.setPhysicalName(2, p, n)
-
-    p = gmsh.model.addPhysicalGroup(3, [vol], 4)
-    gmsh.model.setPhysicalName(3, p, "Wall")
-
-    gmsh.option.setNumber("Mesh.Optimize", 1)
-    gmsh.option.setNumber("Mesh.OptimizeNetgen", 1)
-    gmsh.option.setNumber("Mesh.Smoothing", 1)
-    gmsh.option.setNumber("Mesh.CharacteristicLengthMax", char_length_max)
-    gmsh.option.setNumber("Mesh.CharacteristicLengthMin", char_length_min)
-    gmsh.option.setNumber("Mesh.Algorithm3D", 1)
-    gmsh.model.geo.synchronize()
-    gmsh.model.mesh.generate(3)
-    outfile = (folder / f"{name}").with_suffix(".msh")
-    gmsh.write(str(outfile))
-    logger.info(f"Created mesh {outfile}")
-    gmsh.finalize()
+    path = folder / f"{name}_clipped_{case}.ply"
+    legacy = folder / f"{name}_clipped.ply"
+    if path.exists() and (not legacy.exists() or path.stat().st_mtime >= legacy.stat().st_mtime):
+        return path
+    return legacy
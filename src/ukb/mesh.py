@@ -1,9 +1,16 @@
 from textwrap import dedent
 from pathlib import Path
-from typing import Literal
+from typing import Any, Callable, Iterator, Literal, NamedTuple, Sequence
 from argparse import ArgumentParser
-import subprocess
+import contextlib
 import logging
+import time
+
+import numpy as np
+
+from . import atlas, surface
+from .cache import MeshCache
+from .clip import find_clipped
 
 logger = logging.getLogger(__name__)
 
@@ -52,6 +59,120 @@ def add_parser_arguments(parser: ArgumentParser) -> None:
         action="store_true",
         help="Create a clipped mesh.",
     )
+    parser.add_argument(
+        "--template",
+        type=Path,
+        default=None,
+        help=(
+            "Morph a template mesh instead of meshing from scratch. The template is "
+            "created from the current shape if the file does not exist. "
+            "Requires surfaces written with 'surf --container'."
+        ),
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of threads used by gmsh (General.NumThreads). 0 uses all cores.",
+    )
+    parser.add_argument(
+        "--algorithm3d",
+        choices=list(algorithms_3d),
+        default="delaunay",
+        help="3D mesh algorithm. 'hxt' is a parallel Delaunay algorithm.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=(
+            "Always create the mesh instead of using a cached mesh. Meshes are cached in "
+            "$UKB_CACHE_DIR/meshes (default ~/.ukb/meshes)."
+        ),
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=2048.0,
+        help="Maximum size of the mesh cache in MB. The least recently used meshes are removed.",
+    )
+
+
+# Values of the gmsh option Mesh.Algorithm3D
+algorithms_3d = {
+    "delaunay": 1,
+    "initial": 3,
+    "frontal": 4,
+    "mmg3d": 7,
+    "rtree": 9,
+    "hxt": 10,
+}
+
+
+@contextlib.contextmanager
+def session() -> Iterator[None]:
+    """Keep a gmsh session alive for the duration of the context.
+
+    All meshing functions in this module start a session if none is active,
+    and otherwise reuse the active session and clear its model. Wrapping a
+    loop over many shapes in a session therefore only pays the gmsh startup
+    cost once
+
+    .. code-block:: python
+
+        with ukb.mesh.session():
+            for points in shapes:
+                ukb.mesh.generate_mesh(points, triangles)
+
+    """
+    import gmsh
+
+    if gmsh.isInitialized():
+        yield
+        return
+
+    gmsh.initialize()
+    try:
+        yield
+    finally:
+        gmsh.finalize()
+
+
+def _new_model(name: str, verbose: bool = False, threads: int = 1) -> None:
+    """Clear the model of the active gmsh session and set the general
+    options."""
+    import gmsh
+
+    gmsh.option.setNumber("General.Verbosity", 5 if verbose else 0)
+    gmsh.option.setNumber("General.NumThreads", threads)
+    gmsh.clear()
+    gmsh.model.add(name)
+
+
+class PhaseTimer:
+    """Record the wall time of the phases of a meshing run.
+
+    Parameters
+    ----------
+    label : str
+        Label used when reporting the times
+    """
+
+    def __init__(self, label: str) -> None:
+        self.label = label
+        self.times: dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def __call__(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[phase] = self.times.get(phase, 0.0) + time.perf_counter() - start
+
+    def report(self) -> None:
+        """Log the time of each phase and the total time."""
+        phases = ", ".join(f"{phase} {t:.2f} s" for phase, t in self.times.items())
+        logger.info(f"Wall time {self.label}: {phases} (total {sum(self.times.values()):.2f} s)")
 
 
 template = dedent(
@@ -108,7 +229,8 @@ Mesh.CharacteristicLengthMin = {char_length_min};
 
 // 3D mesh algorithm (1: Delaunay, 3: Initial mesh only,
 // 4: Frontal, 7: MMG3D, 9: R-tree, 10: HXT); Default 1
-Mesh.Algorithm3D = 1;
+Mesh.Algorithm3D = {algorithm3d};
+General.NumThreads = {threads};
 Coherence;
 Mesh.MshFileVersion = 2.2;
 """
@@ -119,7 +241,9 @@ def create_mesh_geo(
     folder: Path,
     char_length_max: float,
     char_length_min: float,
-    case: Literal["ED", "ES", "both"] = "ED",
+    case: str = "ED",
+    algorithm3d: str = "delaunay",
+    threads: int = 1,
 ) -> None:
     """Convert a vtp file to a gmsh mesh file using the surface mesh
     representation. The surface mesh is coarsened using the gmsh
@@ -132,11 +256,19 @@ def create_mesh_geo(
     output : Path
         Path to the output folder
     """
+    import subprocess
+
     geofile = folder / f"{case}.geo"
     logger.debug(f"Writing {geofile}")
 
     geofile.write_text(
-        template.format(char_length_max=char_length_max, char_length_min=char_length_min, case=case)
+        template.format(
+            char_length_max=char_length_max,
+            char_length_min=char_length_min,
+            case=case,
+            algorithm3d=algorithms_3d[algorithm3d],
+            threads=threads,
+        )
     )
     mshfile = folder / f"{case}.msh"
     logger.debug(f"Create mesh {mshfile} using gmsh")
@@ -147,6 +279,402 @@ def create_mesh_geo(
     logger.debug("Finished running gmsh")
 
 
+# Order in which the surfaces are added to the gmsh model, i.e surface ``i``
+# in the list gets tag ``i + 1`` which is used by the physical groups below.
+surface_order = ("LV", "RV", "RVFW", "MV", "AV", "PV", "TV", "EPI")
+clipped_surface_order = ("lv", "rv", "epi")
+
+physical_groups = {
+    "LV": [1],
+    "RV": [2, 3],
+    "MV": [4],
+    "AV": [5],
+    "PV": [6],
+    "TV": [7],
+    "EPI": [8],
+}
+clipped_physical_groups = {
+    "LV": [1],
+    "RV": [2],
+    "EPI": [3],
+    "BASE": [4],
+}
+
+
+class VolumeMesh(NamedTuple):
+    """Tetrahedral mesh with marked boundary triangles.
+
+    Attributes
+    ----------
+    points : np.ndarray
+        Points of shape ``(N, 3)``
+    tetrahedra : np.ndarray
+        Tetrahedra of shape ``(M, 4)`` given as indices into ``points``
+    triangles : np.ndarray
+        Boundary triangles of shape ``(K, 3)`` given as indices into ``points``
+    triangle_markers : np.ndarray
+        Physical group tag of each boundary triangle
+    markers : dict[str, int]
+        Physical group tag of each named boundary
+    """
+
+    points: np.ndarray
+    tetrahedra: np.ndarray
+    triangles: np.ndarray
+    triangle_markers: np.ndarray
+    markers: dict[str, int]
+
+
+def add_discrete_surfaces(
+    points: np.ndarray, triangles: dict[str, np.ndarray], order: Sequence[str] = surface_order
+) -> None:
+    """Add surfaces with shared points to the current gmsh model as discrete
+    entities.
+
+    Surface ``order[i]`` gets tag ``i + 1``, which is the same as when merging
+    the surface files one by one. Node ``j`` gets tag ``j + 1``, so nodes
+    shared between surfaces are only added once and there is no need to
+    remove duplicate nodes afterwards.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Shared points of shape ``(N, 3)``.
+    triangles : dict[str, np.ndarray]
+        Triangles of each surface given as indices into ``points``.
+    order : Sequence[str], optional
+        Order in which the surfaces are added, by default :data:`surface_order`
+    """
+    import gmsh
+
+    added = np.zeros(len(points), dtype=bool)
+    for tag, name in enumerate(order, start=1):
+        gmsh.model.addDiscreteEntity(2, tag)
+        # Nodes are added to the first surface they belong to
+        nodes = np.unique(triangles[name])
+        nodes = nodes[~added[nodes]]
+        added[nodes] = True
+        gmsh.model.mesh.addNodes(2, tag, nodes + 1, points[nodes].ravel())
+        gmsh.model.mesh.addElementsByType(tag, 2, [], triangles[name].ravel() + 1)
+
+
+def _create_volume(
+    groups: dict[str, list[int]],
+    wall_tag: int,
+    char_length_max: float,
+    char_length_min: float,
+    base: bool = False,
+    remove_duplicates: bool = True,
+    algorithm3d: str = "delaunay",
+    timer: PhaseTimer | None = None,
+) -> None:
+    """Create and mesh the volume enclosed by the surfaces of the current
+    gmsh model. If ``base`` is true, the surfaces are closed by a plane
+    surface first. Duplicate nodes only need to be removed when the
+    surfaces were merged from files.
+    """
+    import gmsh
+
+    timer = timer or PhaseTimer("")
+    with timer("topology"):
+        if remove_duplicates:
+            gmsh.model.mesh.removeDuplicateNodes()
+        gmsh.model.mesh.create_topology()
+        gmsh.model.mesh.create_geometry()
+        surfaces = gmsh.model.getEntities(2)
+
+        if base:
+            # Create base plane
+            base_ring = gmsh.model.geo.addCurveLoop([s[1] for s in surfaces], 1)
+            gmsh.model.geo.addPlaneSurface([base_ring], len(surfaces) + 1)
+            gmsh.model.geo.synchronize()
+            surfaces = gmsh.model.getEntities(2)
+
+        gmsh.model.geo.addSurfaceLoop([s[1] for s in surfaces], 1)
+        vol = gmsh.model.geo.addVolume([1], 1)
+        gmsh.model.geo.synchronize()
+
+    for name, tag in groups.items():
+        p = gmsh.model.addPhysicalGroup(2, tag)
+        gmsh.model.setPhysicalName(2, p, name)
+
+    p = gmsh.model.addPhysicalGroup(3, [vol], wall_tag)
+    gmsh.model.setPhysicalName(3, p, "Wall")
+
+    gmsh.option.setNumber("Mesh.Optimize", 1)
+    gmsh.option.setNumber("Mesh.OptimizeNetgen", 1)
+    gmsh.option.setNumber("Mesh.Smoothing", 1)
+    gmsh.option.setNumber("Mesh.CharacteristicLengthMax", char_length_max)
+    gmsh.option.setNumber("Mesh.CharacteristicLengthMin", char_length_min)
+    gmsh.option.setNumber("Mesh.Algorithm3D", algorithms_3d[algorithm3d])
+
+    gmsh.model.geo.synchronize()
+    with timer("surface mesh"):
+        gmsh.model.mesh.generate(2)
+    with timer("volume mesh"):
+        gmsh.model.mesh.generate(3)
+
+
+def _extract_mesh() -> VolumeMesh:
+    """Return the mesh of the current gmsh model as arrays."""
+    import gmsh
+
+    node_tags, coords, _ = gmsh.model.mesh.getNodes()
+    index = np.zeros(int(node_tags.max()) + 1, dtype=np.int64)
+    index[node_tags] = np.arange(len(node_tags))
+
+    _, tetrahedra = gmsh.model.mesh.getElementsByType(4)
+    triangles = []
+    triangle_markers = []
+    markers = {}
+    for dim, group in gmsh.model.getPhysicalGroups(2):
+        markers[gmsh.model.getPhysicalName(dim, group)] = group
+        for entity in gmsh.model.getEntitiesForPhysicalGroup(dim, group):
+            _, nodes = gmsh.model.mesh.getElementsByType(2, entity)
+            triangles.append(index[nodes].reshape(-1, 3))
+            triangle_markers.append(np.full(len(nodes) // 3, group, dtype=np.int32))
+
+    return VolumeMesh(
+        points=coords.reshape(-1, 3),
+        tetrahedra=index[tetrahedra].reshape(-1, 4),
+        triangles=np.concatenate(triangles),
+        triangle_markers=np.concatenate(triangle_markers),
+        markers=markers,
+    )
+
+
+def generate_mesh(
+    points: np.ndarray,
+    triangles: dict[str, np.ndarray],
+    clipped: bool = False,
+    char_length_max: float = 5.0,
+    char_length_min: float = 5.0,
+    outfile: Path | None = None,
+    verbose: bool = False,
+    threads: int = 1,
+    algorithm3d: str = "delaunay",
+) -> VolumeMesh:
+    """Create a volumetric mesh from surfaces given as arrays.
+
+    The gmsh model is built directly from the arrays (see
+    :func:`add_discrete_surfaces`), so no files are read.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Shared points of shape ``(N, 3)``, e.g. the post-deletion points of a
+        shape or the points returned by :func:`ukb.surface.merge_points`.
+    triangles : dict[str, np.ndarray]
+        Triangles of each surface given as indices into ``points``. For the
+        full geometry the keys are :data:`surface_order` and for the clipped
+        geometry they are :data:`clipped_surface_order`.
+    clipped : bool, optional
+        Whether the surfaces are clipped, in which case the mesh is closed
+        by a base plane, by default False
+    char_length_max : float
+        Maximum characteristic length of the mesh elements, by default 5.0
+    char_length_min : float
+        Minimum characteristic length of the mesh elements, by default 5.0
+    outfile : Path | None, optional
+        If given, the mesh is also written to this file, by default None
+    verbose : bool, optional
+        Print verbose output, by default False
+    threads : int, optional
+        Number of threads used by gmsh, by default 1
+    algorithm3d : str, optional
+        3D mesh algorithm, a key of :data:`algorithms_3d`, by default "delaunay"
+
+    Returns
+    -------
+    VolumeMesh
+        The mesh
+    """
+    timer = PhaseTimer("clipped mesh" if clipped else "mesh")
+    with session():
+        _new_model("clipped" if clipped else "mesh", verbose=verbose, threads=threads)
+        order = clipped_surface_order if clipped else surface_order
+        with timer("model"):
+            add_discrete_surfaces(points, triangles, order)
+        _create_volume(
+            clipped_physical_groups if clipped else physical_groups,
+            5 if clipped else 9,
+            char_length_max,
+            char_length_min,
+            base=clipped,
+            remove_duplicates=False,
+            algorithm3d=algorithm3d,
+            timer=timer,
+        )
+        if outfile is not None:
+            with timer("write"):
+                _write(outfile)
+        with timer("extract"):
+            volume = _extract_mesh()
+    timer.report()
+    return volume
+
+
+def _write(outfile: Path) -> None:
+    import gmsh
+
+    # The file may be a hard link to a cached mesh, which must not be changed
+    Path(outfile).unlink(missing_ok=True)
+    gmsh.write(str(outfile))
+    logger.info(f"Created mesh {outfile}")
+
+
+def write_mesh(mesh: VolumeMesh, path: Path, wall_tag: int = 9) -> None:
+    """Write a :class:`VolumeMesh` to a gmsh file.
+
+    Each physical group is written as one discrete surface, and the
+    tetrahedra as one discrete volume with the physical group "Wall".
+
+    Parameters
+    ----------
+    mesh : VolumeMesh
+        The mesh
+    path : Path
+        Path to the output file
+    wall_tag : int, optional
+        Tag of the physical group of the volume, by default 9
+    """
+    import gmsh
+
+    with session():
+        _new_model("mesh")
+        for tag in mesh.markers.values():
+            gmsh.model.addDiscreteEntity(2, tag)
+        gmsh.model.addDiscreteEntity(3, 1, list(mesh.markers.values()))
+        node_tags = np.arange(1, len(mesh.points) + 1)
+        gmsh.model.mesh.addNodes(3, 1, node_tags, mesh.points.ravel())
+        gmsh.model.mesh.addElementsByType(1, 4, [], mesh.tetrahedra.ravel() + 1)
+        for name, tag in mesh.markers.items():
+            triangles = mesh.triangles[mesh.triangle_markers == tag]
+            gmsh.model.mesh.addElementsByType(tag, 2, [], triangles.ravel() + 1)
+            gmsh.model.addPhysicalGroup(2, [tag], tag)
+            gmsh.model.setPhysicalName(2, tag, name)
+        gmsh.model.addPhysicalGroup(3, [1], wall_tag)
+        gmsh.model.setPhysicalName(3, wall_tag, "Wall")
+        Path(path).unlink(missing_ok=True)
+        gmsh.write(str(path))
+
+
+def create_morphed_mesh(
+    folder: Path,
+    template: Path,
+    case: str = "ED",
+    char_length_max: float = 5.0,
+    char_length_min: float = 5.0,
+    verbose: bool = False,
+    threads: int = 1,
+    algorithm3d: str = "delaunay",
+) -> None:
+    """Create a mesh by morphing a template mesh, see :func:`main`."""
+    from . import morph
+
+    container = surface.find_container(folder, case)
+    if container is None:
+        raise FileNotFoundError(
+            f"{surface.container_path(folder, case)} does not exist. "
+            "Meshing from a template requires surfaces written with 'ukb-atlas surf --container'."
+        )
+    points, _ = surface.read_container(container)
+    options: dict[str, Any] = dict(
+        char_length_max=char_length_max,
+        char_length_min=char_length_min,
+        verbose=verbose,
+        threads=threads,
+        algorithm3d=algorithm3d,
+    )
+
+    if template.exists():
+        logger.info(f"Loading template {template}")
+        mesh_template = morph.MeshTemplate.load(template)
+        for name in morph.template_options:
+            value = mesh_template.options.get(name)
+            if options[name] != value:
+                raise ValueError(
+                    f"Template {template} was created with {name}={value}, not "
+                    f"{options[name]}. Remove it to create a new template."
+                )
+    else:
+        mesh_template = morph.MeshTemplate.compute(points, **options)
+        mesh_template.save(template)
+        logger.info(f"Saved template {template}")
+
+    timer = PhaseTimer(f"morphed mesh {case}")
+    with timer("morph"):
+        volume = morph.morph_mesh(mesh_template, points, **options)
+    outfile = folder / f"{case}.msh"
+    with timer("write"):
+        write_mesh(volume, outfile)
+    logger.info(f"Created mesh {outfile}")
+    timer.report()
+
+
+def create_mesh(
+    folder: Path,
+    case: str = "ED",
+    char_length_max: float = 5.0,
+    char_length_min: float = 5.0,
+    verbose: bool = False,
+    threads: int = 1,
+    algorithm3d: str = "delaunay",
+    cache: MeshCache | None = None,
+) -> None:
+    """Create a gmsh mesh file ``{folder}/{case}.msh`` from the surfaces of
+    one case, see :func:`main`. If ``cache`` is given, the mesh is taken from
+    the cache when the same surfaces were meshed with the same options
+    before."""
+    import gmsh
+
+    logger.info(f"Creating mesh for {case} with {char_length_max=}, {char_length_min=}")
+    outfile = folder / f"{case}.msh"
+    container = surface.find_container(folder, case)
+    key = None
+    if cache is not None:
+        inputs = [container] if container else [folder / f"{n}_{case}.stl" for n in surface_order]
+        key = cache.key(
+            inputs,
+            kind="mesh",
+            char_length_max=char_length_max,
+            char_length_min=char_length_min,
+            algorithm3d=algorithm3d,
+            # HXT meshes in parallel, so its output can depend on the threads
+            threads=threads,
+            gmsh=gmsh.__version__,
+        )
+        if cache.get(key, outfile):
+            return
+
+    timer = PhaseTimer(f"mesh {case}")
+    with session():
+        _new_model(case, verbose=verbose, threads=threads)
+        with timer("read"):
+            if container is not None:
+                logger.info(f"Reading {container}")
+                add_discrete_surfaces(*surface.read_container(container))
+            else:
+                # Merge all surfaces
+                for name in surface_order:
+                    gmsh.merge(f"{folder}/{name}_{case}.stl")
+
+        _create_volume(
+            physical_groups,
+            9,
+            char_length_max,
+            char_length_min,
+            remove_duplicates=container is None,
+            algorithm3d=algorithm3d,
+            timer=timer,
+        )
+        with timer("write"):
+            _write(outfile)
+    timer.report()
+    if cache is not None and key is not None:
+        cache.put(key, outfile)
+
+
 def main(
     folder: Path,
     case: Literal["ED", "ES", "both"] = "ED",
@@ -154,15 +682,22 @@ def main(
     char_length_min: float = 5.0,
     verbose: bool = False,
     clipped: bool = False,
+    template: Path | None = None,
+    threads: int = 1,
+    algorithm3d: str = "delaunay",
+    no_cache: bool = False,
+    cache_size: float = 2048.0,
 ) -> None:
     """Create a gmsh mesh file from the surface mesh representation.
 
     Parameters
     ----------
     folder : Path
-        Path to the output folder
+        Path to the output folder. The surfaces are read from
+        ``{case}_surfaces.npz`` if it exists and from the STL files otherwise.
     case : str
-        Case name, by default "ED"
+        Case name, by default "ED". With "both", the ED and ES meshes are
+        created concurrently in two processes, see :func:`mesh_cases`.
     char_length_max : float
         Maximum characteristic length of the mesh elements, by default 5.0
     char_length_min : float
@@ -171,72 +706,198 @@ def main(
         Print verbose output, by default False
     clipped : bool, optional
         Create a clipped mesh, by default False
+    template : Path | None, optional
+        Path to a template mesh (see :class:`ukb.morph.MeshTemplate`). If
+        given, the mesh is created by morphing the template to the shape in
+        ``{case}_surfaces.npz`` and only remeshed if the morphed mesh has
+        inverted elements. If the file does not exist, the template is
+        created from the shape and saved. An existing template must have
+        been created with the same characteristic lengths. Not supported for
+        clipped meshes. By default None
+    threads : int, optional
+        Number of threads used by gmsh (General.NumThreads), by default 1.
+        0 uses all cores.
+    algorithm3d : str, optional
+        3D mesh algorithm, a key of :data:`algorithms_3d`, by default
+        "delaunay". The "hxt" algorithm runs in parallel.
+    no_cache : bool, optional
+        Always create the mesh instead of using a cached mesh, by default
+        False. Meshes are cached in :func:`ukb.cache.default_cache_dir`.
+    cache_size : float, optional
+        Maximum size of the mesh cache in MB, by default 2048
     """
+    options: dict[str, Any] = dict(
+        char_length_max=char_length_max,
+        char_length_min=char_length_min,
+        verbose=verbose,
+        threads=threads,
+        algorithm3d=algorithm3d,
+    )
+    cache = None if no_cache else MeshCache(max_size=int(cache_size * 1024**2))
+    cases = atlas.phases(case)
     if clipped:
-        return create_clipped_mesh(
-            folder=folder,
-            case=case,
-            char_length_max=char_length_max,
-            char_length_min=char_length_min,
-        )
-    logger.info(f"Creating mesh for {case} with {char_length_max=}, {char_length_min=}")
+        if template is not None:
+            raise ValueError("Meshing from a template is not supported for clipped meshes.")
+        if len(cases) > 1:
+            mesh_cases(
+                create_clipped_mesh, folder, cases, "{case}_clipped.msh", cache=cache, **options
+            )
+            return None
+        return create_clipped_mesh(folder=folder, case=case, cache=cache, **options)
+
     try:
-        import gmsh
+        import gmsh  # noqa: F401
 
     except ImportError:
         logger.warning("gmsh python API not installed. Try subprocess.")
-        return create_mesh_geo(folder, char_length_max, char_length_min, case)
+        for c in cases:
+            create_mesh_geo(
+                folder,
+                char_length_max,
+                char_length_min,
+                c,
+                algorithm3d=algorithm3d,
+                threads=threads,
+            )
+        return
+
+    if template is not None:
+        # Morphing is cheap, and running the cases in sequence avoids creating
+        # the same template twice
+        with session():
+            for c in cases:
+                create_morphed_mesh(folder=folder, template=template, case=c, **options)
+    elif len(cases) > 1:
+        mesh_cases(create_mesh, folder, cases, "{case}.msh", cache=cache, **options)
+    else:
+        create_mesh(folder=folder, case=case, cache=cache, **options)
+
+
+class CaseResult(NamedTuple):
+    """Result of meshing one case in :func:`mesh_cases`.
+
+    Attributes
+    ----------
+    case : str
+        The case, "ED" or "ES"
+    outfile : Path
+        The mesh file
+    seconds : float
+        Wall time in seconds
+    log : Path
+        Log file of the case
+    error : str | None
+        The error if meshing failed, otherwise None
+    """
 
-    gmsh.initialize()
-    if not verbose:
-        gmsh.option.setNumber("General.Verbosity", 0)
-
-    # Merge all surfaces
-    gmsh.merge(f"{folder}/LV_{case}.stl")
-    gmsh.merge(f"{folder}/RV_{case}.stl")
-    gmsh.merge(f"{folder}/RVFW_{case}.stl")
-    gmsh.merge(f"{folder}/MV_{case}.stl")
-    gmsh.merge(f"{folder}/AV_{case}.stl")
-    gmsh.merge(f"{folder}/PV_{case}.stl")
-    gmsh.merge(f"{folder}/TV_{case}.stl")
-    gmsh.merge(f"{folder}/EPI_{case}.stl")
-    gmsh.model.mesh.removeDuplicateNodes()
-    gmsh.model.mesh.create_topology()
-    gmsh.model.mesh.create_geometry()
-    surfaces = gmsh.model.getEntities(2)
-
-    gmsh.model.geo.addSurfaceLoop([s[1] for s in surfaces], 1)
-    vol = gmsh.model.geo.addVolume([1], 1)
-    gmsh.model.geo.synchronize()
+    case: str
+    outfile: Path
+    seconds: float
+    log: Path
+    error: str | None = None
+
+
+def _mesh_case(
+    func: Callable[..., None], folder: Path, case: str, outfile: Path, level: int, kwargs: dict
+) -> CaseResult:
+    """Run ``func`` for one case in a worker process, logging to stderr at
+    ``level`` and to ``{folder}/mesh_{case}.log`` at least at INFO level,
+    with the case as prefix."""
+    log = folder / f"mesh_{case}.log"
+    root = logging.getLogger()
+    root.setLevel(min(level, logging.INFO))
+    formatter = logging.Formatter(f"[{case}] %(levelname)s:%(name)s:%(message)s")
+    handlers: list[logging.Handler] = [logging.StreamHandler(), logging.FileHandler(log, mode="w")]
+    handlers[0].setLevel(level)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+
+    start = time.perf_counter()
+    error = None
+    try:
+        func(folder=folder, case=case, **kwargs)
+    except Exception as e:
+        logger.exception(f"Meshing {case} failed")
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        for handler in handlers:
+            root.removeHandler(handler)
+            handler.close()
+    return CaseResult(
+        case=case, outfile=outfile, seconds=time.perf_counter() - start, log=log, error=error
+    )
 
-    physical_groups = {
-        "LV": [1],
-        "RV": [2, 3],
-        "MV": [4],
-        "AV": [5],
-        "PV": [6],
-        "TV": [7],
-        "EPI": [8],
-    }
-    for name, tag in physical_groups.items():
-        p = gmsh.model.addPhysicalGroup(2, tag)
-        gmsh.model.setPhysicalName(2, p, name)
 
-    p = gmsh.model.addPhysicalGroup(3, [vol], 9)
-    gmsh.model.setPhysicalName(3, p, "Wall")
+def mesh_cases(
+    func: Callable[..., None],
+    folder: Path,
+    cases: Sequence[str],
+    outfile: str = "{case}.msh",
+    **kwargs,
+) -> list[CaseResult]:
+    """Mesh several cases concurrently, each in its own process.
 
-    gmsh.option.setNumber("Mesh.Optimize", 1)
-    gmsh.option.setNumber("Mesh.OptimizeNetgen", 1)
-    gmsh.option.setNumber("Mesh.Smoothing", 1)
-    gmsh.option.setNumber("Mesh.CharacteristicLengthMax", char_length_max)
-    gmsh.option.setNumber("Mesh.CharacteristicLengthMin", char_length_min)
-    gmsh.option.setNumber("Mesh.Algorithm3D", 1)
+    gmsh keeps global state and cannot mesh two models at the same time in
+    one process, so each case is meshed in a separate (spawned) process.
+    The log of each case is written to ``{folder}/mesh_{case}.log``.
 
-    gmsh.model.geo.synchronize()
-    gmsh.model.mesh.generate(3)
-    gmsh.write(f"{folder}/{case}.msh")
-    logger.info(f"Created mesh {folder}/{case}.msh")
-    gmsh.finalize()
+    Parameters
+    ----------
+    func : Callable[..., None]
+        Function that meshes one case, called as
+        ``func(folder=folder, case=case, **kwargs)``, e.g.
+        :func:`create_mesh` or :func:`create_clipped_mesh`
+    folder : Path
+        Folder with the surfaces
+    cases : Sequence[str]
+        The cases, e.g. ``("ED", "ES")``
+    outfile : str, optional
+        Name of the mesh file written by ``func``, formatted with the case,
+        by default "{case}.msh"
+    kwargs
+        Passed to ``func``
+
+    Returns
+    -------
+    list[CaseResult]
+        The result of each case
+
+    Raises
+    ------
+    RuntimeError
+        If meshing failed for any case
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    level = logging.getLogger().getEffectiveLevel()
+    context = multiprocessing.get_context("spawn")
+    logger.info(f"Meshing {', '.join(cases)} in parallel")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=len(cases), mp_context=context) as executor:
+        futures = [
+            executor.submit(
+                _mesh_case, func, folder, c, folder / outfile.format(case=c), level, kwargs
+            )
+            for c in cases
+        ]
+        results = [future.result() for future in futures]
+
+    logger.info(f"Meshed {len(cases)} cases in {time.perf_counter() - start:.2f} s")
+    for result in results:
+        status = "failed" if result.error else "ok"
+        logger.info(
+            f"  {result.case}: {status} in {result.seconds:.2f} s, "
+            f"mesh {result.outfile}, log {result.log}"
+        )
+    failed = [result for result in results if result.error]
+    if failed:
+        raise RuntimeError(
+            "Meshing failed for "
+            + ", ".join(f"{result.case} ({result.error})" for result in failed)
+        )
+    return results
 
 
 def create_clipped_mesh(
@@ -245,21 +906,32 @@ def create_clipped_mesh(
     char_length_max: float = 5.0,
     char_length_min: float = 5.0,
     verbose: bool = False,
+    threads: int = 1,
+    algorithm3d: str = "delaunay",
+    cache: MeshCache | None = None,
 ) -> None:
-    """Create a gmsh mesh file from the surface mesh representation.
+    """Create a gmsh mesh file ``{folder}/{case}_clipped.msh`` from the
+    clipped surfaces written by ``ukb-atlas clip``, see :func:`find_clipped`.
 
     Parameters
     ----------
     folder : Path
-        Path to the output folde
-    name : str
-        Case name
+        Path to the folder with the clipped surfaces
+    case : str
+        Case name, by default "ED"
     char_length_max : float
         Maximum characteristic length of the mesh elements
     char_length_min : float
         Minimum characteristic length of the mesh elements
     verbose : bool, optional
         Print verbose output, by default False
+    threads : int, optional
+        Number of threads used by gmsh, by default 1
+    algorithm3d : str, optional
+        3D mesh algorithm, a key of :data:`algorithms_3d`, by default "delaunay"
+    cache : MeshCache | None, optional
+        If given, the mesh is taken from the cache when the same surfaces
+        were meshed with the same options before, by default None
     """
     logger.info(f"Creating clipped mesh for {case} with {char_length_max=}, {char_length_min=}")
     try:
@@ -269,54 +941,44 @@ def create_clipped_mesh(
         logger.warning("gmsh python API not installed. Try subprocess.")
         # return create_mesh_geo(folder, char_length_max, char_length_min, name)
         raise
-    gmsh.initialize()
-    if not verbose:
-        gmsh.option.setNumber("General.Verbosity", 0)
-
-    # Merge all surfaces
-    gmsh.merge(f"{folder}/lv_clipped.ply")
-    gmsh.merge(f"{folder}/rv_clipped.ply")
-    gmsh.merge(f"{folder}/epi_clipped.ply")
 
-    gmsh.model.mesh.removeDuplicateNodes()
-    gmsh.model.mesh.create_topology()
-    gmsh.model.mesh.create_geometry()
-    surfaces = gmsh.model.getEntities(2)
-
-    # Create base plane
-    base_ring = gmsh.model.geo.addCurveLoop([s[1] for s in surfaces], 1)
-
-    gmsh.model.geo.addPlaneSurface([base_ring], 4)
-    gmsh.model.geo.synchronize()
-
-    surfaces = gmsh.model.getEntities(2)
-    gmsh.model.geo.addSurfaceLoop([s[1] for s in surfaces], 1)
-    vol = gmsh.model.geo.addVolume([1], 1)
-    gmsh.model.geo.synchronize()
-
-    gmsh.model.geo.synchronize()
-    physical_groups = {
-        "LV": [1],
-        "RV": [2],
-        "EPI": [3],
-        "BASE": [4],
-    }
-    for n, tag in physical_groups.items():
-        p = gmsh.model.addPhysicalGroup(2, tag)
-        gmsh.model.setPhysicalName(2, p, n)
-
-    p = gmsh.model.addPhysicalGroup(3, [vol], 5)
-    gmsh.model.setPhysicalName(3, p, "Wall")
-
-    gmsh.option.setNumber("Mesh.Optimize", 1)
-    gmsh.option.setNumber("Mesh.OptimizeNetgen", 1)
-    gmsh.option.setNumber("Mesh.Smoothing", 1)
-    gmsh.option.setNumber("Mesh.CharacteristicLengthMax", char_length_max)
-    gmsh.option.setNumber("Mesh.CharacteristicLengthMin", char_length_min)
-    gmsh.option.setNumber("Mesh.Algorithm3D", 1)
-    gmsh.model.geo.synchronize()
-    gmsh.model.mesh.generate(3)
     outfile = (folder / f"{case}_clipped").with_suffix(".msh")
-    gmsh.write(str(outfile))
-    logger.info(f"Created mesh {outfile}")
-    gmsh.finalize()
+    inputs = [find_clipped(folder, name, case) for name in clipped_surface_order]
+    key = None
+    if cache is not None:
+        key = cache.key(
+            inputs,
+            kind="clipped",
+            char_length_max=char_length_max,
+            char_length_min=char_length_min,
+            algorithm3d=algorithm3d,
+            # HXT meshes in parallel, so its output can depend on the threads
+            threads=threads,
+            gmsh=gmsh.__version__,
+        )
+        if cache.get(key, outfile):
+            return
+
+    timer = PhaseTimer(f"clipped mesh {case}")
+    with session():
+        _new_model(f"{case}_clipped", verbose=verbose, threads=threads)
+
+        # Merge all surfaces
+        with timer("read"):
+            for path in inputs:
+                gmsh.merge(str(path))
+
+        _create_volume(
+            clipped_physical_groups,
+            5,
+            char_length_max,
+            char_length_min,
+            base=True,
+            algorithm3d=algorithm3d,
+            timer=timer,
+        )
+        with timer("write"):
+            _write(outfile)
+    timer.report()
+    if cache is not None and key is not None:
+        cache.put(key, outfile)
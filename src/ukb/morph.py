@@ -0,0 +1,348 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Callable
+import functools
+import inspect
+import json
+import logging
+
+import numpy as np
+
+from . import surface
+from .mesh import VolumeMesh, generate_mesh
+
+logger = logging.getLogger(__name__)
+
+
+def tetrahedron_volumes(points: np.ndarray, tetrahedra: np.ndarray) -> np.ndarray:
+    """Signed volume of each tetrahedron.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Points of shape ``(N, 3)``
+    tetrahedra : np.ndarray
+        Tetrahedra of shape ``(M, 4)`` given as indices into ``points``
+
+    Returns
+    -------
+    np.ndarray
+        Signed volumes of shape ``(M,)``
+    """
+    p = points[tetrahedra]
+    edges = p[:, 1:] - p[:, :1]
+    return np.linalg.det(edges) / 6.0
+
+
+def stiffness_matrix(points: np.ndarray, tetrahedra: np.ndarray):
+    """Assemble the P1 finite element stiffness matrix of the Laplacian.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Points of shape ``(N, 3)``
+    tetrahedra : np.ndarray
+        Tetrahedra of shape ``(M, 4)`` given as indices into ``points``
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Stiffness matrix of shape ``(N, N)``
+    """
+    import scipy.sparse
+
+    p = points[tetrahedra]
+    edges = p[:, 1:] - p[:, :1]
+    # Gradients of the barycentric coordinates 1, 2 and 3 are the columns of
+    # the inverse edge matrix, and they sum to minus the gradient of the first
+    grads = np.linalg.inv(edges).transpose(0, 2, 1)
+    grads = np.concatenate([-grads.sum(axis=1, keepdims=True), grads], axis=1)
+    volumes = np.abs(np.linalg.det(edges)) / 6.0
+    local = volumes[:, None, None] * grads @ grads.transpose(0, 2, 1)
+
+    rows = np.broadcast_to(tetrahedra[:, :, None], local.shape)
+    cols = np.broadcast_to(tetrahedra[:, None, :], local.shape)
+    n = len(points)
+    return scipy.sparse.coo_matrix(
+        (local.ravel(), (rows.ravel(), cols.ravel())), shape=(n, n)
+    ).tocsr()
+
+
+def barycentric_map(
+    points: np.ndarray,
+    reference: np.ndarray,
+    triangles: np.ndarray | None = None,
+    k: int = 16,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Locate points on the surface of a reference shape.
+
+    Each point is assigned to the closest of the ``k`` triangles with the
+    closest centroids.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Points of shape ``(M, 3)`` lying on the surface of ``reference``
+    reference : np.ndarray
+        Post-deletion atlas points of shape ``(N, 3)``
+    triangles : np.ndarray | None, optional
+        Triangles of the surface given as indices into ``reference``, by
+        default the triangles of all surfaces in :data:`ukb.surface.surfaces`
+    k : int, optional
+        Number of candidate triangles for each point, by default 16
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Node indices and barycentric weights, both of shape ``(M, 3)``
+    """
+    from scipy.spatial import cKDTree
+
+    if triangles is None:
+        top = surface.topology()
+        triangles = np.unique(
+            np.sort(
+                np.concatenate([top.global_triangles(name) for name in surface.surfaces]), axis=1
+            ),
+            axis=0,
+        )
+    corners = reference[triangles]
+    _, candidates = cKDTree(corners.mean(axis=1)).query(points, k=min(k, len(triangles)))
+    candidates = candidates.reshape(len(points), -1)
+
+    # Barycentric coordinates of the projection onto each candidate triangle,
+    # clipped to the triangle
+    a, b, c = (corners[candidates, i] for i in range(3))
+    v0, v1, v2 = b - a, c - a, points[:, None] - a
+    d00 = np.einsum("...i,...i", v0, v0)
+    d01 = np.einsum("...i,...i", v0, v1)
+    d11 = np.einsum("...i,...i", v1, v1)
+    d20 = np.einsum("...i,...i", v2, v0)
+    d21 = np.einsum("...i,...i", v2, v1)
+    denom = d00 * d11 - d01 * d01
+    w1 = (d11 * d20 - d01 * d21) / denom
+    w2 = (d00 * d21 - d01 * d20) / denom
+    weights = np.clip(np.stack([1.0 - w1 - w2, w1, w2], axis=-1), 0.0, None)
+    weights /= weights.sum(axis=-1, keepdims=True)
+
+    # Pick the candidate closest to the point
+    closest = np.einsum("...j,...jk->...k", weights, corners[candidates])
+    best = np.argmin(np.linalg.norm(closest - points[:, None], axis=-1), axis=1)
+    index = np.arange(len(points))
+    return triangles[candidates[index, best]], weights[index, best]
+
+
+template_options = ("char_length_max", "char_length_min")
+
+
+class MeshTemplate:
+    """Tetrahedral mesh of a reference shape that can be morphed to other
+    shapes of the atlas.
+
+    Since all shapes share the same surface topology, the boundary nodes of
+    the reference mesh are given as fixed barycentric combinations of atlas
+    nodes. A new shape moves the boundary nodes accordingly, and the
+    displacement is extended harmonically to the interior nodes.
+
+    Parameters
+    ----------
+    mesh : VolumeMesh
+        Mesh of the reference shape
+    reference : np.ndarray
+        Post-deletion atlas points of the reference shape of shape ``(N, 3)``
+    boundary : np.ndarray
+        Indices of the boundary nodes in ``mesh.points``
+    atlas_nodes : np.ndarray
+        Atlas node indices of shape ``(len(boundary), 3)`` of the triangle
+        containing each boundary node
+    weights : np.ndarray
+        Barycentric weights of shape ``(len(boundary), 3)``
+    options : dict[str, Any] | None, optional
+        Meshing options the template was created with, e.g. the
+        characteristic lengths, by default None
+    """
+
+    def __init__(
+        self,
+        mesh: VolumeMesh,
+        reference: np.ndarray,
+        boundary: np.ndarray,
+        atlas_nodes: np.ndarray,
+        weights: np.ndarray,
+        options: dict[str, Any] | None = None,
+    ) -> None:
+        self.mesh = mesh
+        self.reference = reference
+        self.boundary = boundary
+        self.atlas_nodes = atlas_nodes
+        self.weights = weights
+        self.options = options or {}
+
+    @classmethod
+    def compute(
+        cls,
+        reference: np.ndarray,
+        triangles: dict[str, np.ndarray] | None = None,
+        **kwargs,
+    ) -> MeshTemplate:
+        """Mesh the reference shape and map its boundary to the atlas nodes.
+
+        Parameters
+        ----------
+        reference : np.ndarray
+            Post-deletion atlas points of shape ``(N, 3)``, e.g. the mean shape
+        triangles : dict[str, np.ndarray] | None, optional
+            Triangles of each surface given as indices into ``reference``, by
+            default the atlas surfaces
+        kwargs
+            Passed to :func:`ukb.mesh.generate_mesh`. The characteristic
+            lengths are stored in :attr:`options`.
+        """
+        if triangles is None:
+            triangles = _global_triangles()
+        logger.info("Creating template mesh")
+        mesh = generate_mesh(reference, triangles, **kwargs)
+        boundary = np.unique(mesh.triangles)
+        atlas_nodes, weights = barycentric_map(
+            mesh.points[boundary], reference, np.concatenate(list(triangles.values()))
+        )
+        return cls(
+            mesh=mesh,
+            reference=reference,
+            boundary=boundary,
+            atlas_nodes=atlas_nodes,
+            weights=weights,
+            options={
+                name: kwargs.get(name, inspect.signature(generate_mesh).parameters[name].default)
+                for name in template_options
+            },
+        )
+
+    def save(self, path: Path) -> None:
+        """Save the template to an ``.npz`` file."""
+        arrays: dict[str, Any] = {
+            "points": self.mesh.points,
+            "tetrahedra": self.mesh.tetrahedra,
+            "triangles": self.mesh.triangles,
+            "triangle_markers": self.mesh.triangle_markers,
+            "marker_names": np.array(list(self.mesh.markers)),
+            "marker_tags": np.array(list(self.mesh.markers.values())),
+            "reference": self.reference,
+            "boundary": self.boundary,
+            "atlas_nodes": self.atlas_nodes,
+            "weights": self.weights,
+            "options": np.array(json.dumps(self.options)),
+        }
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: Path) -> MeshTemplate:
+        """Load a template saved with :meth:`save`."""
+        with np.load(path) as data:
+            if "options" not in data:
+                raise ValueError(
+                    f"{path} does not store the meshing options of the template. "
+                    "Remove it to create a new template."
+                )
+            mesh = VolumeMesh(
+                points=data["points"],
+                tetrahedra=data["tetrahedra"],
+                triangles=data["triangles"],
+                triangle_markers=data["triangle_markers"],
+                markers={
+                    str(name): int(tag)
+                    for name, tag in zip(data["marker_names"], data["marker_tags"])
+                },
+            )
+            return cls(
+                mesh=mesh,
+                reference=data["reference"],
+                boundary=data["boundary"],
+                atlas_nodes=data["atlas_nodes"],
+                weights=data["weights"],
+                options=json.loads(str(data["options"])),
+            )
+
+    def boundary_points(self, points: np.ndarray) -> np.ndarray:
+        """Positions of the boundary nodes for the shape ``points``."""
+        return np.einsum("ij,ijk->ik", self.weights, points[self.atlas_nodes])
+
+    def morph(self, points: np.ndarray) -> VolumeMesh:
+        """Morph the template mesh to a new shape.
+
+        The result may contain inverted tetrahedra if the shape is far from
+        the reference, see :func:`morph_mesh`.
+
+        Parameters
+        ----------
+        points : np.ndarray
+            Post-deletion atlas points of shape ``(N, 3)``
+
+        Returns
+        -------
+        VolumeMesh
+            The morphed mesh
+        """
+        interior, solve, coupling = self._harmonic_extension
+        displacement = np.zeros_like(self.mesh.points)
+        displacement[self.boundary] = self.boundary_points(points) - self.mesh.points[self.boundary]
+        rhs = -(coupling @ displacement[self.boundary])
+        displacement[interior] = np.column_stack([solve(rhs[:, i]) for i in range(3)])
+        return self.mesh._replace(points=self.mesh.points + displacement)
+
+    @functools.cached_property
+    def _harmonic_extension(self) -> tuple[np.ndarray, Callable, Any]:
+        """Interior node indices, a solver for the interior block of the
+        stiffness matrix and its interior-boundary block. The factorization
+        is computed once and reused for every shape."""
+        import scipy.sparse.linalg
+
+        logger.debug("Factorizing template stiffness matrix")
+        K = stiffness_matrix(self.mesh.points, self.mesh.tetrahedra)
+        interior = np.setdiff1d(np.arange(len(self.mesh.points)), self.boundary)
+        solve = scipy.sparse.linalg.factorized(K[interior][:, interior].tocsc())
+        return interior, solve, K[interior][:, self.boundary]
+
+    def inverted(self, mesh: VolumeMesh) -> np.ndarray:
+        """Indices of the tetrahedra of ``mesh`` that are inverted compared
+        to the template mesh."""
+        reference = np.sign(tetrahedron_volumes(self.mesh.points, self.mesh.tetrahedra))
+        volumes = tetrahedron_volumes(mesh.points, mesh.tetrahedra)
+        return np.flatnonzero(volumes * reference <= 0)
+
+
+@functools.cache
+def _global_triangles() -> dict[str, np.ndarray]:
+    top = surface.topology()
+    return {name: top.global_triangles(name) for name in surface.surfaces}
+
+
+def morph_mesh(template: MeshTemplate, points: np.ndarray, **kwargs) -> VolumeMesh:
+    """Create a mesh for a shape by morphing a template mesh.
+
+    If the morphed mesh has inverted tetrahedra, the shape is meshed from
+    scratch with :func:`ukb.mesh.generate_mesh` instead.
+
+    Parameters
+    ----------
+    template : MeshTemplate
+        The template
+    points : np.ndarray
+        Post-deletion atlas points of shape ``(N, 3)``
+    kwargs
+        Passed to :func:`ukb.mesh.generate_mesh` when remeshing
+
+    Returns
+    -------
+    VolumeMesh
+        The mesh
+    """
+    mesh = template.morph(points)
+    inverted = template.inverted(mesh)
+    if len(inverted) == 0:
+        return mesh
+    logger.warning(
+        f"Morphed mesh has {len(inverted)} inverted tetrahedra. Remeshing the shape instead."
+    )
+    return generate_mesh(points, _global_triangles(), **kwargs)
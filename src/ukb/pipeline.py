@@ -0,0 +1,202 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple, Sequence
+import logging
+
+import numpy as np
+
+from . import clip as _clip, surface
+from .smooth import Weights
+
+if TYPE_CHECKING:
+    from .mesh import VolumeMesh
+
+logger = logging.getLogger(__name__)
+
+SurfaceArrays = dict[str, tuple[np.ndarray, np.ndarray]]
+
+
+class Result(NamedTuple):
+    """Output of :func:`build`.
+
+    Attributes
+    ----------
+    surfaces : dict[str, tuple[np.ndarray, np.ndarray]]
+        Points and triangles of each surface in :data:`ukb.surface.surfaces`
+    clipped : dict[str, tuple[np.ndarray, np.ndarray]] | None
+        Points and triangles of the clipped "lv", "rv" and "epi" surfaces, or
+        None if the surfaces were not clipped
+    mesh : VolumeMesh | None
+        The volumetric mesh, or None if no mesh was created
+    """
+
+    surfaces: SurfaceArrays
+    clipped: SurfaceArrays | None
+    mesh: VolumeMesh | None
+
+
+def extract_surfaces(points: np.ndarray) -> SurfaceArrays:
+    """Extract all surfaces from a point set.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Post-deletion points of shape ``(N, 3)``, e.g. ``atlas.Points.ED``.
+
+    Returns
+    -------
+    dict[str, tuple[np.ndarray, np.ndarray]]
+        Points and triangles of each surface
+    """
+    top = surface.topology()
+    return {name: top.extract(name, points) for name in surface.surfaces}
+
+
+def clip_surfaces(
+    surfaces: SurfaceArrays,
+    origin: Sequence[float] | None = None,
+    normal: Sequence[float] | None = None,
+    smooth: bool = True,
+    smooth_iter: int = 100,
+    smooth_relaxation: float = 0.1,
+    smooth_weights: Weights = "uniform",
+) -> SurfaceArrays:
+    """Clip the surfaces with a plane, see :func:`ukb.clip.clip_surfaces`.
+
+    Parameters
+    ----------
+    surfaces : dict[str, tuple[np.ndarray, np.ndarray]]
+        Surfaces returned by :func:`extract_surfaces`
+    origin : Sequence[float] | None, optional
+        Origin of the clipping plane, by default :func:`ukb.clip.default_origin`
+    normal : Sequence[float] | None, optional
+        Normal of the clipping plane, by default :func:`ukb.clip.default_normal`
+    smooth : bool, optional
+        Smooth the RV surface, by default True
+    smooth_iter : int, optional
+        Number of iterations to smooth the RV surface, by default 100
+    smooth_relaxation : float, optional
+        Relaxation factor to smooth the RV surface, by default 0.1
+    smooth_weights : Literal["uniform", "cotangent"], optional
+        Weights of the neighbors when smoothing the RV surface, by default "uniform"
+
+    Returns
+    -------
+    dict[str, tuple[np.ndarray, np.ndarray]]
+        Points and triangles of the clipped "lv", "rv" and "epi" surfaces
+    """
+    clipped = _clip.clip_surfaces(
+        lv=surfaces["LV"],
+        rv_sept=surfaces["RV"],
+        rv_fw=surfaces["RVFW"],
+        epi=surfaces["EPI"],
+        origin=_clip.default_origin() if origin is None else origin,
+        normal=_clip.default_normal() if normal is None else normal,
+        smooth=smooth,
+        smooth_iter=smooth_iter,
+        smooth_relaxation=smooth_relaxation,
+        smooth_weights=smooth_weights,
+    )
+    return {name: (data.points, data.triangles) for name, data in clipped.items()}
+
+
+def build(
+    points: np.ndarray,
+    clip: bool = False,
+    mesh: bool = False,
+    origin: Sequence[float] | None = None,
+    normal: Sequence[float] | None = None,
+    smooth: bool = True,
+    smooth_iter: int = 100,
+    smooth_relaxation: float = 0.1,
+    smooth_weights: Weights = "uniform",
+    char_length_max: float = 5.0,
+    char_length_min: float = 5.0,
+    outfile: Path | None = None,
+    verbose: bool = False,
+    threads: int = 1,
+    algorithm3d: str = "delaunay",
+) -> Result:
+    """Run the surface, clip and mesh stages in memory.
+
+    The stages pass arrays to each other instead of writing and reading
+    files. Only the mesh is written to disk, and only if ``outfile`` is given.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Post-deletion points of shape ``(N, 3)``, e.g. ``atlas.Points.ED``.
+    clip : bool, optional
+        Clip the surfaces, by default False
+    mesh : bool, optional
+        Create a volumetric mesh from the (clipped) surfaces, by default False
+    origin : Sequence[float] | None, optional
+        Origin of the clipping plane, by default :func:`ukb.clip.default_origin`
+    normal : Sequence[float] | None, optional
+        Normal of the clipping plane, by default :func:`ukb.clip.default_normal`
+    smooth : bool, optional
+        Smooth the RV surface before clipping, by default True
+    smooth_iter : int, optional
+        Number of iterations to smooth the RV surface, by default 100
+    smooth_relaxation : float, optional
+        Relaxation factor to smooth the RV surface, by default 0.1
+    smooth_weights : Literal["uniform", "cotangent"], optional
+        Weights of the neighbors when smoothing the RV surface, by default "uniform"
+    char_length_max : float, optional
+        Maximum characteristic length of the mesh elements, by default 5.0
+    char_length_min : float, optional
+        Minimum characteristic length of the mesh elements, by default 5.0
+    outfile : Path | None, optional
+        Path to write the mesh to, by default None
+    verbose : bool, optional
+        Print verbose output from gmsh, by default False
+    threads : int, optional
+        Number of threads used by gmsh, by default 1
+    algorithm3d : str, optional
+        3D mesh algorithm, see :data:`ukb.mesh.algorithms_3d`, by default "delaunay"
+
+    Returns
+    -------
+    Result
+        The surfaces, clipped surfaces and mesh
+    """
+    surfaces = extract_surfaces(points)
+
+    clipped = None
+    if clip:
+        logger.info("Clipping surfaces")
+        clipped = clip_surfaces(
+            surfaces,
+            origin=origin,
+            normal=normal,
+            smooth=smooth,
+            smooth_iter=smooth_iter,
+            smooth_relaxation=smooth_relaxation,
+            smooth_weights=smooth_weights,
+        )
+
+    volume = None
+    if mesh:
+        from .mesh import generate_mesh
+
+        if clipped is not None:
+            shared_points, triangles = surface.merge_points(clipped)
+        else:
+            top = surface.topology()
+            shared_points = points
+            triangles = {name: top.global_triangles(name) for name in surface.surfaces}
+
+        logger.info("Creating mesh")
+        volume = generate_mesh(
+            shared_points,
+            triangles,
+            clipped=clipped is not None,
+            char_length_max=char_length_max,
+            char_length_min=char_length_min,
+            outfile=outfile,
+            verbose=verbose,
+            threads=threads,
+            algorithm3d=algorithm3d,
+        )
+
+    return Result(surfaces=surfaces, clipped=clipped, mesh=volume)
@@ -78,6 +78,31 @@ def add_parser_arguments(parser: ArgumentParser) -> None:
         default=".tsv",
         help='Suffix for the output files. By default ".tsv". Can be changed to ".csv".',
     )
+    parser.add_argument(
+        "--precision",
+        choices=["float32", "float64"],
+        default="float64",
+        help=(
+            "Floating point precision used to synthesize the points. float32 uses "
+            "half the memory and the deviation of the mean shape from float64 is logged."
+        ),
+    )
+    parser.add_argument(
+        "--scores",
+        type=Path,
+        default=None,
+        help=(
+            "File with one PCA score vector per row (.npy, .csv or .tsv). One point "
+            "cloud is written per row, and the rows are streamed from disk. "
+            "Overrides --mode and --std."
+        ),
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=256,
+        help="Number of score vectors synthesized at a time when using --scores.",
+    )
 
 
 def get_point_cloud(
@@ -116,6 +141,22 @@ def get_point_cloud(
     return points[keep], labels[keep], label_names
 
 
+def write_point_cloud(out_path: Path, points: np.ndarray) -> None:
+    """Write the labelled point cloud of a post-deletion points array.
+
+    The delimiter is a tab for ``.tsv`` files and a comma otherwise.
+    """
+    points, labels, label_names = get_point_cloud(points)
+    delimiter = "\t" if out_path.suffix == ".tsv" else ","
+    with out_path.open("w") as f:
+        f.write(f"x{delimiter}y{delimiter}z{delimiter}label{delimiter}region\n")
+        for (x, y, z), label in zip(points, labels):
+            f.write(
+                f"{x}{delimiter}{y}{delimiter}{z}{delimiter}{label}{delimiter}{label_names[label]}\n"
+            )
+    logger.info(f"Saved {out_path}")
+
+
 def main(
     folder: Path,
     all: bool = False,
@@ -125,6 +166,10 @@ def main(
     cache_dir: Path = Path.home() / ".ukb",
     case: Literal["ED", "ES", "both"] = "ED",
     suffix: str = ".tsv",
+    model: atlas.AtlasModel | None = None,
+    precision: Literal["float32", "float64"] = "float64",
+    scores: Path | None = None,
+    chunk_size: int = 256,
 ) -> None:
     """Export labelled point clouds from the UK Biobank atlas.
 
@@ -132,6 +177,10 @@ def main(
     - ``{case}_pointcloud{suffix}`` - file with columns
       ``x``, ``y``, ``z``, ``label`` (integer), ``region`` (surface name).
 
+    If ``scores`` is given, one file per score vector is written instead:
+    - ``{case}_pointcloud_{index}{suffix}`` where ``index`` is the zero padded
+      row number in the scores file.
+
     Parameters
     ----------
     folder : Path
@@ -151,6 +200,20 @@ def main(
     suffix : str
         Suffix for the output files. By default ``".tsv"`` (tab-separated).
         Can be changed to ``".csv"`` (comma-separated).
+    model : atlas.AtlasModel | None
+        If not None, generate points from this already loaded atlas instead of
+        reading the atlas from ``cache_dir``.
+    precision : str
+        Floating point precision used to synthesize the points, ``"float32"``
+        or ``"float64"``. Ignored if `model` is given.
+    scores : Path | None
+        File with one PCA score vector per row (``.npy``, ``.csv`` or ``.tsv``),
+        see :func:`ukb.atlas.read_scores`. The rows are streamed from disk, so
+        the number of rows is not limited by memory. This will override the
+        `mode` and `std` parameters.
+    chunk_size : int
+        Number of score vectors synthesized per matrix product when `scores`
+        is given.
     """
     assert suffix in {".tsv", ".csv"}, "Suffix must be either .tsv or .csv"
     folder = Path(folder)
@@ -164,25 +227,36 @@ def main(
         "verbose": verbose,
         "cache_dir": str(cache_dir),
         "case": case,
+        "model": model.name if model is not None else None,
+        "precision": precision,
+        "scores": str(scores) if scores is not None else None,
     }
     (folder / "parameters.json").write_text(json.dumps(params, indent=4, sort_keys=True))
 
-    cache_dir = Path(cache_dir)
-    cache_dir.mkdir(exist_ok=True, parents=True)
-    filename = atlas.download_atlas(cache_dir, all=all)
-    pts = atlas.generate_points(filename=filename, mode=mode, std=std)
-
     cases = ["ED", "ES"] if case == "both" else [case]
 
+    if model is None and (scores is not None or precision != "float64"):
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(exist_ok=True, parents=True)
+        filename = atlas.download_atlas(cache_dir, all=all)
+        model = atlas.AtlasModel.from_file(filename, dtype=precision)
+
+    if scores is not None:
+        assert model is not None
+        for index, pts in enumerate(
+            atlas.iter_points(model, scores, chunk_size=chunk_size, case=case)
+        ):
+            for c in cases:
+                write_point_cloud(folder / f"{c}_pointcloud_{index:06d}{suffix}", getattr(pts, c))
+        return
+
+    if model is not None:
+        pts = model.points(mode=mode, std=std, case=case)
+    else:
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(exist_ok=True, parents=True)
+        filename = atlas.download_atlas(cache_dir, all=all)
+        pts = atlas.generate_points(filename=filename, mode=mode, std=std, case=case)
+
     for c in cases:
-        points, labels, label_names = get_point_cloud(getattr(pts, c))
-
-        out_path = folder / f"{c}_pointcloud{suffix}"
-        delimiter = "\t" if suffix == ".tsv" else ","
-        with out_path.open("w") as f:
-            f.write(f"x{delimiter}y{delimiter}z{delimiter}label{delimiter}region\n")
-            for (x, y, z), label in zip(points, labels):
-                f.write(
-                    f"{x}{delimiter}{y}{delimiter}{z}{delimiter}{label}{delimiter}{label_names[label]}\n"
-                )
-        logger.info(f"Saved {out_path}")
+        write_point_cloud(folder / f"{c}_pointcloud{suffix}", getattr(pts, c))
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import logging
+import os
+from argparse import ArgumentParser
+from pathlib import Path
+
+from . import atlas
+
+logger = logging.getLogger(__name__)
+
+
+def add_parser_arguments(parser: ArgumentParser) -> None:
+    """Add parser arguments for repacking the atlas.
+
+    Parameters
+    ----------
+    parser : ArgumentParser
+        The argument parser to add arguments to.
+
+    """
+    parser.add_argument(
+        "filename",
+        type=Path,
+        nargs="?",
+        default=None,
+        help=(
+            "Path to the atlas file to repack. This can be a UK Biobank .h5 file "
+            "or a Burns .mat file. If not provided, the UK Biobank atlas in the "
+            "cache directory is used (and downloaded if needed)."
+        ),
+    )
+    parser.add_argument(
+        "-a",
+        "--all",
+        action="store_true",
+        help=(
+            "Use the PCA atlas derived from all 4,329 subjects from the UK "
+            "Biobank Study. By default we use the PCA atlas derived from 630 healthy "
+            "reference subjects from the UK Biobank Study"
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=os.environ.get("UKB_CACHE_DIR", Path.home() / ".ukb"),
+        help=(
+            "Directory to save the downloaded atlas. "
+            "Can also be set with the UKB_CACHE_DIR environment variable. "
+            "By default ~/.ukb"
+        ),
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Print verbose output.",
+    )
+
+
+def main(
+    filename: Path | None = None,
+    all: bool = False,
+    cache_dir: Path = Path.home() / ".ukb",
+) -> Path:
+    """Repack an atlas into a directory of memory mappable ``.npy`` files.
+
+    The repacked copy is saved next to the atlas file, where the other
+    commands look for it.
+
+    Parameters
+    ----------
+    filename : Path | None
+        Path to the atlas file. If None, use the UK Biobank atlas in
+        ``cache_dir``.
+    all : bool
+        If true, use the PCA atlas derived from all 4,329 subjects.
+    cache_dir : Path
+        Directory where the atlas is cached / downloaded to.
+
+    Returns
+    -------
+    Path
+        Path to the repacked atlas.
+    """
+    if filename is None:
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(exist_ok=True, parents=True)
+        filename = atlas.download_atlas(cache_dir, all=all)
+
+    path = atlas.repack(filename)
+    logger.info(f"Saved repacked atlas to {path}")
+    return path
@@ -0,0 +1,589 @@
+from __future__ import annotations
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Callable, Literal, NamedTuple, Sequence
+import functools
+import json
+import logging
+import os
+
+import numpy as np
+
+from . import atlas, clip as _clip, mesh, surface
+from .cache import file_hash
+from .smooth import Weights
+
+logger = logging.getLogger(__name__)
+
+
+def add_parser_arguments(parser: ArgumentParser) -> None:
+    """Add parser arguments for running the whole pipeline.
+
+    Parameters
+    ----------
+    parser : ArgumentParser
+        The argument parser to add arguments to.
+
+    """
+    parser.add_argument(
+        "folder",
+        type=Path,
+        help="Directory to save the surfaces and meshes.",
+    )
+    parser.add_argument(
+        "-a",
+        "--all",
+        action="store_true",
+        help="Use the PCA atlas derived from all 4,329 subjects from the UK Biobank Study.",
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        type=int,
+        default=-1,
+        help="Mode to generate points from. If -1, generate points from the mean shape.",
+    )
+    parser.add_argument(
+        "--std",
+        type=float,
+        default=1.5,
+        help="Standard deviation to scale the mode by.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=os.environ.get("UKB_CACHE_DIR", Path.home() / ".ukb"),
+        help=(
+            "Directory to save the downloaded atlas. "
+            "Can also be set with the UKB_CACHE_DIR environment variable."
+        ),
+    )
+    parser.add_argument(
+        "-c",
+        "--case",
+        choices=["ED", "ES", "both"],
+        default="ED",
+        help="Case to generate the mesh for.",
+    )
+    parser.add_argument(
+        "--burns-path",
+        type=Path,
+        default=None,
+        help="Path to the burns atlas file.",
+    )
+    parser.add_argument(
+        "--precision",
+        choices=["float32", "float64"],
+        default="float64",
+        help="Floating point precision used to synthesize the points.",
+    )
+    parser.add_argument(
+        "--clip",
+        action="store_true",
+        help="Clip the surfaces before meshing.",
+    )
+    parser.add_argument(
+        "--origin",
+        type=float,
+        nargs=3,
+        default=list(_clip.default_origin()),
+        help="Origin of the clipping plane.",
+    )
+    parser.add_argument(
+        "--normal",
+        type=float,
+        nargs=3,
+        default=list(_clip.default_normal()),
+        help="Normal of the clipping plane.",
+    )
+    parser.add_argument(
+        "--auto-plane",
+        action="store_true",
+        help="Fit the clipping plane to the valve nodes of each shape.",
+    )
+    parser.add_argument(
+        "--plane-offset",
+        type=float,
+        default=0.0,
+        help="Distance to move the fitted clipping plane towards the apex.",
+    )
+    parser.add_argument(
+        "--smooth",
+        action="store_true",
+        help="Smooth the RV surface before clipping.",
+    )
+    parser.add_argument(
+        "--smooth-iter",
+        type=int,
+        default=100,
+        help="Number of iterations to smooth the RV surface.",
+    )
+    parser.add_argument(
+        "--smooth-relaxation",
+        type=float,
+        default=0.1,
+        help="Relaxation factor to smooth the RV surface.",
+    )
+    parser.add_argument(
+        "--smooth-weights",
+        choices=["uniform", "cotangent"],
+        default="uniform",
+        help="Weights of the neighbors when smoothing the RV surface.",
+    )
+    parser.add_argument(
+        "--char_length_max",
+        type=float,
+        default=5.0,
+        help="Maximum characteristic length of the mesh elements.",
+    )
+    parser.add_argument(
+        "--char_length_min",
+        type=float,
+        default=5.0,
+        help="Minimum characteristic length of the mesh elements.",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of threads used by gmsh.",
+    )
+    parser.add_argument(
+        "--algorithm3d",
+        choices=["delaunay", "initial", "frontal", "mmg3d", "rtree", "hxt"],
+        default="delaunay",
+        help="3D mesh algorithm used by gmsh.",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Run all stages, also those that are up to date.",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Print verbose output.",
+    )
+
+
+class Stage(NamedTuple):
+    """A step of the pipeline for one case.
+
+    Attributes
+    ----------
+    name : str
+        Name of the stage, e.g. "mesh:ED"
+    inputs : list[Path]
+        Files the stage reads
+    outputs : list[Path]
+        Files the stage writes
+    parameters : dict[str, Any]
+        Parameters that change the outputs, must be JSON serializable
+    """
+
+    name: str
+    inputs: list[Path]
+    outputs: list[Path]
+    parameters: dict[str, Any]
+
+
+# SHA-256 of files by (resolved path, size, modification time in ns)
+KnownHashes = dict[tuple[str, int, int], str]
+
+
+def _file_record(path: Path, known: KnownHashes) -> dict[str, Any]:
+    """SHA-256, size and modification time of a file. The file is only read
+    if ``known`` has no hash for it with the same size and modification time."""
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    if key not in known:
+        known[key] = file_hash(path)
+    return {"sha256": known[key], "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _files(folder: Path, paths: Sequence[Path], known: KnownHashes) -> dict[str, dict[str, Any]]:
+    """Records of the files, keyed by the path relative to ``folder`` if the
+    file is in ``folder``."""
+    return {
+        str(path.relative_to(folder) if path.is_relative_to(folder) else path): _file_record(
+            path, known
+        )
+        for path in paths
+    }
+
+
+def _record(folder: Path, stage: Stage, known: KnownHashes) -> dict[str, Any]:
+    return {
+        "parameters": stage.parameters,
+        "inputs": _files(folder, stage.inputs, known),
+        "outputs": _files(folder, stage.outputs, known),
+    }
+
+
+def _known_hashes(folder: Path, record: dict[str, Any] | None) -> KnownHashes:
+    """The file hashes of a stage record, see :func:`up_to_date`."""
+    known: KnownHashes = {}
+    for files in [] if record is None else [record["inputs"], record["outputs"]]:
+        for name, file in files.items():
+            # Relative to folder, unless the path is absolute
+            key = (str((folder / name).resolve()), file["size"], file["mtime_ns"])
+            known[key] = file["sha256"]
+    return known
+
+
+def up_to_date(
+    folder: Path,
+    stage: Stage,
+    record: dict[str, Any] | None,
+    known: KnownHashes | None = None,
+) -> bool:
+    """Check if the outputs of a stage are up to date.
+
+    The outputs are up to date if the stage ran before with the same
+    parameters on inputs with the same content, and the outputs have not
+    changed since. Files with the same size and modification time as when
+    they were recorded are not read again.
+
+    Parameters
+    ----------
+    folder : Path
+        Output folder of the pipeline
+    stage : Stage
+        The stage
+    record : dict[str, Any] | None
+        What the stage recorded the last time it ran, or None
+    known : KnownHashes | None, optional
+        Known hashes of files by path, size and modification time, updated
+        with the files that are hashed. By default the hashes in ``record``
+
+    Returns
+    -------
+    bool
+        True if the stage can be skipped
+    """
+    if record is None or record.get("parameters") != stage.parameters:
+        return False
+    if not all(path.exists() for path in stage.inputs + stage.outputs):
+        return False
+    if known is None:
+        known = _known_hashes(folder, record)
+    current = _record(folder, stage, known)
+    return all(
+        {name: file["sha256"] for name, file in current[key].items()}
+        == {name: file["sha256"] for name, file in record[key].items()}
+        for key in ("inputs", "outputs")
+    )
+
+
+class Pipeline:
+    """Stages of the pipeline and what they recorded in ``parameters.json``.
+
+    Parameters
+    ----------
+    folder : Path
+        Output folder of the pipeline
+    force : bool, optional
+        Run all stages, also those that are up to date, by default False
+    """
+
+    def __init__(self, folder: Path, force: bool = False) -> None:
+        self.folder = folder
+        self.force = force
+        self.path = folder / "parameters.json"
+        self.parameters: dict[str, Any] = {}
+        if self.path.exists():
+            self.parameters = json.loads(self.path.read_text())
+        self.parameters.setdefault("stages", {})
+        # Shared by all stages, so a file used by several stages, like the
+        # atlas, is hashed at most once
+        self.known: KnownHashes = {}
+        for record in self.parameters["stages"].values():
+            self.known.update(_known_hashes(folder, record))
+
+    def run(self, stage: Stage, func: Callable[[], None]) -> bool:
+        """Run ``func`` unless the outputs of ``stage`` are up to date.
+
+        Returns
+        -------
+        bool
+            True if the stage was run
+        """
+        record = self.parameters["stages"].get(stage.name)
+        if not self.force and up_to_date(self.folder, stage, record, self.known):
+            logger.info(f"{stage.name} is up to date")
+            # Files that were touched without changing are not hashed again
+            current = _record(self.folder, stage, self.known)
+            if current != record:
+                self.parameters["stages"][stage.name] = current
+                self.save()
+            return False
+
+        logger.info(f"Running {stage.name}")
+        func()
+        self.parameters["stages"][stage.name] = _record(self.folder, stage, self.known)
+        self.save()
+        return True
+
+    def save(self) -> None:
+        self.path.write_text(json.dumps(self.parameters, indent=4, sort_keys=True))
+
+
+def main(
+    folder: Path,
+    all: bool = False,
+    mode: int = -1,
+    std: float = 1.5,
+    cache_dir: Path = Path.home() / ".ukb",
+    case: Literal["ED", "ES", "both"] = "ED",
+    burns_path: Path | None = None,
+    precision: Literal["float32", "float64"] = "float64",
+    clip: bool = False,
+    origin: Sequence[float] = _clip.default_origin(),
+    normal: Sequence[float] = _clip.default_normal(),
+    auto_plane: bool = False,
+    plane_offset: float = 0.0,
+    smooth: bool = False,
+    smooth_iter: int = 100,
+    smooth_relaxation: float = 0.1,
+    smooth_weights: Weights = "uniform",
+    char_length_max: float = 5.0,
+    char_length_min: float = 5.0,
+    threads: int = 1,
+    algorithm3d: str = "delaunay",
+    force: bool = False,
+    verbose: bool = False,
+) -> None:
+    """Create the meshes from the atlas in one process.
+
+    The stages surfaces, clip (optional) and mesh are run for each case.
+    Each stage records its parameters and the SHA-256 of its inputs and
+    outputs under ``"stages"`` in ``parameters.json``, and is skipped if
+    they have not changed since it last ran. Along with the hashes, the size
+    and modification time of the files are recorded, and files where these
+    have not changed are not read again.
+
+    - The surfaces stage generates the points from the atlas and writes them
+      with the triangles of all surfaces to ``{case}_surfaces.npz``, see
+      :func:`ukb.surface.write_container`.
+    - The clip stage writes ``{name}_clipped_{case}.ply``, see
+      :func:`ukb.clip.clip_surfaces`.
+    - The mesh stage writes ``{case}.msh``, or ``{case}_clipped.msh`` if the
+      surfaces are clipped, see :func:`ukb.mesh.generate_mesh`.
+
+    Parameters
+    ----------
+    folder : Path
+        Directory to save the surfaces and meshes.
+    all : bool, optional
+        Use the PCA atlas derived from all subjects, see :func:`ukb.surface.main`.
+        By default False
+    mode : int, optional
+        Mode to generate points from. If -1, generate points from the mean
+        shape. By default -1
+    std : float, optional
+        Standard deviation to scale the mode by, by default 1.5
+    cache_dir : Path, optional
+        Directory to save the downloaded atlas, by default ~/.ukb
+    case : Literal["ED", "ES", "both"], optional
+        Case to generate the mesh for, by default "ED"
+    burns_path : Path | None, optional
+        Path to the burns atlas file, by default None
+    precision : Literal["float32", "float64"], optional
+        Floating point precision used to synthesize the points, by default "float64"
+    clip : bool, optional
+        Clip the surfaces before meshing, by default False
+    origin : Sequence[float], optional
+        Origin of the clipping plane, by default :func:`ukb.clip.default_origin`
+    normal : Sequence[float], optional
+        Normal of the clipping plane, by default :func:`ukb.clip.default_normal`
+    auto_plane : bool, optional
+        Fit the clipping plane to the valve nodes of each case, see
+        :func:`ukb.clip.base_plane`. By default False
+    plane_offset : float, optional
+        Distance to move the fitted plane towards the apex, by default 0.0
+    smooth : bool, optional
+        Smooth the RV surface before clipping, by default False
+    smooth_iter : int, optional
+        Number of iterations to smooth the RV surface, by default 100
+    smooth_relaxation : float, optional
+        Relaxation factor to smooth the RV surface, by default 0.1
+    smooth_weights : Literal["uniform", "cotangent"], optional
+        Weights of the neighbors when smoothing the RV surface, by default "uniform"
+    char_length_max : float, optional
+        Maximum characteristic length of the mesh elements, by default 5.0
+    char_length_min : float, optional
+        Minimum characteristic length of the mesh elements, by default 5.0
+    threads : int, optional
+        Number of threads used by gmsh, by default 1
+    algorithm3d : str, optional
+        3D mesh algorithm, see :data:`ukb.mesh.algorithms_3d`, by default "delaunay"
+    force : bool, optional
+        Run all stages, also those that are up to date, by default False
+    verbose : bool, optional
+        Print verbose output from gmsh, by default False
+    """
+    folder.mkdir(exist_ok=True, parents=True)
+    pipeline = Pipeline(folder, force=force)
+    pipeline.parameters.update(
+        {
+            "folder": str(folder),
+            "all": all,
+            "mode": mode,
+            "std": std,
+            "cache_dir": str(cache_dir),
+            "case": case,
+            "burns_path": str(burns_path) if burns_path else None,
+            "precision": precision,
+        }
+    )
+
+    if burns_path is not None:
+        if not burns_path.exists():
+            raise ValueError(f"Burns path {burns_path} does not exist.")
+        filename = burns_path
+    else:
+        cache_dir.mkdir(exist_ok=True, parents=True)
+        filename = atlas.download_atlas(cache_dir, all=all)
+
+    @functools.cache
+    def generate_points() -> atlas.Points:
+        # Only generated if the surfaces of a case are out of date
+        if burns_path is not None:
+            return atlas.generate_points_burns(filename, mode=mode, std=std, case=case)
+        if precision == "float64":
+            return atlas.generate_points(filename, mode=mode, std=std, case=case)
+        model = atlas.AtlasModel.from_file(filename, dtype=precision)
+        return model.points(mode=mode, std=std, case=case)
+
+    for c in atlas.phases(case):
+        container = surface.container_path(folder, c)
+
+        def create_surfaces() -> None:
+            surface.write_container(container, getattr(generate_points(), c))
+            logger.info(f"Saved {container}")
+
+        pipeline.run(
+            Stage(
+                name=f"surfaces:{c}",
+                inputs=[filename],
+                outputs=[container],
+                parameters={"mode": mode, "std": std, "precision": precision},
+            ),
+            create_surfaces,
+        )
+
+        mesh_parameters = {
+            "char_length_max": char_length_max,
+            "char_length_min": char_length_min,
+            "algorithm3d": algorithm3d,
+            # HXT meshes in parallel, so its output can depend on the threads
+            "threads": threads,
+        }
+        if not clip:
+            outfile = folder / f"{c}.msh"
+            pipeline.run(
+                Stage(f"mesh:{c}", [container], [outfile], mesh_parameters),
+                lambda: _mesh(container, None, outfile, verbose, **mesh_parameters),
+            )
+            continue
+
+        clipped = {name: folder / f"{name}_clipped_{c}.ply" for name in mesh.clipped_surface_order}
+        # Only record the parameters that are used
+        clip_parameters: dict[str, Any] = {"auto_plane": auto_plane, "smooth": smooth}
+        if auto_plane:
+            clip_parameters["plane_offset"] = plane_offset
+        else:
+            clip_parameters.update(origin=list(origin), normal=list(normal))
+        if smooth:
+            clip_parameters.update(
+                smooth_iter=smooth_iter,
+                smooth_relaxation=smooth_relaxation,
+                smooth_weights=smooth_weights,
+            )
+        pipeline.run(
+            Stage(f"clip:{c}", [container], list(clipped.values()), clip_parameters),
+            lambda: _clip_surfaces(
+                container,
+                c,
+                clipped,
+                origin=origin,
+                normal=normal,
+                auto_plane=auto_plane,
+                plane_offset=plane_offset,
+                smooth=smooth,
+                smooth_iter=smooth_iter,
+                smooth_relaxation=smooth_relaxation,
+                smooth_weights=smooth_weights,
+            ),
+        )
+
+        outfile = folder / f"{c}_clipped.msh"
+        pipeline.run(
+            Stage(f"mesh:{c}_clipped", list(clipped.values()), [outfile], mesh_parameters),
+            lambda: _mesh(container, clipped, outfile, verbose, **mesh_parameters),
+        )
+
+
+def _clip_surfaces(
+    container: Path,
+    case: str,
+    outfiles: dict[str, Path],
+    origin: Sequence[float],
+    normal: Sequence[float],
+    auto_plane: bool,
+    plane_offset: float,
+    **kwargs,
+) -> None:
+    arrays = surface.read_container(container)
+    if auto_plane:
+        fitted_origin, fitted_normal = _clip.base_plane(arrays[0], offset=plane_offset)
+        origin, normal = fitted_origin.tolist(), fitted_normal.tolist()
+        logger.info(f"Plane of {case}: origin {origin}, normal {normal}")
+
+    clipped = _clip.clip_surfaces(
+        lv=_clip.read_surface(container.parent, "LV", case, arrays),
+        rv_sept=_clip.read_surface(container.parent, "RV", case, arrays),
+        rv_fw=_clip.read_surface(container.parent, "RVFW", case, arrays),
+        epi=_clip.read_surface(container.parent, "EPI", case, arrays),
+        origin=origin,
+        normal=normal,
+        **kwargs,
+    )
+    for name, path in outfiles.items():
+        surface.write_ply(path, clipped[name].points, clipped[name].triangles)
+        logger.info(f"Saved {path}")
+
+
+def _mesh(
+    container: Path,
+    clipped: dict[str, Path] | None,
+    outfile: Path,
+    verbose: bool,
+    **kwargs,
+) -> None:
+    if clipped is None:
+        points, triangles = surface.read_container(container)
+    else:
+        import meshio
+
+        surfaces: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        # Keyed like mesh.clipped_surface_order, which generate_mesh looks up
+        for name, path in clipped.items():
+            data = meshio.read(path)
+            surfaces[name] = (
+                np.asarray(data.points, dtype=np.float64),
+                data.cells_dict["triangle"],
+            )
+        points, triangles = surface.merge_points(surfaces)
+
+    mesh.generate_mesh(
+        points,
+        triangles,
+        clipped=clipped is not None,
+        outfile=outfile,
+        verbose=verbose,
+        **kwargs,
+    )
+    logger.info(f"Saved {outfile}")
@@ -0,0 +1,219 @@
+from __future__ import annotations
+from typing import Literal
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+Weights = Literal["uniform", "cotangent"]
+
+
+def _cotangent_weights(points: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    """Half the cotangent of the angle opposite to each edge ``(i, j)``,
+    ``(j, k)`` and ``(k, i)`` of each triangle, shape ``(M, 3)``."""
+    p = points[triangles]
+    cot = np.empty(triangles.shape)
+    for corner in range(3):
+        # The angle at a corner is opposite to the edge between the two others
+        a = p[:, (corner + 1) % 3] - p[:, corner]
+        b = p[:, (corner + 2) % 3] - p[:, corner]
+        cross = np.linalg.norm(np.cross(a, b), axis=1)
+        cot[:, (corner + 1) % 3] = np.einsum("ij,ij->i", a, b) / np.maximum(cross, 1e-300)
+    return 0.5 * cot
+
+
+def laplacian(
+    triangles: np.ndarray,
+    n_points: int | None = None,
+    weights: Weights = "uniform",
+    points: np.ndarray | None = None,
+    edge_angle: float = 15.0,
+):
+    """Averaging operator of the neighbors of each point of a surface.
+
+    Row ``i`` of the matrix holds the weights of the neighbors of point ``i``
+    and sums to one, so ``W @ x - x`` is the discrete Laplacian of ``x``.
+    Like VTK's ``vtkSmoothPolyDataFilter``, points on the boundary are only
+    averaged with their neighbors along the boundary so that holes keep their
+    shape, and points where the boundary is non-manifold or turns by more than
+    ``edge_angle`` degrees are their own average and stay fixed.
+
+    Parameters
+    ----------
+    triangles : np.ndarray
+        Triangles of shape ``(M, 3)``
+    n_points : int | None, optional
+        Number of points, by default ``triangles.max() + 1``
+    weights : Literal["uniform", "cotangent"], optional
+        Weights of the neighbors of interior points, by default "uniform".
+        Cotangent weights depend on the geometry and are clamped at zero.
+    points : np.ndarray | None, optional
+        Points of shape ``(N, 3)``. Required for cotangent weights and for
+        fixing boundary corners, which are not fixed if ``points`` is None.
+    edge_angle : float, optional
+        Angle in degrees above which a boundary point is fixed, by default 15
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Operator of shape ``(N, N)``
+    """
+    import scipy.sparse
+
+    triangles = np.asarray(triangles, dtype=np.int64)
+    if n_points is None:
+        n_points = int(triangles.max()) + 1
+    if weights == "cotangent" and points is None:
+        raise ValueError("Cotangent weights require the points")
+
+    # Undirected edges and how many triangles share them
+    half_edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    half_edges.sort(axis=1)
+    keys, inverse, counts = np.unique(
+        half_edges[:, 0] * n_points + half_edges[:, 1], return_inverse=True, return_counts=True
+    )
+    edges = np.column_stack([keys // n_points, keys % n_points])
+    if weights == "cotangent":
+        assert points is not None
+        edge_weights = np.zeros(len(edges))
+        np.add.at(edge_weights, inverse, _cotangent_weights(points, triangles).T.ravel())
+        edge_weights = np.maximum(edge_weights, 0.0)
+    else:
+        edge_weights = np.ones(len(edges))
+
+    # Points on boundary (or non-manifold) edges are only averaged with
+    # their neighbors along those edges, and points with other than two such
+    # edges are fixed
+    boundary = counts != 2
+    boundary_count = np.bincount(edges[boundary].ravel(), minlength=n_points)
+    on_boundary = boundary_count > 0
+    fixed = on_boundary & (boundary_count != 2)
+    edge_weights[boundary] = 1.0
+
+    rows = np.concatenate([edges[:, 0], edges[:, 1]])
+    cols = np.concatenate([edges[:, 1], edges[:, 0]])
+    data = np.concatenate([edge_weights, edge_weights])
+    keep = ~on_boundary[rows] | np.concatenate([boundary, boundary])
+    rows, cols, data = rows[keep], cols[keep], data[keep]
+
+    if points is not None:
+        # Fix boundary corners
+        neighbors = np.zeros((n_points, 2), dtype=np.int64)
+        candidates = np.flatnonzero(boundary_count == 2)
+        b_edges = edges[boundary]
+        ends = np.concatenate([b_edges, b_edges[:, ::-1]])
+        ends = ends[np.argsort(ends[:, 0], kind="stable")]
+        ends = ends[np.isin(ends[:, 0], candidates)]
+        neighbors[ends[::2, 0], 0] = ends[::2, 1]
+        neighbors[ends[1::2, 0], 1] = ends[1::2, 1]
+        l1 = points[neighbors[candidates, 0]] - points[candidates]
+        l2 = points[neighbors[candidates, 1]] - points[candidates]
+        l1 /= np.linalg.norm(l1, axis=1, keepdims=True)
+        l2 /= np.linalg.norm(l2, axis=1, keepdims=True)
+        corner = -np.einsum("ij,ij->i", l1, l2) < np.cos(np.radians(edge_angle))
+        fixed[candidates[corner]] = True
+
+    keep = ~fixed[rows]
+    matrix = scipy.sparse.coo_matrix(
+        (data[keep], (rows[keep], cols[keep])), shape=(n_points, n_points)
+    ).tocsr()
+    row_sums = np.asarray(matrix.sum(axis=1)).ravel()
+    scale = np.divide(1.0, row_sums, out=np.zeros(n_points), where=row_sums > 0)
+    # Fixed (and isolated) points are their own average
+    identity = scipy.sparse.diags((row_sums <= 0).astype(np.float64))
+    return (scipy.sparse.diags(scale) @ matrix + identity).tocsr()
+
+
+class LaplacianSmoothing:
+    """Laplacian smoothing of surfaces that share the same triangles.
+
+    Each iteration moves every point a fraction ``relaxation`` towards the
+    average of its neighbors, see :func:`laplacian`. The iteration matrix is
+    built once and applied to any shape, or to a batch of shapes at once,
+    with sparse matrix products. Unlike VTK, which updates the points in place
+    one by one, all points are updated together, so the result does not
+    depend on the order of the points.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        Matrix of one smoothing step, or of all steps if precomposed
+    n_iter : int
+        Number of times ``matrix`` is applied
+    """
+
+    def __init__(self, matrix, n_iter: int) -> None:
+        self.matrix = matrix
+        self.n_iter = n_iter
+
+    @classmethod
+    def compute(
+        cls,
+        triangles: np.ndarray,
+        n_points: int | None = None,
+        n_iter: int = 100,
+        relaxation: float = 0.1,
+        weights: Weights = "uniform",
+        reference: np.ndarray | None = None,
+        edge_angle: float = 15.0,
+        precompose: bool = False,
+    ) -> LaplacianSmoothing:
+        """Build the smoothing operator of a surface topology.
+
+        Parameters
+        ----------
+        triangles : np.ndarray
+            Triangles of shape ``(M, 3)``
+        n_points : int | None, optional
+            Number of points, by default ``triangles.max() + 1``
+        n_iter : int, optional
+            Number of iterations, by default 100
+        relaxation : float, optional
+            Relaxation factor, by default 0.1
+        weights : Literal["uniform", "cotangent"], optional
+            Weights of the neighbors, by default "uniform"
+        reference : np.ndarray | None, optional
+            Points of shape ``(N, 3)`` of a reference shape, used for the
+            cotangent weights and to find the fixed boundary corners
+        edge_angle : float, optional
+            Angle in degrees above which a boundary point is fixed, by default 15
+        precompose : bool, optional
+            Multiply the ``n_iter`` steps into a single matrix, by default
+            False. This pays off when smoothing many shapes, as long as the
+            product stays sparse, i.e. for few iterations on large surfaces.
+        """
+        import scipy.sparse
+
+        W = laplacian(triangles, n_points, weights=weights, points=reference, edge_angle=edge_angle)
+        step = ((1.0 - relaxation) * scipy.sparse.identity(W.shape[0]) + relaxation * W).tocsr()
+        operator = cls(step, n_iter)
+        if precompose:
+            operator = operator.precomposed()
+        return operator
+
+    def precomposed(self) -> LaplacianSmoothing:
+        """Return an operator with all steps multiplied into one matrix."""
+        import scipy.sparse
+
+        result = scipy.sparse.identity(self.matrix.shape[0], format="csr")
+        power, n = self.matrix, self.n_iter
+        # Exponentiation by squaring
+        while n > 0:
+            if n & 1:
+                result = result @ power
+            n >>= 1
+            if n > 0:
+                power = power @ power
+        logger.debug(f"Precomposed smoothing operator with {result.nnz} non-zeros")
+        return LaplacianSmoothing(result.tocsr(), 1)
+
+    def __call__(self, points: np.ndarray) -> np.ndarray:
+        """Smooth a shape of shape ``(N, 3)`` or a batch of shapes of shape
+        ``(B, N, 3)``."""
+        points = np.asarray(points, dtype=np.float64)
+        # Stack the coordinates of all shapes as columns
+        x = np.moveaxis(points, -2, 0).reshape(points.shape[-2], -1)
+        for _ in range(self.n_iter):
+            x = self.matrix @ x
+        return np.moveaxis(x.reshape((points.shape[-2],) + points.shape[:-2] + (3,)), 0, -2)
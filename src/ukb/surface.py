@@ -1,21 +1,44 @@
 from __future__ import annotations
 from pathlib import Path
+from textwrap import dedent
+import base64
+import functools
 import os
 import json
 from argparse import ArgumentParser
 
-import meshio
 import numpy as np
 import logging
-from typing import NamedTuple, Literal
+from typing import TYPE_CHECKING, Any, Iterable, NamedTuple, Literal
 
 from . import atlas
 
+if TYPE_CHECKING:
+    import meshio
+
 logger = logging.getLogger(__name__)
 here = Path(__file__).parent.absolute()
 
-connectivity_file = here / "connectivity.txt"
-connectivity = np.loadtxt(connectivity_file, dtype=int)
+connectivity_file = here / "connectivity.npy"
+
+
+@functools.cache
+def load_connectivity() -> np.ndarray:
+    """Load the triangles of the atlas, shape ``(M, 3)``, on first use.
+
+    The triangles are stored in binary form in ``connectivity.npy``, with
+    ``connectivity.txt`` as a fallback.
+    """
+    if connectivity_file.exists():
+        return np.load(connectivity_file).astype(int)
+    return np.loadtxt(connectivity_file.with_suffix(".txt"), dtype=int)
+
+
+def __getattr__(name: str) -> Any:
+    # Keep ``ukb.surface.connectivity`` working without loading it on import
+    if name == "connectivity":
+        return load_connectivity()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def add_parser_arguments(parser: ArgumentParser) -> None:
@@ -84,6 +107,29 @@ def add_parser_arguments(parser: ArgumentParser) -> None:
             "This will be a .mat file which will be loaded using scipy.io.loadmat. "
         ),
     )
+    parser.add_argument(
+        "--precision",
+        choices=["float32", "float64"],
+        default="float64",
+        help=(
+            "Floating point precision used to synthesize the points. float32 uses "
+            "half the memory and the deviation of the mean shape from float64 is logged."
+        ),
+    )
+    parser.add_argument(
+        "--container",
+        action="store_true",
+        help=(
+            "Write all surfaces of a case to a single file {case}_surfaces.npz "
+            "instead of one file per surface."
+        ),
+    )
+    parser.add_argument(
+        "--format",
+        choices=["stl", "ply", "vtp", "npz"],
+        default="stl",
+        help=("File format of the surfaces. Note that the mesh and clip commands read STL files."),
+    )
 
 
 def tolist(obj: np.ndarray | list) -> list:
@@ -106,6 +152,10 @@ def main(
     burns_path: Path | None = None,
     custom_points: atlas.Points | None = None,
     score: np.ndarray | None = None,
+    model: atlas.AtlasModel | None = None,
+    precision: Literal["float32", "float64"] = "float64",
+    format: Literal["stl", "ply", "vtp", "npz"] = "stl",
+    container: bool = False,
 ) -> None:
     """Main function to generate  surfas from the UK Biobank atlas.
 
@@ -139,6 +189,23 @@ def main(
         If not None, use these scores to generate points from the atlas instead of
         using the `mode` and `std` parameters. This will override the `mode` and
         `std` parameters if provided.
+    model : atlas.AtlasModel | None
+        If not None, generate points from this already loaded atlas instead of
+        reading the atlas from disk. This will override the `all` and `burns_path`
+        parameters.
+    precision : str
+        Floating point precision used to synthesize the points, ``"float32"``
+        or ``"float64"``. Ignored if `model` or `custom_points` is given.
+    format : str
+        File format of the surfaces. ``"stl"``, ``"ply"`` and ``"vtp"`` are
+        written as binary files and ``"npz"`` holds the ``points`` and
+        ``triangles`` arrays. Note that ``ukb-atlas mesh`` and
+        ``ukb-atlas clip`` read STL files.
+    container : bool
+        If true, write all surfaces of a case to a single file
+        ``{case}_surfaces.npz`` (see :func:`write_container`) instead of one
+        file per surface. The file can be read by ``ukb-atlas clip`` and
+        ``ukb-atlas mesh``.
 
     """
 
@@ -156,6 +223,10 @@ def main(
             "burns_path": str(burns_path) if burns_path else None,
             "custom_points": str(custom_points) if custom_points else None,
             "score": tolist(score) if score is not None else None,
+            "model": model.name if model is not None else None,
+            "precision": precision,
+            "format": format,
+            "container": container,
         },
         indent=4,
         sort_keys=True,
@@ -167,25 +238,34 @@ def main(
     if custom_points is not None:
         points = custom_points
 
+    elif model is not None:
+        points = model.points(mode=mode, std=std, score=score, case=case)
+
     else:
         if burns_path is not None:
             if not burns_path.exists():
                 raise ValueError(f"Burns path {burns_path} does not exist.")
+            filename = burns_path
+            generate_points = atlas.generate_points_burns
+        else:
+            cache_dir.mkdir(exist_ok=True, parents=True)
+            filename = atlas.download_atlas(cache_dir, all=all)
+            generate_points = atlas.generate_points
 
-            points = atlas.generate_points_burns(
-                filename=burns_path,
+        if precision == "float64":
+            points = generate_points(
+                filename=filename,
                 mode=mode,
                 std=std,
                 score=score,
+                case=case,
             )
         else:
-            cache_dir.mkdir(exist_ok=True, parents=True)
-            filename = atlas.download_atlas(cache_dir, all=all)
-
-            points = atlas.generate_points(
-                filename=filename,
+            points = atlas.AtlasModel.from_file(filename, dtype=precision).points(
                 mode=mode,
                 std=std,
+                score=score,
+                case=case,
             )
 
     if case == "both":
@@ -194,24 +274,257 @@ def main(
         cases = [case]
 
     for c in cases:
-        epi = get_epi_mesh(
-            points=getattr(points, c),
+        if container:
+            path = container_path(folder, c)
+            write_container(path, getattr(points, c))
+            logger.info(f"Saved {path}")
+            continue
+
+        for name in ["EPI", *valves, "LV", "RV", "RVFW"]:
+            surface_points, triangles = topology().extract(name, getattr(points, c))
+            path = folder / f"{name}_{c}.{format}"
+            write_surface(path, surface_points, triangles)
+            logger.info(f"Saved {path}")
+
+
+def container_path(folder: Path, case: str) -> Path:
+    """Path of the surface container of ``case`` in ``folder``."""
+    return Path(folder) / f"{case}_surfaces.npz"
+
+
+def write_container(path: Path, points: np.ndarray) -> None:
+    """Write all surfaces of a shape to a single ``.npz`` file.
+
+    The file holds the shared ``points`` array of shape ``(N, 3)``, the
+    surface ``names`` and for each surface an array ``triangles_{name}`` with
+    indices into ``points``.
+
+    Parameters
+    ----------
+    path : Path
+        Path to the output file.
+    points : np.ndarray
+        Post-deletion points of shape ``(N, 3)``.
+    """
+    top = topology()
+    arrays: dict[str, Any] = {"points": points, "names": np.array(list(surfaces))}
+    for name in surfaces:
+        arrays[f"triangles_{name}"] = top.global_triangles(name)
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def read_container(path: Path) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """Read a file written by :func:`write_container`.
+
+    Returns
+    -------
+    tuple[np.ndarray, dict[str, np.ndarray]]
+        The shared points and, for each surface, its triangles given as
+        indices into the points.
+    """
+    with np.load(path) as data:
+        return data["points"], {str(name): data[f"triangles_{name}"] for name in data["names"]}
+
+
+def find_container(folder: Path, case: str) -> Path | None:
+    """Return the surface container of ``case`` in ``folder`` if it exists
+    and is newer than the STL files of the same case, otherwise None.
+    """
+    path = container_path(folder, case)
+    if not path.exists():
+        return None
+    stl = Path(folder) / f"LV_{case}.stl"
+    if stl.exists() and stl.stat().st_mtime > path.stat().st_mtime:
+        return None
+    return path
+
+
+def merge_points(
+    surfaces: dict[str, tuple[np.ndarray, np.ndarray]], tol: float = 1e-8
+) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """Merge the points of surfaces that each have their own points.
+
+    Points closer than ``tol`` times the size of the bounding box are merged,
+    which is the same tolerance gmsh uses when removing duplicate nodes.
+
+    Parameters
+    ----------
+    surfaces : dict[str, tuple[np.ndarray, np.ndarray]]
+        Points and triangles of each surface. The triangles are indices into
+        the points of the same surface.
+    tol : float, optional
+        Relative tolerance, by default 1e-8
+
+    Returns
+    -------
+    tuple[np.ndarray, dict[str, np.ndarray]]
+        Shared points and the triangles of each surface given as indices into
+        the shared points
+    """
+    points = np.concatenate([p for p, _ in surfaces.values()])
+    offsets = np.cumsum([0] + [len(p) for p, _ in surfaces.values()])
+    size = np.linalg.norm(points.max(axis=0) - points.min(axis=0))
+    keys = np.round(points / (tol * size)).astype(np.int64)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    # Number the merged points in order of first appearance, so that surfaces
+    # with the same topology are merged into the same triangles
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    triangles = {
+        name: rank[inverse.ravel()[tri + offset]]
+        for (name, (_, tri)), offset in zip(surfaces.items(), offsets)
+    }
+    return points[first[order]], triangles
+
+
+def face_normals(points: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    """Return the unit normals of the triangles, shape ``(M, 3)``."""
+    p0, p1, p2 = (points[triangles[:, i]] for i in range(3))
+    normals = np.cross(p1 - p0, p2 - p0)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+
+_stl_dtype = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attr", "<u2")])
+
+
+def write_stl(path: Path, points: np.ndarray, triangles: np.ndarray) -> None:
+    """Write a triangle surface as a binary STL file.
+
+    Parameters
+    ----------
+    path : Path
+        Path to the output file.
+    points : np.ndarray
+        Points of shape ``(N, 3)``.
+    triangles : np.ndarray
+        Triangles of shape ``(M, 3)`` given as indices into ``points``.
+    """
+    records = np.zeros(len(triangles), dtype=_stl_dtype)
+    records["normal"] = face_normals(points, triangles)
+    records["vertices"] = points[triangles]
+    header = b"Binary STL written by ukb-atlas".ljust(80, b" ")
+    with open(path, "wb") as f:
+        f.write(header + np.uint32(len(triangles)).tobytes() + records.tobytes())
+
+
+def write_ply(path: Path, points: np.ndarray, triangles: np.ndarray) -> None:
+    """Write a triangle surface as a binary little endian PLY file.
+
+    Parameters
+    ----------
+    path : Path
+        Path to the output file.
+    points : np.ndarray
+        Points of shape ``(N, 3)``.
+    triangles : np.ndarray
+        Triangles of shape ``(M, 3)`` given as indices into ``points``.
+    """
+    header = (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        f"element vertex {len(points)}\n"
+        "property float x\n"
+        "property float y\n"
+        "property float z\n"
+        f"element face {len(triangles)}\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n"
+    )
+    faces = np.empty(len(triangles), dtype=[("count", "u1"), ("indices", "<i4", (3,))])
+    faces["count"] = 3
+    faces["indices"] = triangles
+    with open(path, "wb") as f:
+        f.write(
+            header.encode("ascii")
+            + np.ascontiguousarray(points, dtype="<f4").tobytes()
+            + faces.tobytes()
         )
-        epi.write(str(folder / f"EPI_{c}.stl"))
-        logger.info(f"Saved {folder / f'EPI_{c}.stl'}")
-
-        for valve in ["MV", "AV", "TV", "PV"]:
-            valve_mesh = get_valve_mesh(surface_name=valve, points=getattr(points, c))
-            valve_mesh.write(str(folder / f"{valve}_{c}.stl"))
-            logger.info(f"Saved {folder / f'{valve}_{c}.stl'}")
-
-        for chamber in ["LV", "RV", "RVFW"]:
-            chamber_mesh = get_chamber_mesh(
-                surface_name=chamber,
-                points=getattr(points, c),
-            )
-            chamber_mesh.write(str(folder / f"{chamber}_{c}.stl"))
-            logger.info(f"Saved {folder / f'{chamber}_{c}.stl'}")
+
+
+def _vtk_binary(array: np.ndarray) -> str:
+    data = np.ascontiguousarray(array).tobytes()
+    return base64.b64encode(np.uint32(len(data)).tobytes() + data).decode("ascii")
+
+
+def write_vtp(path: Path, points: np.ndarray, triangles: np.ndarray) -> None:
+    """Write a triangle surface as a VTK XML PolyData file with base64 encoded
+    binary data arrays.
+
+    Parameters
+    ----------
+    path : Path
+        Path to the output file.
+    points : np.ndarray
+        Points of shape ``(N, 3)``.
+    triangles : np.ndarray
+        Triangles of shape ``(M, 3)`` given as indices into ``points``.
+    """
+    offsets = np.arange(3, 3 * len(triangles) + 1, 3, dtype="<i4")
+    content = dedent(
+        f"""\
+        <?xml version="1.0"?>
+        <VTKFile type="PolyData" version="0.1" byte_order="LittleEndian" header_type="UInt32">
+          <PolyData>
+            <Piece NumberOfPoints="{len(points)}" NumberOfPolys="{len(triangles)}">
+              <Points>
+                <DataArray type="Float32" NumberOfComponents="3" format="binary">
+                  {_vtk_binary(np.asarray(points, dtype="<f4"))}
+                </DataArray>
+              </Points>
+              <Polys>
+                <DataArray type="Int32" Name="connectivity" format="binary">
+                  {_vtk_binary(np.asarray(triangles, dtype="<i4"))}
+                </DataArray>
+                <DataArray type="Int32" Name="offsets" format="binary">
+                  {_vtk_binary(offsets)}
+                </DataArray>
+              </Polys>
+            </Piece>
+          </PolyData>
+        </VTKFile>
+        """
+    )
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def write_surface(path: Path, points: np.ndarray, triangles: np.ndarray) -> None:
+    """Write a triangle surface in the format given by the suffix of ``path``.
+
+    ``.stl``, ``.ply`` and ``.vtp`` are written as binary files by
+    :func:`write_stl`, :func:`write_ply` and :func:`write_vtp`, ``.npz`` holds
+    the arrays ``points`` and ``triangles``, and any other format is written
+    with meshio.
+    """
+    path = Path(path)
+    if path.suffix == ".stl":
+        write_stl(path, points, triangles)
+    elif path.suffix == ".ply":
+        write_ply(path, points, triangles)
+    elif path.suffix == ".vtp":
+        write_vtp(path, points, triangles)
+    elif path.suffix == ".npz":
+        with open(path, "wb") as f:
+            np.savez(f, points=points, triangles=triangles)
+    else:
+        import meshio
+
+        meshio.Mesh(points=points, cells=[("triangle", triangles)]).write(path)
+
+
+@functools.lru_cache
+def _post_deletion_indices(vertex_range: tuple[tuple[int, int], ...]) -> np.ndarray:
+    original = np.concatenate([np.arange(start, end) for start, end in vertex_range])
+    unwanted_sorted = np.array(sorted(atlas.unwanted_nodes))
+    mask = ~np.isin(original, atlas.unwanted_nodes)
+    valid = original[mask]
+    shifts = np.searchsorted(unwanted_sorted, valid, side="left")
+    indices = valid - shifts
+    indices.flags.writeable = False
+    return indices
 
 
 class Surface(NamedTuple):
@@ -233,14 +546,10 @@ class Surface(NamedTuple):
         *original* indices, so this property converts them to the indices that
         are valid in the array returned by ``generate_points``.
 
-        Nodes that are themselves in ``unwanted_nodes`` are excluded.
+        Nodes that are themselves in ``unwanted_nodes`` are excluded. The
+        result is computed once per ``vertex_range`` and returned read-only.
         """
-        original = self.vertex_indices
-        unwanted_sorted = np.array(sorted(atlas.unwanted_nodes))
-        mask = ~np.isin(original, atlas.unwanted_nodes)
-        valid = original[mask]
-        shifts = np.searchsorted(unwanted_sorted, valid, side="left")
-        return valid - shifts
+        return _post_deletion_indices(tuple(map(tuple, self.vertex_range)))
 
     @property
     def face_indices(self):
@@ -278,71 +587,202 @@ surfaces = {
     "TV": Surface("TV", [(5654, 5693)], [(6752, 11616)]),
     "PV": Surface("PV", [(5694, 5729)], [(6752, 11616)]),
 }
+valves = ("MV", "AV", "TV", "PV")
 
 
-def get_mesh(faces, points, rows_to_keep) -> meshio.Mesh:
-    triangle_data_local = faces[rows_to_keep]
+def region_node_indices(names: Iterable[str]) -> np.ndarray:
+    """Return the sorted post-deletion node indices of the given surfaces.
 
-    node_indices_that_we_need = np.unique(triangle_data_local)
-    node_data_local = points[node_indices_that_we_need, :]
+    Parameters
+    ----------
+    names : Iterable[str]
+        Keys of :data:`surfaces`, e.g. ``["LV"]`` or ``["MV", "AV", "TV", "PV"]``.
+    """
+    names = list(names)
+    unknown = set(names) - set(surfaces)
+    if unknown:
+        raise ValueError(f"Unknown surface(s) {sorted(unknown)}. Choose from {list(surfaces)}")
+    return np.unique(
+        np.concatenate([surfaces[name].post_deletion_vertex_indices for name in names])
+    )
 
-    node_id_map_original_to_local = {
-        original: local for local, original in enumerate(node_indices_that_we_need)
-    }
 
-    # now apply the mapping to the triangle_data
-    for i in range(triangle_data_local.shape[0]):
-        triangle_data_local[i, 0] = node_id_map_original_to_local[triangle_data_local[i, 0]]
-        triangle_data_local[i, 1] = node_id_map_original_to_local[triangle_data_local[i, 1]]
-        triangle_data_local[i, 2] = node_id_map_original_to_local[triangle_data_local[i, 2]]
+def generate_region_points(
+    model: atlas.AtlasModel,
+    names: Iterable[str],
+    mode: int = -1,
+    std: float = 1.5,
+    score: np.ndarray | None = None,
+    case: Literal["ED", "ES", "both"] = "both",
+) -> atlas.Points:
+    """Generate only the nodes belonging to the given surfaces.
 
-    # node_indices_that_we_need = np.unique(triangle_data_local)
-    # node_data_local = points[node_indices_that_we_need, :]
+    Only the eigenvector columns of these nodes are used, so the cost per
+    shape scales with the size of the region rather than the full atlas.
 
-    return meshio.Mesh(points=node_data_local, cells=[("triangle", triangle_data_local)])
+    Parameters
+    ----------
+    model : atlas.AtlasModel
+        The loaded atlas.
+    names : Iterable[str]
+        Keys of :data:`surfaces`.
+    mode : int, optional
+        Mode to generate points from, by default -1
+    std : float, optional
+        Standard deviation to scale the mode by, by default 1.5
+    score : np.ndarray | None, optional
+        PCA scores to generate points from, by default None
+    case : str, optional
+        Which phase(s) to generate, by default "both"
+
+    Returns
+    -------
+    atlas.Points
+        Points where row ``i`` is node ``region_node_indices(names)[i]`` of the
+        array returned by :func:`ukb.atlas.generate_points`. The arrays are
+        read-only, see :meth:`ukb.atlas.AtlasModel.points_at`.
+    """
+    nodes = region_node_indices(names)
+    return model.points_at(nodes, mode=mode, std=std, score=score, case=case)
 
 
-def get_epi_mesh(points: np.ndarray) -> meshio.Mesh:
-    logger.debug("Getting EPI mesh")
-    faces = connectivity[surfaces["EPI"].face_indices, :]
-    triangle_should_be_removed = np.zeros(faces.shape[0], dtype=bool)
-    for valve_name in ["MV", "AV", "TV", "PV"]:
-        for start, end in surfaces[valve_name].vertex_range:
-            triangle_should_be_removed |= np.any(
+def get_mesh(faces, points, rows_to_keep) -> meshio.Mesh:
+    import meshio
+
+    node_data_local, triangle_data_local = _localize(faces[rows_to_keep])
+    return meshio.Mesh(points=points[node_data_local, :], cells=[("triangle", triangle_data_local)])
+
+
+def _localize(triangles: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Return the sorted global node indices used by ``triangles`` and the
+    triangles expressed in local indices into that array.
+    """
+    nodes, local = np.unique(triangles, return_inverse=True)
+    return nodes, local.reshape(triangles.shape)
+
+
+def _surface_rows(surface_name: str, faces: np.ndarray) -> np.ndarray:
+    """Rows of ``faces`` (the faces in the face range of ``surface_name``)
+    that belong to the surface.
+    """
+    if surface_name == "EPI":
+        triangle_should_be_removed = np.zeros(faces.shape[0], dtype=bool)
+        for valve_name in valves:
+            for start, end in surfaces[valve_name].vertex_range:
+                triangle_should_be_removed |= np.any(
+                    np.logical_and(
+                        faces >= start,
+                        faces <= end,
+                    ),
+                    axis=1,
+                )
+        return np.flatnonzero(np.logical_not(triangle_should_be_removed))
+
+    if surface_name in valves:
+        triangle_should_be_kept = np.zeros(faces.shape[0], dtype=bool)
+        for start, end in surfaces[surface_name].vertex_range:
+            triangle_should_be_kept |= np.any(
                 np.logical_and(
                     faces >= start,
                     faces <= end,
                 ),
                 axis=1,
             )
+        return np.flatnonzero(triangle_should_be_kept)
 
-    triangle_should_be_kept = np.logical_not(triangle_should_be_removed)
-    rows_to_keep = np.flatnonzero(triangle_should_be_kept)
-    return get_mesh(faces, points, rows_to_keep)
+    return np.arange(faces.shape[0])
 
 
-def get_valve_mesh(surface_name: str, points: np.ndarray) -> meshio.Mesh:
-    logger.debug(f"Getting valve mesh for {surface_name}")
-    faces = connectivity[surfaces[surface_name].face_indices, :]
-    triangle_should_be_kept = np.zeros(faces.shape[0], dtype=bool)
-
-    for start, end in surfaces[surface_name].vertex_range:
-        triangle_should_be_kept |= np.any(
-            np.logical_and(
-                faces >= start,
-                faces <= end,
-            ),
-            axis=1,
-        )
+class SurfaceTopology(NamedTuple):
+    """Node indices and triangles of every surface in :data:`surfaces`.
+
+    The topology is the same for every shape in the atlas, so extracting a
+    surface for a new shape is a single gather ``points[nodes[name]]``.
+
+    Parameters
+    ----------
+    nodes : dict[str, np.ndarray]
+        For each surface, the sorted indices of its nodes in the
+        post-deletion points array.
+    triangles : dict[str, np.ndarray]
+        For each surface, triangles of shape ``(M, 3)`` given as indices
+        into ``nodes[name]``.
+    """
 
-    rows_to_keep = np.flatnonzero(triangle_should_be_kept)
+    nodes: dict[str, np.ndarray]
+    triangles: dict[str, np.ndarray]
+
+    @classmethod
+    def compute(cls) -> SurfaceTopology:
+        """Compute the topology from :data:`connectivity` and :data:`surfaces`."""
+        nodes = {}
+        triangles = {}
+        for name, surface in surfaces.items():
+            faces = load_connectivity()[surface.face_indices, :]
+            nodes[name], triangles[name] = _localize(faces[_surface_rows(name, faces)])
+        return cls(nodes=nodes, triangles=triangles)
+
+    def save(self, path: Path) -> None:
+        """Save the topology to an ``.npz`` file."""
+        arrays: dict[str, Any] = {f"nodes_{name}": array for name, array in self.nodes.items()}
+        arrays.update({f"triangles_{name}": array for name, array in self.triangles.items()})
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: Path) -> SurfaceTopology:
+        """Load a topology saved with :meth:`save`."""
+        with np.load(path) as data:
+            return cls(
+                nodes={name: data[f"nodes_{name}"] for name in surfaces},
+                triangles={name: data[f"triangles_{name}"] for name in surfaces},
+            )
 
-    return get_mesh(faces, points, rows_to_keep)
+    def extract(self, surface_name: str, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Return the points and triangles of ``surface_name`` for a shape.
+
+        Parameters
+        ----------
+        surface_name : str
+            Key of :data:`surfaces`.
+        points : np.ndarray
+            Post-deletion points of shape ``(N, 3)``, or a stack of shapes of
+            shape ``(..., N, 3)``.
+        """
+        return points[..., self.nodes[surface_name], :], self.triangles[surface_name]
+
+    def global_triangles(self, surface_name: str) -> np.ndarray:
+        """Return the triangles of ``surface_name`` as indices into the
+        post-deletion points of a shape, i.e. with nodes shared between
+        surfaces.
+        """
+        return self.nodes[surface_name][self.triangles[surface_name]]
+
+    def mesh(self, surface_name: str, points: np.ndarray) -> meshio.Mesh:
+        """Return the surface ``surface_name`` of a shape as a meshio mesh."""
+        import meshio
+
+        surface_points, triangles = self.extract(surface_name, points)
+        return meshio.Mesh(points=surface_points, cells=[("triangle", triangles.copy())])
+
+
+@functools.cache
+def topology() -> SurfaceTopology:
+    """The :class:`SurfaceTopology` of the atlas, computed once per process."""
+    logger.debug("Computing surface topology")
+    return SurfaceTopology.compute()
+
+
+def get_epi_mesh(points: np.ndarray) -> meshio.Mesh:
+    logger.debug("Getting EPI mesh")
+    return topology().mesh("EPI", points)
+
+
+def get_valve_mesh(surface_name: str, points: np.ndarray) -> meshio.Mesh:
+    logger.debug(f"Getting valve mesh for {surface_name}")
+    return topology().mesh(surface_name, points)
 
 
 def get_chamber_mesh(surface_name: str, points: np.ndarray) -> meshio.Mesh:
     logger.debug(f"Getting chamber mesh for {surface_name}")
-    faces = connectivity[surfaces[surface_name].face_indices, :]
-    triangle_should_be_kept = np.ones(faces.shape[0], dtype=bool)
-    rows_to_keep = np.flatnonzero(triangle_should_be_kept)
-    return get_mesh(faces, points, rows_to_keep)
+    return topology().mesh(surface_name, points)
@@ -1,3 +1,5 @@
+import h5py
+import numpy as np
 import pytest
 
 from ukb import atlas
@@ -11,3 +13,49 @@ def atlas_path(tmp_path_factory):
     # Download the healthy reference atlas (all=False)
     path = atlas.download_atlas(outdir=cache_dir, all=False)
     return path
+
+
+@pytest.fixture(scope="session")
+def synthetic_atlas_path(tmp_path_factory):
+    """Small random atlas with the same layout as the UK Biobank HDF5 file.
+
+    MU is stored as ``(2 * 3 * N, 1)``, COEFF as ``(modes, 2 * 3 * N)``
+    and LATENT as ``(1, modes)`` where ``N = 5810`` is the number of nodes
+    per phase before ``atlas.unwanted_nodes`` are removed.
+    """
+    rng = np.random.default_rng(42)
+    num_modes = 10
+    size = 2 * 3 * 5810
+    path = tmp_path_factory.mktemp("synthetic_atlas") / "synthetic.h5"
+    with h5py.File(path, "w") as hdf:
+        hdf["MU"] = rng.normal(0, 10, (size, 1))
+        hdf["COEFF"] = np.linalg.qr(rng.normal(0, 1, (size, num_modes)))[0].T
+        hdf["LATENT"] = np.sort(rng.uniform(1, 100, (1, num_modes)))[:, ::-1]
+    return path
+
+
+@pytest.fixture
+def synthetic_cache_dir(tmp_path, synthetic_atlas_path):
+    """Cache directory where the synthetic atlas stands in for the downloaded
+    UK Biobank atlas, so that the command line interface runs offline.
+    """
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    (cache_dir / "UKBRVLV.h5").write_bytes(synthetic_atlas_path.read_bytes())
+    return cache_dir
+
+
+@pytest.fixture(scope="session")
+def sphere_surfaces():
+    """A closed sphere split into one surface per octant, named after the
+    surfaces of the biventricular mesh, as ``(points, triangles)``.
+    """
+    pv = pytest.importorskip("pyvista")
+    from ukb import mesh
+
+    sphere = pv.Sphere(radius=20.0, theta_resolution=40, phi_resolution=40).triangulate().clean()
+    points = np.asarray(sphere.points, dtype=np.float64)
+    triangles = sphere.faces.reshape(-1, 4)[:, 1:]
+    centers = points[triangles].mean(axis=1)
+    octant = 4 * (centers[:, 0] > 0) + 2 * (centers[:, 1] > 0) + (centers[:, 2] > 0)
+    return points, {name: triangles[octant == i] for i, name in enumerate(mesh.surface_order)}
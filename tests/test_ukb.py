@@ -1,11 +1,21 @@
 import json
+import os
+import subprocess
+import sys
 from unittest.mock import patch
 
 import pytest
 import h5py
+import meshio
 import numpy as np
+import scipy.io
 
+import ukb.cache
 import ukb.cli
+import ukb.mesh
+import ukb.morph
+import ukb.pipeline
+import ukb.smooth
 import ukb.surface
 from ukb import atlas
 
@@ -164,3 +174,938 @@ def test_pointcloud(tmp_path, atlas_path, suffix, case):
     for c in cases:
         path = tmp_path / f"{c}_pointcloud{suffix}"
         assert path.exists()
+
+
+def test_atlas_model_matches_generate_points(synthetic_atlas_path):
+    model = atlas.AtlasModel.from_file(synthetic_atlas_path)
+    assert model.num_modes == 10
+
+    for kwargs in [{"mode": -1}, {"mode": 3, "std": -0.7}, {"score": np.linspace(-1, 1, 5)}]:
+        expected = atlas.generate_points(synthetic_atlas_path, **kwargs)
+        points = atlas.generate_points(model, **kwargs)
+        assert np.allclose(points.ED, expected.ED)
+        assert np.allclose(points.ES, expected.ES)
+
+    with pytest.raises(ValueError, match="Mode 10 is out of bounds"):
+        model.points(mode=10)
+
+
+def test_atlas_model_lru_cache(synthetic_atlas_path):
+    model = atlas.AtlasModel.from_file(synthetic_atlas_path, cache_size=2)
+    first = model.points(mode=0, std=1.0)
+    assert model.points(mode=0, std=1.0) is first
+    assert model.points(score=np.ones(3)) is model.points(score=np.ones(3))
+    assert not first.ED.flags.writeable
+
+    model.points(mode=1, std=1.0)
+    model.points(mode=2, std=1.0)
+    assert model.points(mode=0, std=1.0) is not first
+
+
+def test_surface_main_with_model(tmp_path, synthetic_atlas_path):
+    model = atlas.AtlasModel.from_file(synthetic_atlas_path)
+    ukb.surface.main(tmp_path, mode=1, std=0.5, case="ES", model=model)
+    params = json.loads((tmp_path / "parameters.json").read_text())
+    assert params["model"] == str(synthetic_atlas_path)
+    for name in ukb.surface.surfaces:
+        assert (tmp_path / f"{name}_ES.stl").exists()
+
+
+@pytest.mark.parametrize("chunk_size", [None, 2])
+def test_generate_points_batch(synthetic_atlas_path, chunk_size):
+    model = atlas.AtlasModel.from_file(synthetic_atlas_path)
+    scores = np.random.default_rng(1).normal(0, 1, (5, 4))
+    batch = atlas.generate_points_batch(model, scores, chunk_size=chunk_size)
+    assert batch.shape == (5, 2, len(model.points().ED), 3)
+    for score, shape in zip(scores, batch):
+        expected = atlas.generate_points(synthetic_atlas_path, score=score)
+        assert np.allclose(shape[0], expected.ED)
+        assert np.allclose(shape[1], expected.ES)
+
+
+def test_generate_points_batch_burns_layout(synthetic_atlas_path):
+    with h5py.File(synthetic_atlas_path, "r") as hdf:
+        burns = {
+            "MU": np.asarray(hdf["MU"]).T,
+            "COEFF": np.asarray(hdf["COEFF"]).T,
+            "LATENT": np.asarray(hdf["LATENT"]).T,
+        }
+    model = atlas.AtlasModel.from_atlas_file(burns)
+    scores = np.random.default_rng(2).normal(0, 1, (3, 10))
+    batch = atlas.generate_points_batch(model, scores)
+    expected = atlas.generate_points_batch(synthetic_atlas_path, scores)
+    assert np.allclose(batch, expected)
+
+
+@pytest.mark.parametrize("case", ["ED", "ES"])
+def test_generate_points_single_phase(synthetic_atlas_path, case):
+    other = "ES" if case == "ED" else "ED"
+    model = atlas.AtlasModel.from_file(synthetic_atlas_path)
+    for kwargs in [{"mode": -1}, {"mode": 2, "std": 1.2}, {"score": np.linspace(-1, 1, 6)}]:
+        both = atlas.generate_points(synthetic_atlas_path, **kwargs)
+        for points in [
+            atlas.generate_points(synthetic_atlas_path, case=case, **kwargs),
+            model.points(case=case, **kwargs),
+        ]:
+            assert getattr(points, other) is None
+            assert np.allclose(getattr(points, case), getattr(both, case))
+
+    scores = np.random.default_rng(3).normal(0, 1, (4, 3))
+    batch = model.points_batch(scores, case=case)
+    assert batch.shape[1] == 1
+    assert np.allclose(batch[:, 0], model.points_batch(scores)[:, ["ED", "ES"].index(case)])
+
+
+def test_compute_S_single_phase_burns_layout(synthetic_atlas_path):
+    with h5py.File(synthetic_atlas_path, "r") as hdf:
+        S = atlas.compute_S(hdf, mode=4, std=0.5)
+        burns = {
+            "MU": np.asarray(hdf["MU"]).T,
+            "COEFF": np.asarray(hdf["COEFF"]).T,
+            "LATENT": np.asarray(hdf["LATENT"]).T,
+        }
+    N = S.size // 2
+    assert np.allclose(atlas.compute_S(burns, mode=4, std=0.5, case="ES").ravel(), S[0, N:])
+    assert np.allclose(atlas.compute_S(burns, mode=4, std=0.5, case="ED").ravel(), S[0, :N])
+
+
+def test_generate_region_points(synthetic_atlas_path):
+    model = atlas.AtlasModel.from_file(synthetic_atlas_path)
+    names = ["LV", "MV", "AV"]
+    nodes = ukb.surface.region_node_indices(names)
+    assert np.all(np.diff(nodes) > 0)
+
+    score = np.linspace(-2, 2, 7)
+    full = model.points(score=score)
+    full_mean = model.points()
+    region = ukb.surface.generate_region_points(model, names, score=score)
+    assert region.ED.shape == (len(nodes), 3)
+    assert np.allclose(region.ED, full.ED[nodes])
+    assert np.allclose(region.ES, full.ES[nodes])
+
+    region = ukb.surface.generate_region_points(model, ["RVFW"], mode=1, std=0.5, case="ES")
+    assert region.ED is None
+    assert np.allclose(
+        region.ES, model.points(mode=1, std=0.5).ES[ukb.surface.region_node_indices(["RVFW"])]
+    )
+
+    # The mean shape is shared with the cached region
+    mean = ukb.surface.generate_region_points(model, names)
+    with pytest.raises(ValueError, match="read-only"):
+        mean.ED[0] = 0.0
+    assert np.allclose(ukb.surface.generate_region_points(model, names).ED, full_mean.ED[nodes])
+
+    with pytest.raises(ValueError, match="Unknown surface"):
+        ukb.surface.region_node_indices(["LA"])
+
+
+def test_atlas_model_repacked_cache(tmp_path, synthetic_atlas_path):
+    model = atlas.AtlasModel.from_file(synthetic_atlas_path, cache_dir=tmp_path)
+    assert atlas.find_repacked(synthetic_atlas_path, tmp_path) is not None
+    assert model.coeff.shape == (model.num_modes, 6 * model.num_nodes)
+    assert model.coeff.flags.c_contiguous
+
+    with patch("h5py.File") as mock_file:
+        loaded = atlas.AtlasModel.from_file(synthetic_atlas_path, cache_dir=tmp_path)
+        mock_file.assert_not_called()
+
+    expected = atlas.generate_points(synthetic_atlas_path, mode=5, std=-1.0)
+    points = loaded.points(mode=5, std=-1.0)
+    assert np.allclose(points.ED, expected.ED)
+    assert np.allclose(points.ES, expected.ES)
+
+
+def test_atlas_model_float32_repacked_cache(tmp_path, synthetic_atlas_path):
+    expected = atlas.AtlasModel.from_file(synthetic_atlas_path, repacked=False)
+    model32 = atlas.AtlasModel.from_file(synthetic_atlas_path, cache_dir=tmp_path, dtype=np.float32)
+    assert model32.dtype == np.float32
+    assert 0.0 < model32.precision_error < 1e-5
+
+    # The shared repack keeps the float64 atlas
+    model64 = atlas.AtlasModel.from_file(synthetic_atlas_path, cache_dir=tmp_path)
+    assert model64.dtype == np.float64
+    assert np.array_equal(model64.coeff, expected.coeff)
+    loaded32 = atlas.AtlasModel.from_file(
+        synthetic_atlas_path, cache_dir=tmp_path, dtype=np.float32
+    )
+    assert loaded32.precision_error == model32.precision_error
+
+    # A repack saved in float32 is not used
+    model32.save(atlas.repacked_path(synthetic_atlas_path, tmp_path))
+    assert atlas.find_repacked(synthetic_atlas_path, tmp_path) is None
+
+
+def test_repack_burns(tmp_path, synthetic_atlas_path):
+    with h5py.File(synthetic_atlas_path, "r") as hdf:
+        burns = {
+            "MU": np.asarray(hdf["MU"]).T,
+            "COEFF": np.asarray(hdf["COEFF"]).T,
+            "LATENT": np.asarray(hdf["LATENT"]).T,
+        }
+    mat_path = tmp_path / "burns.mat"
+    scipy.io.savemat(mat_path, {"pca200": burns})
+    expected = atlas.generate_points_burns(mat_path, mode=2, std=1.0)
+
+    ukb.cli.main(["repack", str(mat_path)])
+    assert atlas.find_repacked(mat_path) == tmp_path / "burns.atlas"
+
+    with patch("scipy.io.loadmat") as mock_loadmat:
+        points = atlas.generate_points_burns(mat_path, mode=2, std=1.0)
+        model = atlas.AtlasModel.from_file(mat_path)
+        mock_loadmat.assert_not_called()
+
+    assert isinstance(model.coeff.base, np.memmap) or isinstance(model.coeff, np.memmap)
+    assert np.allclose(points.ED, expected.ED)
+    assert np.allclose(points.ES, expected.ES)
+    points.ED[0] = 0.0  # generate_points still returns writable arrays
+
+
+def test_atlas_model_float32(synthetic_atlas_path):
+    model64 = atlas.AtlasModel.from_file(synthetic_atlas_path)
+    model32 = atlas.AtlasModel.from_file(synthetic_atlas_path, dtype=np.float32)
+    assert model64.precision_error == 0.0
+    assert 0.0 < model32.precision_error < 1e-5
+
+    score = np.linspace(-1, 1, 10)
+    points = model32.points(score=score)
+    assert points.ED.dtype == np.float32
+    assert np.allclose(points.ED, model64.points(score=score).ED, atol=1e-4)
+    assert model32.points(mode=1, std=2.0).ES.dtype == np.float32
+    assert model32.points_batch(score[None, :]).dtype == np.float32
+
+
+@pytest.mark.parametrize("command", ["surf", "points"])
+def test_cli_precision(command, tmp_path, synthetic_cache_dir):
+    outdir = tmp_path / "out"
+    ukb.cli.main(
+        [command, str(outdir), "--precision", "float32", "--cache-dir", str(synthetic_cache_dir)]
+    )
+    params = json.loads((outdir / "parameters.json").read_text())
+    assert params["precision"] == "float32"
+
+
+def test_atlas_model_truncate(synthetic_atlas_path):
+    model = atlas.AtlasModel.from_file(synthetic_atlas_path)
+    latent = model.latent
+
+    truncated = model.truncate(variance=0.6)
+    k = truncated.num_modes
+    assert latent[:k].sum() / latent.sum() >= 0.6 > latent[: k - 1].sum() / latent.sum()
+    assert truncated.explained_variance == pytest.approx(latent[:k].sum() / latent.sum())
+    assert np.shares_memory(truncated.coeff, model.coeff)
+
+    # The expected error matches the RMS error of random shapes from the atlas
+    scores = np.random.default_rng(4).normal(0, 1, (2000, model.num_modes))
+    errors = model.points_batch(scores) - truncated.points_batch(scores[:, :k])
+    rms = np.sqrt(np.mean(np.sum(errors**2, axis=-1)))
+    assert rms == pytest.approx(truncated.truncation_error, rel=0.05)
+
+    bounded = model.truncate(rms_error=truncated.truncation_error)
+    assert bounded.num_modes == k
+    assert model.truncate(rms_error=0.0).num_modes == model.num_modes
+
+    with pytest.raises(ValueError, match="exactly one"):
+        model.truncate()
+    with pytest.raises(ValueError, match="non-negative"):
+        model.truncate(rms_error=-1.0)
+
+    # Truncating again is relative to the full atlas
+    nested = [model]
+    for variance in [0.9, 0.8, 0.6]:
+        nested.append(nested[-1].truncate(variance=variance))
+    assert np.all(np.diff([m.num_modes for m in nested]) <= 0)
+    assert np.all(np.diff([m.truncation_error for m in nested]) >= 0)
+    assert np.all(np.diff([m.explained_variance for m in nested]) <= 0)
+    assert nested[-1].num_modes == k
+    assert nested[-1].truncation_error == pytest.approx(truncated.truncation_error)
+    assert nested[-1].explained_variance == pytest.approx(truncated.explained_variance)
+    with pytest.raises(ValueError, match="cannot be met"):
+        truncated.truncate(rms_error=0.0)
+
+
+@pytest.mark.parametrize("suffix", [".npy", ".csv", ".tsv"])
+def test_iter_points_from_file(tmp_path, synthetic_atlas_path, suffix):
+    model = atlas.AtlasModel.from_file(synthetic_atlas_path)
+    scores = np.random.default_rng(5).normal(0, 1, (7, 4))
+    path = tmp_path / f"scores{suffix}"
+    if suffix == ".npy":
+        np.save(path, scores)
+    else:
+        np.savetxt(path, scores, delimiter="," if suffix == ".csv" else "\t", header="scores")
+
+    expected = model.points_batch(scores)
+    points = list(atlas.iter_points(model, path, chunk_size=3))
+    assert len(points) == len(scores)
+    for shape, pts in zip(expected, points):
+        assert np.allclose(pts.ED, shape[0])
+        assert np.allclose(pts.ES, shape[1])
+
+    points = list(atlas.iter_points(model, scores, chunk_size=2, case="ES"))
+    assert points[-1].ED is None
+    assert np.allclose(points[-1].ES, expected[-1, 1])
+
+
+def test_pointcloud_scores(tmp_path, synthetic_cache_dir):
+    scores = tmp_path / "scores.csv"
+    np.savetxt(scores, np.eye(3, 5), delimiter=",")
+    outdir = tmp_path / "out"
+    ukb.cli.main(
+        ["points", str(outdir), "--scores", str(scores), "--chunk-size", "2"]
+        + ["--case", "both", "--cache-dir", str(synthetic_cache_dir)]
+    )
+    for index in range(3):
+        for case in ["ED", "ES"]:
+            assert (outdir / f"{case}_pointcloud_{index:06d}.tsv").exists()
+    assert not (outdir / "ED_pointcloud_000003.tsv").exists()
+
+
+def test_project_points(synthetic_atlas_path):
+    model = atlas.AtlasModel.from_file(synthetic_atlas_path)
+    scores = np.random.default_rng(6).normal(0, 1, (4, model.num_modes))
+    shapes = model.points_batch(scores)
+
+    projection = atlas.project_points(model, shapes)
+    assert np.allclose(projection.scores, scores)
+    assert np.allclose(projection.residuals, 0.0, atol=1e-8)
+
+    # Single shape given as Points, fitted with only ED
+    points = model.points(score=scores[0])
+    projection = atlas.project_points(model, points, case="ED")
+    assert projection.scores.shape == (model.num_modes,)
+    assert np.allclose(projection.scores, scores[0])
+
+    projection = atlas.project_points(model, points, n_modes=3)
+    assert projection.scores.shape == (3,)
+    assert projection.residuals > 0
+
+    # Raw node ordering including the unwanted nodes is understood
+    with h5py.File(synthetic_atlas_path, "r") as hdf:
+        raw = atlas.compute_S(hdf, score=scores[1], case="ES").reshape(-1, 3)
+    assert np.allclose(atlas.project_points(model, raw, case="ES").scores, scores[1])
+
+    regularized = atlas.project_points(model, shapes, regularization=1e3)
+    assert np.all(np.linalg.norm(regularized.scores, axis=1) < np.linalg.norm(scores, axis=1))
+
+    with pytest.raises(ValueError, match="Cannot fit points"):
+        atlas.project_points(model, points.ED)
+    # Four ED shapes are not two shapes with both phases
+    with pytest.raises(ValueError, match="Cannot fit points"):
+        atlas.project_points(model, np.stack([points.ED] * 4))
+    assert atlas.project_points(model, np.stack([points.ED] * 4), case="ED").scores.shape == (
+        4,
+        model.num_modes,
+    )
+
+
+def test_surface_topology(tmp_path):
+    points = np.random.default_rng(7).normal(0, 1, (2, 5806, 3))
+    topology = ukb.surface.topology()
+    assert ukb.surface.topology() is topology
+
+    for name, surface in ukb.surface.surfaces.items():
+        faces = ukb.surface.connectivity[surface.face_indices, :]
+        rows = ukb.surface._surface_rows(name, faces)
+        expected = ukb.surface.get_mesh(faces, points[0], rows)
+        surface_points, triangles = topology.extract(name, points)
+        assert np.array_equal(surface_points[0], expected.points)
+        assert np.array_equal(triangles, expected.cells[0].data)
+        assert np.array_equal(surface_points[1], points[1][topology.nodes[name]])
+
+    topology.save(tmp_path / "topology.npz")
+    loaded = ukb.surface.SurfaceTopology.load(tmp_path / "topology.npz")
+    for name in ukb.surface.surfaces:
+        assert np.array_equal(loaded.triangles[name], topology.triangles[name])
+        assert np.array_equal(loaded.nodes[name], topology.nodes[name])
+
+
+def test_cli_startup_does_not_import_heavy_modules():
+    # Measure the imports needed to build the command line interface, like
+    # `ukb-atlas --help`, with python -X importtime
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import ukb.cli; ukb.cli.get_parser()"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported = {
+        line.split("|")[-1].strip().split(".")[0]
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+    assert "ukb" in imported
+    assert not imported & {"h5py", "scipy", "meshio", "pyvista", "vtk", "gmsh"}
+
+    # The binary connectivity matches the text version
+    assert np.array_equal(
+        ukb.surface.connectivity,
+        np.loadtxt(ukb.surface.connectivity_file.with_suffix(".txt"), dtype=int),
+    )
+
+
+@pytest.mark.parametrize("format", ["stl", "ply", "vtp", "npz"])
+def test_write_surface(tmp_path, format):
+    points = np.random.default_rng(8).normal(0, 1, (5806, 3))
+    surface_points, triangles = ukb.surface.topology().extract("LV", points)
+    path = tmp_path / f"LV.{format}"
+    ukb.surface.write_surface(path, surface_points, triangles)
+
+    if format == "npz":
+        data = np.load(path)
+        assert np.array_equal(data["points"], surface_points)
+        assert np.array_equal(data["triangles"], triangles)
+        return
+
+    if format == "vtp":
+        pv = pytest.importorskip("pyvista")
+        mesh = pv.read(path)
+        assert np.allclose(mesh.points, surface_points, atol=1e-6)
+        assert np.array_equal(mesh.regular_faces, triangles)
+        return
+
+    mesh = meshio.read(path)
+    if format == "stl":
+        # STL stores each triangle separately, compare the triangle corners
+        assert np.allclose(mesh.points[mesh.cells[0].data], surface_points[triangles], atol=1e-6)
+    else:
+        assert np.allclose(mesh.points, surface_points, atol=1e-6)
+        assert np.array_equal(mesh.cells[0].data, triangles)
+
+
+def test_face_normals():
+    points = np.array([[0.0, 0.0, 0.0], [2.0, 0.0, 0.0], [0.0, 2.0, 0.0], [0.0, 0.0, 0.0]])
+    normals = ukb.surface.face_normals(points, np.array([[0, 1, 2], [0, 2, 1], [0, 1, 3]]))
+    assert np.allclose(normals, [[0, 0, 1], [0, 0, -1], [0, 0, 0]])
+
+
+@pytest.mark.parametrize("format", ["ply", "npz"])
+def test_generate_surfaces_format(format, tmp_path, synthetic_cache_dir):
+    outdir = tmp_path / "out"
+    ukb.cli.main(["surf", str(outdir), "--format", format, "--cache-dir", str(synthetic_cache_dir)])
+    for name in ukb.surface.surfaces:
+        assert (outdir / f"{name}_ED.{format}").exists()
+        assert not (outdir / f"{name}_ED.stl").exists()
+
+
+def test_surface_container(tmp_path, synthetic_cache_dir):
+    ukb.cli.main(["surf", str(tmp_path / "stl"), "--cache-dir", str(synthetic_cache_dir)])
+    outdir = tmp_path / "container"
+    ukb.cli.main(["surf", str(outdir), "--container", "--cache-dir", str(synthetic_cache_dir)])
+    path = outdir / "ED_surfaces.npz"
+    assert path.exists()
+    assert not (outdir / "LV_ED.stl").exists()
+    assert ukb.surface.find_container(outdir, "ED") == path
+
+    points, triangles = ukb.surface.read_container(path)
+    assert set(triangles) == set(ukb.surface.surfaces)
+    for name, tri in triangles.items():
+        surface_points, local = ukb.surface.topology().extract(name, points)
+        assert np.array_equal(points[tri], surface_points[local])
+
+    for folder in [tmp_path / "stl", outdir]:
+        ukb.cli.main(["clip", str(folder), "--case", "ED"])
+    for name in ["lv", "rv", "epi"]:
+        expected = meshio.read(tmp_path / "stl" / f"{name}_clipped.ply")
+        clipped = meshio.read(outdir / f"{name}_clipped.ply")
+        # The STL reader sorts the points, so compare them in sorted order
+        assert len(clipped.cells_dict["triangle"]) == len(expected.cells_dict["triangle"])
+        expected_points = expected.points[np.lexsort(expected.points.T)]
+        clipped_points = clipped.points[np.lexsort(clipped.points.T)]
+        assert np.allclose(clipped_points, expected_points, atol=1e-4)
+
+
+def test_pipeline_clip(synthetic_atlas_path):
+    points = atlas.generate_points(synthetic_atlas_path, case="ED").ED
+    result = ukb.pipeline.build(points, clip=True)
+    assert result.mesh is None
+    assert set(result.surfaces) == set(ukb.surface.surfaces)
+    assert result.clipped is not None
+    assert set(result.clipped) == {"lv", "rv", "epi"}
+
+    origin = np.array(ukb.clip.default_origin())
+    normal = np.array(ukb.clip.default_normal())
+    for clipped_points, triangles in result.clipped.values():
+        assert triangles.shape[1] == 3
+        assert triangles.max() < len(clipped_points)
+        assert np.all((clipped_points - origin) @ normal <= 1e-6)
+
+
+def test_clip_plane(sphere_surfaces):
+    import pyvista as pv
+
+    points, surfaces = sphere_surfaces
+    triangles = np.concatenate(list(surfaces.values()))
+    origin, normal = np.array([1.0, 2.0, 3.0]), np.array([0.3, -0.5, 0.8])
+    result = ukb.clip.clip_plane(points, triangles, origin, normal)
+
+    faces = np.hstack([np.full((len(triangles), 1), 3), triangles]).ravel()
+    expected = pv.PolyData(points, faces).clip(normal=normal, origin=origin, invert=True)
+    assert len(result.points) == expected.n_points
+    assert len(result.triangles) == expected.triangulate().n_cells
+    faces = np.hstack([np.full((len(result.triangles), 1), 3), result.triangles]).ravel()
+    assert np.isclose(pv.PolyData(result.points, faces).area, expected.area)
+
+    # A single closed cut loop on the plane, running along the edges of the
+    # clipped triangles in the same direction
+    assert len(result.boundary) == 1
+    loop = result.boundary[0]
+    distance = (result.points[loop] - origin) @ (normal / np.linalg.norm(normal))
+    assert np.allclose(distance, 0.0)
+    triangle_edges = {
+        (tri[i], tri[(i + 1) % 3]) for tri in result.triangles.tolist() for i in range(3)
+    }
+    assert set(zip(loop.tolist(), np.roll(loop, -1).tolist())) <= triangle_edges
+
+
+def test_clip_plane_through_vertices():
+    # Two triangles of a square cut along the diagonal through vertices 0 and 2
+    points = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [1.0, 1.0, 0.0], [0.0, 1.0, 0.0]])
+    triangles = np.array([[0, 1, 2], [0, 2, 3]])
+    result = ukb.clip.clip_plane(points, triangles, origin=[0, 0, 0], normal=[-1, 1, 0])
+    assert np.array_equal(result.points, points[:3])
+    assert np.array_equal(result.triangles, [[0, 1, 2]])
+    assert [b.tolist() for b in result.boundary] == [[2, 0]]
+
+
+@pytest.mark.parametrize(
+    "edges, expected",
+    [
+        ([(0, 1), (1, 2), (2, 0), (3, 4), (4, 5)], [[3, 4, 5], [0, 1, 2]]),
+        # Two loops through point 0
+        ([(0, 1), (1, 0), (0, 3), (3, 0)], [[0, 3], [0, 1]]),
+        # A path through a loop at point 0
+        ([(5, 0), (0, 1), (1, 0), (0, 6)], [[5, 0, 6], [0, 1]]),
+    ],
+)
+def test_clip_chain(edges, expected):
+    start, end = np.array(edges).T
+    curves = ukb.clip._chain(start, end)
+    assert [c.tolist() for c in curves] == expected
+
+
+def test_clip_shapes(tmp_path, synthetic_atlas_path):
+    points = atlas.generate_points(synthetic_atlas_path, case="both")
+    shapes = np.stack([points.ED, points.ES])
+    origins = np.array([ukb.clip.default_origin(), np.add(ukb.clip.default_origin(), 5.0)])
+    normals = np.array([ukb.clip.default_normal(), (0.0, 0.0, 1.0)])
+    outfile = tmp_path / "clipped.npz"
+    clipped = ukb.clip.clip_shapes(
+        shapes, origins, normals, smooth=False, outfile=outfile, per_shape=False
+    )
+    assert len(clipped) == 2
+    assert all(len(planes) == 2 for planes in clipped)
+
+    for i, shape in enumerate(shapes):
+        surfaces = ukb.pipeline.extract_surfaces(shape)
+        for j, (origin, normal) in enumerate(zip(origins, normals)):
+            expected = ukb.clip.clip_surfaces(
+                *(surfaces[name] for name in ["LV", "RV", "RVFW", "EPI"]),
+                origin=origin,
+                normal=normal,
+                smooth=False,
+            )
+            for name, c in clipped[i][j].items():
+                assert len(c.triangles) == len(expected[name].triangles)
+                assert np.allclose(
+                    np.sort(c.points, axis=0), np.sort(expected[name].points, axis=0)
+                )
+
+    stored, stored_origins, stored_normals = ukb.clip.read_clipped_container(outfile)
+    assert stored_origins.shape == stored_normals.shape == (2, 2, 3)
+    assert np.allclose(stored_origins, origins)
+    assert np.allclose(np.linalg.norm(stored_normals, axis=-1), 1.0)
+    for i in range(2):
+        for j in range(2):
+            for name, c in clipped[i][j].items():
+                assert np.array_equal(stored[i][j][name][0], c.points)
+                assert np.array_equal(stored[i][j][name][1], c.triangles)
+
+    # Smoothing a single shape gives the same RV as clip_surfaces
+    (smoothed,) = ukb.clip.clip_shapes(points.ED, origins[:1], normals[:1], smooth_iter=10)
+    surfaces = ukb.pipeline.extract_surfaces(points.ED)
+    expected = ukb.clip.clip_surfaces(
+        *(surfaces[name] for name in ["LV", "RV", "RVFW", "EPI"]),
+        origin=origins[0],
+        normal=normals[0],
+        smooth_iter=10,
+    )
+    assert np.allclose(
+        np.sort(smoothed[0]["rv"].points, axis=0), np.sort(expected["rv"].points, axis=0)
+    )
+
+
+def test_base_plane(synthetic_atlas_path):
+    points = atlas.generate_points(synthetic_atlas_path, case="both")
+    shapes = np.stack([points.ED, points.ES])
+    top = ukb.surface.topology()
+    nodes = np.unique(np.concatenate([top.global_triangles(name) for name in ukb.surface.valves]))
+    default = np.array(ukb.clip.default_normal())
+    origins = np.array([[1.0, 2.0, 3.0], [-4.0, 0.0, 10.0]])
+    # The second normal points towards the apex, which the fit flips
+    normals = np.array([default, -np.array([0.0, 0.6, 0.8])])
+    for shape, origin, normal in zip(shapes, origins, normals):
+        valve_points = shape[nodes]
+        shape[nodes] = valve_points - np.outer((valve_points - origin) @ normal, normal)
+
+    fitted_origins, fitted_normals = ukb.clip.base_plane(shapes)
+    assert fitted_normals.shape == (2, 3)
+    assert np.allclose(fitted_normals, [default, [0.0, 0.6, 0.8]])
+    assert np.allclose(np.einsum("ij,ij->i", fitted_origins - origins, fitted_normals), 0.0)
+
+    origin, normal = ukb.clip.base_plane(shapes[0], offset=2.0)
+    assert np.allclose(origin, fitted_origins[0] - 2.0 * default)
+    assert np.allclose(normal, default)
+
+    # One plane per shape
+    clipped = ukb.clip.clip_shapes(shapes, fitted_origins, fitted_normals, smooth=False)
+    assert all(len(planes) == 1 for planes in clipped)
+    for planes, origin, normal in zip(clipped, fitted_origins, fitted_normals):
+        for c in planes[0].values():
+            assert np.all((c.points - origin) @ normal <= 1e-6)
+
+
+def test_clip_auto_plane(tmp_path, synthetic_cache_dir):
+    args = ["--cache-dir", str(synthetic_cache_dir)]
+    ukb.cli.main(["surf", str(tmp_path / "stl")] + args)
+    ukb.cli.main(["surf", str(tmp_path / "container"), "--container"] + args)
+    points, _ = ukb.surface.read_container(tmp_path / "container" / "ED_surfaces.npz")
+    origin, normal = ukb.clip.base_plane(points, offset=1.0)
+    for folder in [tmp_path / "stl", tmp_path / "container"]:
+        ukb.cli.main(["clip", str(folder), "--auto-plane", "--plane-offset", "1.0"])
+        for name in ["lv", "rv", "epi"]:
+            clipped = meshio.read(folder / f"{name}_clipped.ply")
+            assert np.all((clipped.points - origin) @ normal <= 1e-4)
+
+
+def grid_surface(n: int = 11) -> tuple[np.ndarray, np.ndarray]:
+    """Triangulated unit square in the xy-plane with ``n x n`` points."""
+    x, y = np.meshgrid(np.linspace(0, 1, n), np.linspace(0, 1, n))
+    points = np.column_stack([x.ravel(), y.ravel(), np.zeros(n * n)])
+    index = np.arange(n * n).reshape(n, n)
+    a, b, c, d = index[:-1, :-1], index[:-1, 1:], index[1:, 1:], index[1:, :-1]
+    triangles = np.concatenate([np.stack([a, b, c], -1), np.stack([a, c, d], -1)]).reshape(-1, 3)
+    return points, triangles
+
+
+@pytest.mark.parametrize("weights", ["uniform", "cotangent"])
+def test_laplacian_smoothing(weights):
+    points, triangles = grid_surface()
+    rng = np.random.default_rng(3)
+    noisy = points + rng.normal(scale=0.01, size=points.shape)
+    smoothing = ukb.smooth.LaplacianSmoothing.compute(
+        triangles, n_iter=20, weights=weights, reference=points
+    )
+    W = ukb.smooth.laplacian(triangles, weights=weights, points=points)
+    assert np.allclose(W.sum(axis=1), 1.0)
+
+    smoothed = smoothing(noisy)
+    assert np.std(smoothed[:, 2]) < 0.5 * np.std(noisy[:, 2])
+    # The corners of the square are fixed, and the other boundary points
+    # move along the boundary
+    corners = [0, 10, 110, 120]
+    assert np.array_equal(smoothed[corners], noisy[corners])
+    flat = smoothing(points)
+    edge = np.flatnonzero(points[:, 1] == 0)
+    assert np.allclose(flat[edge, 1:], 0.0)
+
+    batch = smoothing(np.stack([noisy, 2 * noisy]))
+    assert batch.shape == (2,) + points.shape
+    assert np.allclose(batch[0], smoothed)
+    assert np.allclose(batch[1], 2 * smoothed)
+    assert np.allclose(smoothing.precomposed()(noisy), smoothed)
+
+
+def test_laplacian_smoothing_like_vtk():
+    pv = pytest.importorskip("pyvista")
+    sphere = pv.Sphere(radius=20.0, theta_resolution=40, phi_resolution=40).triangulate().clean()
+    cap = sphere.clip(normal=(0.2, 0.3, 1.0), origin=(0.0, 0.0, 5.0)).triangulate().clean()
+    rng = np.random.default_rng(4)
+    cap.points = cap.points + rng.normal(scale=0.5, size=cap.points.shape)
+    triangles = cap.faces.reshape(-1, 4)[:, 1:]
+    expected = np.asarray(cap.smooth(n_iter=100, relaxation_factor=0.1).points)
+
+    smoothing = ukb.smooth.LaplacianSmoothing.compute(triangles, reference=cap.points)
+    smoothed = smoothing(cap.points)
+    # VTK updates the points one by one, so the results differ slightly
+    assert np.abs(smoothed - expected).max() < 0.1 * np.abs(cap.points - expected).max()
+
+
+def test_merge_points():
+    rng = np.random.default_rng(2)
+    points = rng.random((10, 3))
+    triangles = np.array([[0, 1, 2], [2, 3, 4], [5, 6, 7], [7, 8, 9], [9, 0, 5]])
+    # Give each surface its own copy of the points
+    surfaces = {
+        "a": (points[:8].copy(), triangles[:3]),
+        "b": (points.copy() + 1e-12, triangles[3:]),
+    }
+    merged_points, merged = ukb.surface.merge_points(surfaces)
+    assert merged_points.shape == (10, 3)
+    for name, (surface_points, tri) in surfaces.items():
+        assert np.allclose(merged_points[merged[name]], surface_points[tri])
+
+
+def test_generate_mesh_from_arrays(tmp_path, sphere_surfaces):
+    points, surfaces = sphere_surfaces
+
+    mesh = ukb.mesh.generate_mesh(points, surfaces)
+    assert mesh.tetrahedra.shape[1] == 4
+    assert mesh.tetrahedra.max() < len(mesh.points)
+    assert set(mesh.markers) == set(ukb.mesh.physical_groups)
+    assert set(np.unique(mesh.triangle_markers)) == set(mesh.markers.values())
+    # Shared nodes are added once, so no surface nodes are duplicated
+    assert len(np.unique(mesh.points[np.unique(mesh.triangles)], axis=0)) == len(
+        np.unique(mesh.triangles)
+    )
+
+    ukb.mesh.write_mesh(mesh, tmp_path / "mesh.msh")
+    written = meshio.read(tmp_path / "mesh.msh")
+    assert np.allclose(written.points, mesh.points)
+    assert len(written.cells_dict["tetra"]) == len(mesh.tetrahedra)
+    assert set(written.field_data) == {*mesh.markers, "Wall"}
+
+
+def test_morph_template_affine():
+    from scipy.spatial import Delaunay
+
+    rng = np.random.default_rng(3)
+    corners = np.array([[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)], dtype=float)
+    points = np.concatenate([corners, rng.uniform(0.1, 0.9, size=(50, 3))])
+    tetrahedra = Delaunay(points).simplices
+    mesh = ukb.mesh.VolumeMesh(
+        points=points,
+        tetrahedra=tetrahedra,
+        triangles=np.zeros((0, 3), dtype=int),
+        triangle_markers=np.zeros(0, dtype=int),
+        markers={},
+    )
+    # The corners are the boundary nodes, each mapped to a single "atlas" node
+    boundary = np.arange(8)
+    template = ukb.morph.MeshTemplate(
+        mesh=mesh,
+        reference=corners,
+        boundary=boundary,
+        atlas_nodes=np.column_stack([boundary] * 3),
+        weights=np.tile([1.0, 0.0, 0.0], (8, 1)),
+    )
+    K = ukb.morph.stiffness_matrix(points, tetrahedra)
+    assert np.allclose(K.sum(axis=1), 0.0)
+
+    # A harmonic extension reproduces affine maps exactly
+    A = np.array([[1.2, 0.1, 0.0], [0.0, 0.9, 0.2], [0.1, 0.0, 1.1]])
+    b = np.array([1.0, -2.0, 0.5])
+    morphed = template.morph(corners @ A.T + b)
+    assert np.allclose(morphed.points, points @ A.T + b)
+    assert len(template.inverted(morphed)) == 0
+
+    # Reflecting the shape inverts every tetrahedron
+    reflected = template.morph(corners * [-1.0, 1.0, 1.0])
+    assert len(template.inverted(reflected)) == len(tetrahedra)
+
+
+def test_mesh_session_options(caplog, sphere_surfaces):
+    points, surfaces = sphere_surfaces
+
+    import gmsh
+
+    caplog.set_level("INFO", logger="ukb.mesh")
+    with ukb.mesh.session():
+        meshes = [
+            ukb.mesh.generate_mesh(points, surfaces, threads=2, algorithm3d=algorithm)
+            for algorithm in ["delaunay", "hxt"]
+        ]
+        assert gmsh.isInitialized()
+        assert gmsh.option.getNumber("General.NumThreads") == 2
+        assert gmsh.option.getNumber("Mesh.Algorithm3D") == ukb.mesh.algorithms_3d["hxt"]
+    assert not gmsh.isInitialized()
+    for mesh in meshes:
+        assert set(mesh.markers) == set(ukb.mesh.physical_groups)
+    assert caplog.text.count("Wall time mesh") == 2
+
+
+def write_sphere_containers(folder, sphere_surfaces):
+    points, surfaces = sphere_surfaces
+    # write_container uses the atlas topology, so write the container by hand
+    for case, scale in [("ED", 1.0), ("ES", 0.8)]:
+        arrays = {f"triangles_{name}": tri for name, tri in surfaces.items()}
+        np.savez(
+            folder / f"{case}_surfaces.npz",
+            points=points * scale,
+            names=np.array(list(surfaces)),
+            **arrays,
+        )
+
+
+def test_mesh_template_options(tmp_path, sphere_surfaces):
+    write_sphere_containers(tmp_path, sphere_surfaces)
+    points, _ = sphere_surfaces
+    mesh = ukb.mesh.VolumeMesh(
+        points=points,
+        tetrahedra=np.zeros((0, 4), dtype=int),
+        triangles=np.zeros((0, 3), dtype=int),
+        triangle_markers=np.zeros(0, dtype=int),
+        markers={},
+    )
+    template = ukb.morph.MeshTemplate(
+        mesh=mesh,
+        reference=points,
+        boundary=np.zeros(0, dtype=int),
+        atlas_nodes=np.zeros((0, 3), dtype=int),
+        weights=np.zeros((0, 3)),
+        options={"char_length_max": 5.0, "char_length_min": 5.0},
+    )
+    path = tmp_path / "template.npz"
+    template.save(path)
+    assert ukb.morph.MeshTemplate.load(path).options == template.options
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data if name != "options"}
+    np.savez(tmp_path / "no_options.npz", **arrays)
+    with pytest.raises(ValueError, match="does not store the meshing options"):
+        ukb.morph.MeshTemplate.load(tmp_path / "no_options.npz")
+
+    with pytest.raises(ValueError, match="char_length_max=5.0, not 3.0"):
+        ukb.cli.main(["mesh", str(tmp_path), "--template", str(path), "--char_length_max", "3"])
+    with pytest.raises(ValueError, match="not supported for clipped meshes"):
+        ukb.cli.main(["mesh", str(tmp_path), "--template", str(path), "--clipped"])
+
+
+def test_mesh_both_cases_in_parallel(tmp_path, sphere_surfaces):
+    write_sphere_containers(tmp_path, sphere_surfaces)
+    ukb.cli.main(["mesh", str(tmp_path), "--case", "both", "--no-cache"])
+    for case in ["ED", "ES"]:
+        assert (tmp_path / f"{case}.msh").exists()
+        assert (
+            f"Created mesh {tmp_path / f'{case}.msh'}"
+            in (tmp_path / f"mesh_{case}.log").read_text()
+        )
+
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    with pytest.raises(RuntimeError, match="Meshing failed for ED"):
+        ukb.mesh.mesh_cases(ukb.mesh.create_mesh, empty, ["ED"])
+
+
+def test_clip_both_cases(tmp_path, synthetic_cache_dir):
+    ukb.cli.main(["surf", str(tmp_path), "--case", "both", "--cache-dir", str(synthetic_cache_dir)])
+    ukb.cli.main(["clip", str(tmp_path), "--case", "both"])
+    for case in ["ED", "ES"]:
+        for name in ["lv", "rv", "epi"]:
+            path = tmp_path / f"{name}_clipped_{case}.ply"
+            assert path.exists()
+            assert ukb.clip.find_clipped(tmp_path, name, case) == path
+
+
+def test_mesh_cache(tmp_path, sphere_surfaces, monkeypatch, caplog):
+    monkeypatch.setenv("UKB_CACHE_DIR", str(tmp_path / "cache"))
+    folder = tmp_path / "data"
+    folder.mkdir()
+    write_sphere_containers(folder, sphere_surfaces)
+    caplog.set_level("INFO", logger="ukb")
+
+    ukb.cli.main(["mesh", str(folder)])
+    entries = list((tmp_path / "cache" / "meshes").glob("*.msh"))
+    assert len(entries) == 1
+    assert entries[0].read_bytes() == (folder / "ED.msh").read_bytes()
+    assert "Using cached mesh" not in caplog.text
+
+    ukb.cli.main(["mesh", str(folder)])
+    assert "Using cached mesh" in caplog.text
+    assert (folder / "ED.msh").samefile(entries[0])
+
+    # Other options give another entry, and rewriting the output file does
+    # not change the cached mesh it was linked to
+    cached = entries[0].read_bytes()
+    ukb.cli.main(["mesh", str(folder), "--char_length_max", "4.0", "--char_length_min", "4.0"])
+    assert len(list((tmp_path / "cache" / "meshes").glob("*.msh"))) == 2
+    assert entries[0].read_bytes() == cached
+    ukb.cli.main(["mesh", str(folder), "--threads", "2"])
+    assert len(list((tmp_path / "cache" / "meshes").glob("*.msh"))) == 3
+    caplog.clear()
+    ukb.cli.main(["mesh", str(folder), "--no-cache"])
+    assert "Using cached mesh" not in caplog.text
+
+
+def test_mesh_cache_eviction(tmp_path):
+    cache = ukb.cache.MeshCache(tmp_path / "cache", max_size=250)
+    inputs = []
+    for i in range(3):
+        path = tmp_path / f"input_{i}.stl"
+        path.write_bytes(bytes([i]) * 10)
+        inputs.append(path)
+    keys = [cache.key([path], char_length_max=5.0) for path in inputs]
+    assert len(set(keys)) == 3
+    assert cache.key([inputs[0]], char_length_max=5.0) == keys[0]
+    assert cache.key([inputs[0]], char_length_max=4.0) != keys[0]
+
+    mesh = tmp_path / "mesh.msh"
+    for i, key in enumerate(keys[:2]):
+        mesh.write_bytes(bytes([i]) * 100)
+        cache.put(key, mesh)
+        os.utime(cache.path(key), (i, i))
+    # Using the first entry makes the second the least recently used
+    assert cache.get(keys[0], tmp_path / "out.msh")
+    mesh.write_bytes(bytes([2]) * 100)
+    cache.put(keys[2], mesh)
+
+    assert cache.path(keys[0]).exists()
+    assert not cache.path(keys[1]).exists()
+    assert cache.path(keys[2]).exists()
+    assert not cache.get(keys[1], tmp_path / "out.msh")
+
+
+def test_run_skips_up_to_date_stages(tmp_path, synthetic_cache_dir):
+    def fake_generate_mesh(points, triangles, outfile, clipped=False, **kwargs):
+        # The surfaces are added to gmsh in this order
+        order = ukb.mesh.clipped_surface_order if clipped else ukb.mesh.surface_order
+        assert set(triangles) == set(order)
+        assert all(tri.max() < len(points) for tri in triangles.values())
+        outfile.write_text(f"{len(points)} {kwargs['char_length_max']}")
+
+    args = ["run", str(tmp_path), "--cache-dir", str(synthetic_cache_dir)]
+    container = tmp_path / "ED_surfaces.npz"
+    with patch("ukb.mesh.generate_mesh", side_effect=fake_generate_mesh) as generate:
+        ukb.cli.main(args)
+        assert generate.call_count == 1
+        assert (tmp_path / "ED.msh").exists()
+        parameters = json.loads((tmp_path / "parameters.json").read_text())
+        assert parameters["mode"] == -1
+        assert set(parameters["stages"]) == {"surfaces:ED", "mesh:ED"}
+        assert set(parameters["stages"]["mesh:ED"]["inputs"]) == {"ED_surfaces.npz"}
+        mtime = container.stat().st_mtime_ns
+
+        # Nothing changed, and no file is read to find out
+        with patch("ukb.run.file_hash", side_effect=ukb.cache.file_hash) as file_hash:
+            ukb.cli.main(args)
+            assert file_hash.call_count == 0
+        assert generate.call_count == 1
+
+        # Touching a file only hashes it again
+        os.utime(container)
+        with patch("ukb.run.file_hash", side_effect=ukb.cache.file_hash) as file_hash:
+            ukb.cli.main(args)
+            assert file_hash.call_count == 1
+        assert generate.call_count == 1
+        mtime = container.stat().st_mtime_ns
+
+        # Only the mesh depends on the characteristic length
+        ukb.cli.main(args + ["--char_length_max", "3"])
+        assert generate.call_count == 2
+        assert container.stat().st_mtime_ns == mtime
+
+        ukb.cli.main(args + ["--char_length_max", "3", "--clip"])
+        ukb.cli.main(args + ["--char_length_max", "3", "--clip"])
+        assert generate.call_count == 3
+        assert (tmp_path / "ED_clipped.msh").exists()
+        for name in ["lv", "rv", "epi"]:
+            assert (tmp_path / f"{name}_clipped_ED.ply").exists()
+        parameters = json.loads((tmp_path / "parameters.json").read_text())
+        assert {"clip:ED", "mesh:ED_clipped", "mesh:ED"} <= set(parameters["stages"])
+
+        # Outputs that were changed are recreated
+        (tmp_path / "ED.msh").write_text("modified")
+        ukb.cli.main(args + ["--char_length_max", "3"])
+        assert generate.call_count == 4
+
+        # A new shape recreates everything downstream
+        ukb.cli.main(args + ["--char_length_max", "3", "--clip", "--mode", "1"])
+        assert generate.call_count == 5
+        assert container.stat().st_mtime_ns != mtime